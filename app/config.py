@@ -1,7 +1,7 @@
 from functools import lru_cache
 from pydantic import Field
 from pydantic_settings import BaseSettings
-from typing import Optional
+from typing import Literal, Optional
 
 
 class Settings(BaseSettings):
@@ -15,11 +15,59 @@ class Settings(BaseSettings):
 
     # Database
     database_url: str = Field(default="sqlite:///./data/app.db", env="DATABASE_URL")
+    # SQLite tuning (WAL journal, synchronous=NORMAL are always on for file databases)
+    sqlite_busy_timeout_ms: int = Field(default=5000)
+    sqlite_mmap_size: int = Field(default=256 * 1024 * 1024)
+    sqlite_cache_size_kb: int = Field(default=64 * 1024)
+    sqlite_pool_size: int = Field(default=8)
+    # Serialize SQLite writes through one writer connection with group commits
+    sqlite_single_writer: bool = Field(default=True)
+    db_writer_batch_size: int = Field(default=64)
 
     # Anthropic
     anthropic_api_key: Optional[str] = Field(default=None, env="ANTHROPIC_API_KEY")
     anthropic_model: str = Field(default="claude-3-7-sonnet-20250219")
     enable_computer_use: bool = Field(default=True)
+    # Stream responses: text arrives as assistant_delta events while the model generates
+    anthropic_stream: bool = Field(default=True)
+    # Shared connection pool for Anthropic API clients (HTTP/2 needs the h2 package)
+    anthropic_max_connections: int = Field(default=20)
+    anthropic_max_keepalive_connections: int = Field(default=10)
+    anthropic_keepalive_expiry: float = Field(default=60.0)
+    anthropic_http2: bool = Field(default=True)
+    # Screenshot encoding sent to the model, e.g. "png", "png-palette", "jpeg:70",
+    # "webp:80" (None: the tool version's default); a session can override it with
+    # "screenshot_encoding" in its metadata
+    screenshot_encoding: Optional[str] = Field(default=None)
+
+    # Agent worker pool
+    agent_max_workers: int = Field(default=4, env="AGENT_MAX_WORKERS")
+    agent_max_queued: int = Field(default=100, env="AGENT_MAX_QUEUED")
+    conversation_cache_max_sessions: int = Field(default=256)
+    conversation_cache_max_bytes: int = Field(default=256 * 1024 * 1024)
+
+    # WebSocket fan-out: per-connection send queue and what to do when it fills up
+    stream_send_queue_size: int = Field(default=256)
+    stream_slow_consumer_policy: Literal["drop", "coalesce", "disconnect"] = Field(default="coalesce")
+    # Resume (?since=<seq>): recent events kept per session, sessions kept, longest replay
+    stream_replay_buffer: int = Field(default=512)
+    stream_replay_sessions: int = Field(default=256)
+    stream_replay_max_events: int = Field(default=2000)
+    # Carries stream events between API nodes: "inprocess" (single node), "redis",
+    # "postgres" (LISTEN/NOTIFY), or "memory" (in-process fake for tests)
+    stream_backend: Literal["inprocess", "redis", "postgres", "memory"] = Field(default="inprocess")
+    redis_url: str = Field(default="redis://localhost:6379/0", env="REDIS_URL")
+    # Defaults to database_url when that is Postgres
+    stream_postgres_dsn: Optional[str] = Field(default=None)
+    stream_channel_prefix: str = Field(default="cua_stream_")
+    # Events waiting to be sent to the redis/postgres backend; more are dropped
+    stream_backend_max_queued: int = Field(default=10000)
+    # Connection lifecycle: ping idle clients, drop ones silent for too long (seconds)
+    stream_heartbeat_interval: float = Field(default=20.0)
+    stream_heartbeat_timeout: float = Field(default=60.0)
+    stream_max_subscriptions: int = Field(default=32)
+    # Width of screenshot thumbnails for images=thumb subscribers
+    stream_thumbnail_width: int = Field(default=320)
 
     # VNC / Desktop
     vnc_host: str = Field(default="vnc")
@@ -28,9 +76,33 @@ class Settings(BaseSettings):
     vnc_password: str = Field(default="vncpassword", env="VNC_PASSWORD")
     media_dir: str = Field(default="data/media")
 
+    # Warm pool of pre-started VM containers; opt-in, since every pooled
+    # container holds its CPU and memory limits while idle (0 disables it)
+    vm_pool_size: int = Field(default=0)
+    # Run in a booting container until it exits 0: X display and noVNC/VNC ports up
+    vm_health_command: str = Field(
+        default='xdpyinfo -display ":${DISPLAY_NUM:-1}" >/dev/null 2>&1 && nc -z localhost 6080 && nc -z localhost 5900'
+    )
+    vm_health_timeout: float = Field(default=60.0)
+    vm_health_interval: float = Field(default=0.5)
+    # How often idle pool containers are re-checked (seconds)
+    vm_pool_check_interval: float = Field(default=30.0)
+    # Per-container resource limits (None/0 for no limit); vm_memory is a docker size like "3g"
+    vm_cpus: Optional[float] = Field(default=1.0)
+    vm_memory: Optional[str] = Field(default="3g")
+    vm_pids_limit: Optional[int] = Field(default=1024)
+    # Stop the VM of a session without messages or agent steps for this long (seconds, 0 disables)
+    vm_idle_timeout: float = Field(default=1800.0)
+    vm_reap_interval: float = Field(default=60.0)
+
     # MongoDB (optional for event storage)
     mongodb_uri: Optional[str] = Field(default=None, env="MONGODB_URI")
     mongodb_db: str = Field(default="computer_use")
+    event_store_batch_size: int = Field(default=200)
+    event_store_flush_interval: float = Field(default=0.25)  # seconds
+    event_store_max_queued: int = Field(default=10000)
+    # "block" makes awaited appends wait for room; sync appends always drop when full
+    event_store_overflow_policy: Literal["drop", "block"] = Field(default="drop")
 
     class Config:
         env_file = ".env"
@@ -1,27 +1,77 @@
-from sqlalchemy import create_engine
+import asyncio
+from typing import Any, List, Optional, Set, Tuple
+
+from sqlalchemy import create_engine, event, inspect
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import sessionmaker, declarative_base
-from sqlalchemy.pool import NullPool
+from sqlalchemy.pool import AsyncAdaptedQueuePool, StaticPool
+from sqlalchemy.schema import CreateColumn
 from .config import get_settings
 
+try:
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+except Exception:  # pragma: no cover - needs greenlet
+    create_async_engine = None  # type: ignore
+
 
 settings = get_settings()
 
-is_sqlite = settings.database_url.startswith("sqlite")
+# Async drivers selectable through DATABASE_URL, mapped to the sync driver used
+# for table creation and the remaining sync routes
+ASYNC_DRIVERS = {
+    "sqlite+aiosqlite": "sqlite",
+    "postgresql+asyncpg": "postgresql+psycopg2",
+}
+
+url = make_url(settings.database_url)
+use_async = url.drivername in ASYNC_DRIVERS
+sync_url = url.set(drivername=ASYNC_DRIVERS[url.drivername]) if use_async else url
+
+is_sqlite = url.get_backend_name() == "sqlite"
 connect_args = {"check_same_thread": False} if is_sqlite else {}
 
-if is_sqlite:
-    # Avoid connection pool contention/timeouts with SQLite by disabling pooling
+# In-memory SQLite databases live and die with their connection, so every
+# session shares a single one
+is_sqlite_memory = is_sqlite and url.database in (None, "", ":memory:")
+
+
+def _sqlite_pragmas(dbapi_connection, connection_record):
+    """Tune every new SQLite connection for concurrent readers and one writer."""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={settings.sqlite_busy_timeout_ms}")
+    cursor.execute(f"PRAGMA mmap_size={settings.sqlite_mmap_size}")
+    # Negative cache_size is in KiB
+    cursor.execute(f"PRAGMA cache_size=-{settings.sqlite_cache_size_kb}")
+    cursor.close()
+
+
+if is_sqlite and is_sqlite_memory:
+    engine = create_engine(
+        sync_url,
+        echo=False,
+        future=True,
+        connect_args=connect_args,
+        poolclass=StaticPool,
+    )
+elif is_sqlite:
+    # WAL lets readers run alongside the writer, so reads share a small pool;
+    # writes are serialized through services/db_writer.py
     engine = create_engine(
-        settings.database_url,
+        sync_url,
         echo=False,
         future=True,
         connect_args=connect_args,
-        poolclass=NullPool,
+        pool_size=settings.sqlite_pool_size,
+        max_overflow=0,
+        pool_timeout=30,
     )
+    event.listen(engine, "connect", _sqlite_pragmas)
 else:
     # Bigger pool for Postgres
     engine = create_engine(
-        settings.database_url,
+        sync_url,
         echo=False,
         future=True,
         pool_size=10,
@@ -32,8 +82,60 @@ else:
 
 SessionLocal = sessionmaker(bind=engine, autocommit=False, autoflush=False, future=True)
 
+async_engine = None
+AsyncSessionLocal = None
+if use_async:
+    if create_async_engine is None:
+        raise RuntimeError(f"{url.drivername} requires SQLAlchemy's asyncio extension (greenlet)")
+    if is_sqlite_memory:
+        async_engine = create_async_engine(url, echo=False, poolclass=StaticPool)
+    elif is_sqlite:
+        async_engine = create_async_engine(
+            url,
+            echo=False,
+            poolclass=AsyncAdaptedQueuePool,
+            pool_size=settings.sqlite_pool_size,
+            max_overflow=0,
+        )
+        event.listen(async_engine.sync_engine, "connect", _sqlite_pragmas)
+    else:
+        async_engine = create_async_engine(
+            url,
+            echo=False,
+            pool_size=10,
+            max_overflow=20,
+            pool_pre_ping=True,
+            pool_recycle=1800,
+        )
+    # Objects stay usable after commit; lazy refreshes are not possible under asyncio
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 Base = declarative_base()
 
+
+def init_db() -> Set[Tuple[str, str]]:
+    """Create missing tables, columns and indexes; returns the (table, column) pairs added.
+
+    create_all only creates whole tables, so columns and indexes added to
+    existing tables since the database was created are added here.
+    """
+    Base.metadata.create_all(bind=engine)
+    added = set()
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    ddl = CreateColumn(column).compile(dialect=engine.dialect)
+                    conn.exec_driver_sql(f"ALTER TABLE {table.name} ADD COLUMN {ddl}")
+                    added.add((table.name, column.name))
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+    return added
+
+
 def get_db():
     db = SessionLocal()
     try:
@@ -42,3 +144,76 @@ def get_db():
         db.close()
 
 
+class AsyncDB:
+    """Awaitable database session for async routes and the agent runner.
+
+    Wraps an AsyncSession when DATABASE_URL names an async driver
+    (sqlite+aiosqlite, postgresql+asyncpg). Otherwise it wraps a regular
+    Session and runs each database call in a worker thread, so the event loop
+    never waits on the database either way.
+    """
+
+    def __init__(self):
+        if AsyncSessionLocal is not None:
+            self._async = AsyncSessionLocal()
+            self._sync = None
+        else:
+            self._async = None
+            self._sync = SessionLocal(expire_on_commit=False)
+
+    async def _run(self, fn, *args) -> Any:
+        return await asyncio.to_thread(fn, *args)
+
+    async def get(self, model, ident) -> Optional[Any]:
+        if self._async is not None:
+            return await self._async.get(model, ident)
+        return await self._run(self._sync.get, model, ident)
+
+    async def scalars(self, stmt) -> List[Any]:
+        if self._async is not None:
+            return list((await self._async.scalars(stmt)).all())
+        return await self._run(lambda: list(self._sync.scalars(stmt).all()))
+
+    async def execute(self, stmt) -> List[Any]:
+        """Execute a statement and return all rows."""
+        if self._async is not None:
+            return list((await self._async.execute(stmt)).all())
+        return await self._run(lambda: list(self._sync.execute(stmt).all()))
+
+    def add(self, obj) -> None:
+        (self._async or self._sync).add(obj)
+
+    def add_all(self, objs) -> None:
+        (self._async or self._sync).add_all(objs)
+
+    async def commit(self) -> None:
+        if self._async is not None:
+            await self._async.commit()
+        else:
+            await self._run(self._sync.commit)
+
+    async def rollback(self) -> None:
+        if self._async is not None:
+            await self._async.rollback()
+        else:
+            await self._run(self._sync.rollback)
+
+    async def refresh(self, obj) -> None:
+        if self._async is not None:
+            await self._async.refresh(obj)
+        else:
+            await self._run(self._sync.refresh, obj)
+
+    async def close(self) -> None:
+        if self._async is not None:
+            await self._async.close()
+        else:
+            await self._run(self._sync.close)
+
+
+async def get_async_db():
+    db = AsyncDB()
+    try:
+        yield db
+    finally:
+        await db.close()
@@ -1,22 +1,51 @@
+import os
+
 import uvicorn
 from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 
+from computer_use_demo.clients import client_registry
+from computer_use_demo.tools.input import x_input_stats
+from computer_use_demo.tools.screen import encode_stats, settle_stats
+
 from .config import get_settings
-from .database import Base, engine
+from .database import SessionLocal, init_db
 from .routers.sessions import router as sessions_router
 from .routers.messages import router as messages_router
 from .routers.stream import router as stream_router
 from .routers.vnc import router as vnc_router
+from .routers.media import router as media_router
+from .services.agent_pool import agent_pool
+from .services.agent_runner import backfill_message_seqs
+from .services.conversation_cache import conversation_cache
+from .services.db_writer import db_writer
+from .services.event_store import event_store
+from .services.stream_manager import stream_manager
+from .services.vm_controller import vm_controller
+from .services.vm_manager import vm_manager
 
 
 settings = get_settings()
 
 
+def configure_api_clients() -> None:
+    # Every agent turn reuses the same pooled clients (see computer_use_demo/clients.py)
+    client_registry.configure(
+        max_connections=settings.anthropic_max_connections,
+        max_keepalive_connections=settings.anthropic_max_keepalive_connections,
+        keepalive_expiry=settings.anthropic_keepalive_expiry,
+        http2=settings.anthropic_http2,
+    )
+
+
 def create_app() -> FastAPI:
     # Create tables on startup 
-    Base.metadata.create_all(bind=engine)
+    if ("messages", "seq") in init_db():
+        # Give messages stored before transcript positions existed theirs
+        with SessionLocal() as db:
+            backfill_message_seqs(db)
+            db.commit()
 
     app = FastAPI(title=settings.app_name)
 
@@ -26,19 +55,58 @@ def create_app() -> FastAPI:
         allow_credentials=True,
         allow_methods=["*"],
         allow_headers=["*"],
+        # Cross-origin scripts only see headers listed here; list_sessions
+        # returns its next-page cursor in one
+        expose_headers=["X-Next-Before"],
     )
 
     app.include_router(sessions_router)
     app.include_router(messages_router)
     app.include_router(stream_router)
-    # Serve media if any future endpoints write images to disk
-    app.mount("/media", StaticFiles(directory="data/media"), name="media")
+    # Serve screenshots and other content-addressed media (see services/media_store.py)
+    os.makedirs(settings.media_dir, exist_ok=True)
+    app.mount("/media", StaticFiles(directory=settings.media_dir), name="media")
+    app.include_router(media_router)
     app.include_router(vnc_router)
 
+    # Agent turns run on a dedicated worker pool, started with the app
+    app.add_event_handler("startup", configure_api_clients)
+    app.add_event_handler("startup", event_store.start)
+    app.add_event_handler("startup", db_writer.start)
+    app.add_event_handler("startup", stream_manager.start)
+    app.add_event_handler("startup", vm_manager.start)
+    app.add_event_handler("startup", vm_controller.start)
+    app.add_event_handler("startup", agent_pool.start)
+    # Stop agents first so their last events and writes land before the
+    # event store flushes and the DB writer exits
+    app.add_event_handler("shutdown", agent_pool.stop)
+    app.add_event_handler("shutdown", vm_controller.stop)
+    app.add_event_handler("shutdown", db_writer.stop)
+    app.add_event_handler("shutdown", event_store.stop)
+    app.add_event_handler("shutdown", stream_manager.stop)
+    app.add_event_handler("shutdown", vm_manager.stop)
+    app.add_event_handler("shutdown", client_registry.close)
+
     @app.get("/healthz")
     def healthz():
         return {"status": "ok"}
 
+    @app.get("/metrics")
+    def metrics():
+        return {
+            "agent_pool": agent_pool.stats(),
+            "event_store": event_store.stats(),
+            "conversation_cache": conversation_cache.stats(),
+            "db_writer": db_writer.stats(),
+            "stream": stream_manager.stats(),
+            "vm_pool": vm_manager.stats(),
+            "vm": vm_controller.stats(),
+            "anthropic_clients": client_registry.stats(),
+            "computer_settle": settle_stats.stats(),
+            "computer_input": x_input_stats(),
+            "computer_encode": encode_stats.stats(),
+        }
+
     return app
 
 
@@ -1,5 +1,5 @@
 from datetime import datetime
-from sqlalchemy import Column, DateTime, ForeignKey, String, Text, JSON
+from sqlalchemy import Column, DateTime, ForeignKey, Index, Integer, String, Text, JSON, text
 from sqlalchemy.orm import relationship
 from ..database import Base
 
@@ -13,7 +13,25 @@ class Message(Base):
     content = Column(Text, nullable=True)
     content_json = Column(JSON, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    # Position in the session's agent transcript, from Session.message_seq. A
+    # user message gets it when its turn starts, not when it is posted, so
+    # NULL means the turn is still queued (or never ran)
+    seq = Column(Integer, nullable=True)
 
     session = relationship("Session", backref="messages")
 
+    __table_args__ = (
+        # Serves per-session history pages ordered by (created_at, id)
+        Index("ix_messages_session_created", "session_id", "created_at", "id"),
+        # Serves transcript rebuilds in insertion order
+        Index("ix_messages_session_seq", "session_id", "seq"),
+        # Serves finding the queued turns to recover at startup
+        Index(
+            "ix_messages_unplaced",
+            "created_at",
+            sqlite_where=text("seq IS NULL"),
+            postgresql_where=text("seq IS NULL"),
+        ),
+    )
+
 
@@ -1,6 +1,6 @@
 import uuid
 from datetime import datetime
-from sqlalchemy import Column, DateTime, String, Boolean, JSON
+from sqlalchemy import Column, DateTime, Integer, String, Boolean, Index, JSON
 from ..database import Base
 
 
@@ -21,5 +21,12 @@ class Session(Base):
     last_agent_state = Column(JSON, nullable=True)
     metadata_json = Column(JSON, nullable=True)
     archived = Column(Boolean, default=False, nullable=False)
+    # Last transcript position handed out to this session's messages
+    message_seq = Column(Integer, default=0, server_default="0", nullable=False)
+
+    __table_args__ = (
+        # Serves the session list's keyset pagination, most recently active first
+        Index("ix_sessions_updated", "updated_at", "id"),
+    )
 
 
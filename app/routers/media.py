@@ -0,0 +1,27 @@
+import re
+
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import FileResponse
+
+from ..config import get_settings
+from ..services.media_store import THUMBS_URL_PREFIX, media_store
+
+
+router = APIRouter(prefix=THUMBS_URL_PREFIX, tags=["media"])
+settings = get_settings()
+
+SHA256_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+@router.get("/{name}")
+def get_thumbnail(name: str):
+    # Generated on first request (sync route, so Pillow runs in the threadpool) and cached on disk
+    digest = name.removesuffix(".jpg")
+    if not SHA256_RE.match(digest):
+        raise HTTPException(status_code=404, detail="Not found")
+    found = media_store.thumbnail(digest, settings.stream_thumbnail_width)
+    if found is None:
+        raise HTTPException(status_code=404, detail="Not found")
+    path, media_type = found
+    # Content-addressed, so it never changes
+    return FileResponse(path, media_type=media_type, headers={"Cache-Control": "public, max-age=31536000, immutable"})
@@ -1,17 +1,17 @@
 import uuid
-import asyncio
 from typing import Dict, List
 
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session as OrmSession
+from sqlalchemy import delete
 
-from ..database import get_db
+from ..database import AsyncDB, get_async_db
 from ..models.session import Session as SessionModel
 from ..models.message import Message as MessageModel
 from ..schemas import MessageCreate, MessageRead
 from ..services.stream_manager import stream_manager
-from ..services.event_store import event_store
-from ..services.agent_runner import run_agent_for_new_user_message
+from ..services.db_writer import db_writer
+from ..services.agent_pool import AgentQueueFull, agent_pool, agent_state
+from ..services.vm_controller import vm_controller
 
 
 router = APIRouter(prefix="/sessions/{session_id}/messages", tags=["messages"])
@@ -30,10 +30,13 @@ def build_anthropic_history(db_messages: List[MessageModel]) -> List[Dict]:
 
 
 @router.post("", response_model=MessageRead)
-async def send_message(session_id: str, payload: MessageCreate, db: OrmSession = Depends(get_db)):
-    session = db.get(SessionModel, session_id)
+async def send_message(session_id: str, payload: MessageCreate, db: AsyncDB = Depends(get_async_db)):
+    session = await db.get(SessionModel, session_id)
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
+    # Reject before persisting anything so a refused turn leaves no orphan message
+    if agent_pool.full():
+        raise HTTPException(status_code=429, detail="Agent queue is full, retry later")
 
     user_message = MessageModel(
         id=str(uuid.uuid4()),
@@ -41,19 +44,45 @@ async def send_message(session_id: str, payload: MessageCreate, db: OrmSession =
         role="user",
         content=payload.content,
     )
-    db.add(user_message)
-    db.commit()
-    db.refresh(user_message)
+    queued = agent_state("queued", user_message.id)
 
-    # Stream to websockets that a user message arrived
+    def write(wdb):
+        wdb.add(user_message)
+        wdb.get(SessionModel, session_id).last_agent_state = queued
+
+    await db_writer.run(write)
+    # Keeps the session's VM from being reaped, or brings it back if it was
+    vm_controller.touch(session_id)
+
+    # Stream to websockets that a user message arrived. Before the turn is
+    # queued: an idle worker starts it at once, and its events must follow
     ev = {
         "type": "user_message",
         "at": user_message.created_at.isoformat(),
         "message": {"id": user_message.id, "content": user_message.content},
     }
-    event_store.append(session_id, ev)
     await stream_manager.broadcast(session_id, ev)
 
+    # Queue the turn on the agent worker pool; it opens its own DB session
+    try:
+        agent_pool.submit(session_id, user_message.id)
+    except AgentQueueFull as e:
+        # The queue filled up while we were committing: drop the message, or
+        # it would look queued and be recovered on the next start
+        rejected = agent_state("rejected", user_message.id)
+
+        def reject(wdb):
+            wdb.execute(delete(MessageModel).where(MessageModel.id == user_message.id))
+            wdb.get(SessionModel, session_id).last_agent_state = rejected
+
+        await db_writer.run(reject)
+        await stream_manager.broadcast(session_id, {
+            "type": "user_message_rejected",
+            "at": rejected["at"],
+            "message": {"id": user_message.id},
+        })
+        raise HTTPException(status_code=429, detail=str(e))
+
     # Emit VM meta to help the frontend validate the iframe port/session binding
     try:
         vm_meta = (session.metadata_json or {}).get("vm")
@@ -66,14 +95,6 @@ async def send_message(session_id: str, payload: MessageCreate, db: OrmSession =
     except Exception:
         pass
 
-    # Build Anthropic history from DB
-    db.refresh(session)
-    history = build_anthropic_history(session.messages)
-
-    async def handle_stream():
-        await run_agent_for_new_user_message(db, session, user_message)
-    asyncio.create_task(handle_stream())
-
     return user_message
 
 
@@ -1,75 +1,146 @@
 import uuid
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session as OrmSession
+from datetime import datetime
+from typing import Literal, Optional, Tuple
 
-from ..database import get_db
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from sqlalchemy import select, tuple_
+
+from ..database import AsyncDB, get_async_db
 from ..models.session import Session as SessionModel
 from ..models.message import Message as MessageModel
-from ..schemas import SessionCreate, SessionRead, ChatHistoryRead
-from ..services.vm_manager import vm_manager
+from ..schemas import SessionCreate, SessionRead, MessageRead, ChatHistoryRead
+from ..services.vm_controller import vm_controller
 from ..services.event_store import event_store
+from ..services.db_writer import db_writer
+
+from computer_use_demo.tools.screen import Encoding
 
 
 router = APIRouter(prefix="/sessions", tags=["sessions"])
 
 
+def parse_cursor(before: Optional[str]) -> Optional[Tuple[datetime, str]]:
+    """Parse a `<timestamp ISO8601>,<id>` keyset cursor."""
+    if not before:
+        return None
+    created_at, _, row_id = before.partition(",")
+    try:
+        return datetime.fromisoformat(created_at), row_id
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor, expected <timestamp>,<id>")
+
+
+def make_cursor(at: datetime, row_id: str) -> str:
+    return f"{at.isoformat()},{row_id}"
+
+
 @router.post("", response_model=SessionRead)
-def create_session(payload: SessionCreate, db: OrmSession = Depends(get_db)):
-    vm_info = vm_manager.create_vm()
+async def create_session(payload: SessionCreate):
+    # Checked here: a bad value would otherwise fail every turn of the session
+    encoding = (payload.metadata or {}).get("screenshot_encoding")
+    if encoding is not None:
+        try:
+            if not isinstance(encoding, str):
+                raise ValueError(f"expected a string, got {encoding!r}")
+            Encoding.parse(encoding)
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=f"Invalid metadata.screenshot_encoding: {e}")
     session = SessionModel(
         id=str(uuid.uuid4()),
         title=payload.title,
-        metadata_json={**(payload.metadata or {}), "vm": vm_info},
+        metadata_json={**(payload.metadata or {}), "vm": {"status": "pending"}},
         status="active",
     )
-    db.add(session)
-    db.commit()
-    db.refresh(session)
+    await db_writer.run(lambda wdb: wdb.add(session))
+    # Ready at once with a warm container from the pool; otherwise pending, and
+    # a vm_status event on the session stream announces when it is up
+    vm_info = await vm_controller.create(session.id)
+    session.metadata_json = {**(payload.metadata or {}), "vm": vm_info}
     return session
 
 
 @router.get("", response_model=list[SessionRead])
-def list_sessions(db: OrmSession = Depends(get_db)):
-    # latest first
-    sessions = db.query(SessionModel).order_by(SessionModel.updated_at.desc()).all()
+async def list_sessions(
+    response: Response,
+    before: Optional[str] = None,
+    limit: int = Query(default=50, ge=1, le=200),
+    db: AsyncDB = Depends(get_async_db),
+):
+    # most recently active (updated) first, keyset-paginated on (updated_at, id);
+    # the cursor for the next page is returned in the X-Next-Before header
+    stmt = select(SessionModel).order_by(SessionModel.updated_at.desc(), SessionModel.id.desc())
+    cursor = parse_cursor(before)
+    if cursor:
+        stmt = stmt.where(tuple_(SessionModel.updated_at, SessionModel.id) < cursor)
+    sessions = await db.scalars(stmt.limit(limit + 1))
+    if len(sessions) > limit:
+        sessions = sessions[:limit]
+        response.headers["X-Next-Before"] = make_cursor(sessions[-1].updated_at, sessions[-1].id)
     return sessions
 
 
 @router.post("/{session_id}/archive", response_model=SessionRead)
-def archive_session(session_id: str, db: OrmSession = Depends(get_db)):
-    session = db.get(SessionModel, session_id)
+async def archive_session(session_id: str, db: AsyncDB = Depends(get_async_db)):
+    session = await db.get(SessionModel, session_id)
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
-    # Stop per-session VM if present
-    try:
-        container_id = (session.metadata_json or {}).get("vm", {}).get("container_id")
-        if container_id:
-            vm_manager.stop_vm(container_id)
-    except Exception:
-        pass
-    session.status = "archived"
-    db.add(session)
-    db.commit()
-    db.refresh(session)
-    return session
+    # Stop the per-session VM in the background; progress arrives as vm_status events
+    container_id = ((session.metadata_json or {}).get("vm") or {}).get("container_id")
+    vm_controller.release(session_id, container_id)
+
+    def write(wdb):
+        row = wdb.get(SessionModel, session_id)
+        row.status = "archived"
+        return row
+
+    return await db_writer.run(write)
 
 
 @router.get("/{session_id}/events")
-def list_session_events(session_id: str):
-    # Returns stored live stream events (if MongoDB is configured)
-    return event_store.list(session_id)
+def list_session_events(session_id: str, since: Optional[int] = None):
+    # Returns stored live stream events (if MongoDB is configured); with
+    # `since`, only events with a greater seq
+    return event_store.list(session_id, since=since)
 
 @router.get("/{session_id}", response_model=ChatHistoryRead)
-def get_session(session_id: str, db: OrmSession = Depends(get_db)):
-    session = db.get(SessionModel, session_id)
+async def get_session(
+    session_id: str,
+    before: Optional[str] = None,
+    limit: int = Query(default=100, ge=1, le=1000),
+    fields: Literal["full", "summary"] = "full",
+    db: AsyncDB = Depends(get_async_db),
+):
+    session = await db.get(SessionModel, session_id)
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
-    # Access messages relationship
-    _ = session.messages  # ensure loaded
-    return ChatHistoryRead(
-        session=session,
-        messages=session.messages,
+    # Newest page first via the (session_id, created_at, id) index; returned oldest-first.
+    # "summary" selects plain columns only so content_json is never read from the DB.
+    if fields == "summary":
+        stmt = select(
+            MessageModel.id,
+            MessageModel.session_id,
+            MessageModel.role,
+            MessageModel.content,
+            MessageModel.created_at,
+        )
+    else:
+        stmt = select(MessageModel)
+    stmt = stmt.where(MessageModel.session_id == session_id).order_by(
+        MessageModel.created_at.desc(), MessageModel.id.desc()
     )
+    cursor = parse_cursor(before)
+    if cursor:
+        stmt = stmt.where(tuple_(MessageModel.created_at, MessageModel.id) < cursor)
+    if fields == "summary":
+        rows = [MessageRead(**row._mapping) for row in await db.execute(stmt.limit(limit + 1))]
+    else:
+        rows = [MessageRead.model_validate(m) for m in await db.scalars(stmt.limit(limit + 1))]
+    next_before = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_before = make_cursor(rows[-1].created_at, rows[-1].id)
+    rows.reverse()
+    return ChatHistoryRead(session=session, messages=rows, next_before=next_before)
 
 
 
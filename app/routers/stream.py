@@ -1,33 +1,131 @@
 import asyncio
-from fastapi import APIRouter, HTTPException
-from fastapi import WebSocket, WebSocketDisconnect
+import json
+from datetime import datetime
+from typing import Any, Dict, Literal, Optional
 
-from ..database import SessionLocal
+from fastapi import APIRouter
+from fastapi import WebSocket
+
+from ..config import get_settings
+from ..database import AsyncDB
 from ..models.session import Session as SessionModel
-from ..services.stream_manager import stream_manager
+from ..services.stream_manager import Subscriber, stream_manager
+from ..services.stream_profiles import IMAGE_MODES, PROFILES
 
 
 router = APIRouter(prefix="/sessions/{session_id}", tags=["stream"])
+settings = get_settings()
 
+# Close code for clients that stopped answering heartbeats
+HEARTBEAT_TIMEOUT_CLOSE_CODE = 4408
 
-@router.websocket("/stream")
-async def stream_session(websocket: WebSocket, session_id: str):
-    # Check session existence with short-lived DB session
-    db = SessionLocal()
+
+async def session_exists(session_id: str) -> bool:
+    # Short-lived DB session, not held for the lifetime of the socket
+    db = AsyncDB()
     try:
-        session = db.get(SessionModel, session_id)
+        return await db.get(SessionModel, session_id) is not None
     finally:
-        db.close()
+        await db.close()
 
-    if not session:
+
+@router.websocket("/stream")
+async def stream_session(
+    websocket: WebSocket,
+    session_id: str,
+    since: Optional[int] = None,
+    profile: Literal["full", "chat", "debug"] = "full",
+    images: Literal["ref", "thumb", "none"] = "ref",
+):
+    if not await session_exists(session_id):
         await websocket.close(code=4404)
         return
 
-    await stream_manager.connect(session_id, websocket)
+    subscriber = await stream_manager.accept(websocket, profile, images)
     try:
-        while True:
-            await asyncio.sleep(60)
-    except WebSocketDisconnect:
-        await stream_manager.disconnect(session_id, websocket)
+        await stream_manager.subscribe(subscriber, session_id, since)
+        await receive_loop(websocket, subscriber, session_id)
+    finally:
+        await subscriber.close()
+
+
+async def receive_loop(websocket: WebSocket, subscriber: Subscriber, session_id: str) -> None:
+    """Read control messages until the client goes away.
+
+    Sending is done by the subscriber's writer task. Between client messages a
+    ping is sent every `stream_heartbeat_interval` seconds; a client silent for
+    `stream_heartbeat_timeout` seconds is disconnected.
+    """
+    loop = asyncio.get_running_loop()
+    last_seen = loop.time()
+    while not subscriber.closed:
+        try:
+            message = await asyncio.wait_for(websocket.receive(), timeout=settings.stream_heartbeat_interval)
+        except asyncio.TimeoutError:
+            if loop.time() - last_seen > settings.stream_heartbeat_timeout:
+                await subscriber.close(HEARTBEAT_TIMEOUT_CLOSE_CODE)
+                return
+            subscriber.send_control({"type": "ping", "at": datetime.utcnow().isoformat()})
+            continue
+        except Exception:
+            return
+        if message["type"] == "websocket.disconnect":
+            return
+        last_seen = loop.time()
+        try:
+            control = json.loads(message.get("text") or message.get("bytes") or "")
+            if not isinstance(control, dict):
+                raise ValueError("expected a JSON object")
+        except ValueError as e:
+            subscriber.send_control({"type": "error", "detail": f"Invalid control message: {e}"})
+            continue
+        await handle_control(subscriber, control, session_id)
+
 
+async def handle_control(subscriber: Subscriber, control: Dict[str, Any], default_session_id: str) -> None:
+    """Apply one client control message.
 
+    - `{"type": "ping"}` → `{"type": "pong"}`; `{"type": "pong"}` only marks the client alive
+    - `{"type": "subscribe", "session_id", "since"?}` adds a session to this connection
+    - `{"type": "unsubscribe", "session_id"}` removes one
+    - `{"type": "resume", "session_id"?, "since"}` replays missed events of a session
+    - `{"type": "filter", "types": [...] | null}` limits which event types are sent
+    - `{"type": "profile", "profile"?, "images"?}` switches the stream profile
+    """
+    kind = control.get("type")
+    target = control.get("session_id") or default_session_id
+    if kind == "ping":
+        subscriber.send_control({"type": "pong", "at": datetime.utcnow().isoformat()})
+    elif kind == "pong":
+        pass
+    elif kind in ("subscribe", "resume"):
+        since = control.get("since")
+        if since is not None and not isinstance(since, int):
+            subscriber.send_control({"type": "error", "detail": "since must be an integer"})
+            return
+        if target not in subscriber.sessions:
+            if len(subscriber.sessions) >= settings.stream_max_subscriptions:
+                subscriber.send_control({"type": "error", "detail": "Too many subscriptions"})
+                return
+            if not await session_exists(target):
+                subscriber.send_control({"type": "error", "session_id": target, "detail": "Session not found"})
+                return
+        seq = await stream_manager.subscribe(subscriber, target, since)
+        subscriber.send_control({"type": "subscribed", "session_id": target, "seq": seq})
+    elif kind == "unsubscribe":
+        await stream_manager.unsubscribe(subscriber, target)
+        subscriber.send_control({"type": "unsubscribed", "session_id": target})
+    elif kind == "filter":
+        types = control.get("types")
+        subscriber.types = set(types) if types is not None else None
+        subscriber.send_control({"type": "filter", "types": sorted(subscriber.types) if types is not None else None})
+    elif kind == "profile":
+        profile = control.get("profile", subscriber.profile)
+        images = control.get("images", subscriber.images)
+        if profile not in PROFILES or images not in IMAGE_MODES:
+            subscriber.send_control({"type": "error", "detail": f"profile must be one of {PROFILES}, images one of {IMAGE_MODES}"})
+            return
+        subscriber.profile, subscriber.images = profile, images
+        subscriber.send_control({"type": "profile", "profile": profile, "images": images})
+    else:
+        subscriber.send_control({"type": "error", "detail": f"Unknown control message type: {kind}"})
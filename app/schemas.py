@@ -32,7 +32,8 @@ class MessageRead(BaseModel):
     session_id: str
     role: str
     content: Optional[str]
-    content_json: Optional[dict]
+    # Structured content is a list of content blocks; None in summary mode
+    content_json: Optional[Any] = None
     created_at: datetime
 
     class Config:
@@ -42,5 +43,7 @@ class MessageRead(BaseModel):
 class ChatHistoryRead(BaseModel):
     session: SessionRead
     messages: List[MessageRead]
+    # Cursor for the next (older) page of messages, if any
+    next_before: Optional[str] = None
 
 
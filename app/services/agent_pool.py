@@ -0,0 +1,262 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Deque, Dict, List, Optional
+
+from sqlalchemy import select
+from sqlalchemy.orm.attributes import set_committed_value
+
+from ..config import get_settings
+from ..database import AsyncDB
+from .db_writer import db_writer
+from ..models.message import Message as MessageModel
+from ..models.session import Session as SessionModel
+from .agent_runner import run_agent_for_new_user_message
+from .stream_manager import stream_manager
+
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+
+class AgentQueueFull(Exception):
+    """Raised when the pool cannot accept another turn."""
+
+
+@dataclass
+class AgentJob:
+    session_id: str
+    message_id: str
+    enqueued_at: float = field(default_factory=time.monotonic)
+
+
+class AgentWorkerPool:
+    """Runs agent turns on a bounded set of workers.
+
+    Jobs are queued per session so that a session only ever runs one turn at a
+    time, while different sessions are picked up by any free worker. Each job
+    opens its own DB session instead of borrowing the request-scoped one.
+    """
+
+    def __init__(self, max_workers: int, max_queued: int):
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self._session_queues: Dict[str, Deque[AgentJob]] = {}
+        self._ready: Optional[asyncio.Queue[str]] = None
+        self._workers: List[asyncio.Task] = []
+        self._queued = 0
+        self._running = 0
+        # metrics
+        self._submitted = 0
+        self._completed = 0
+        self._failed = 0
+        self._rejected = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._run_total = 0.0
+        self._run_max = 0.0
+
+    async def start(self) -> None:
+        if self._workers:
+            return
+        self._ready = asyncio.Queue()
+        # Sessions queued before startup (or recovered below) become ready now
+        for session_id in self._session_queues:
+            self._ready.put_nowait(session_id)
+        self._workers = [
+            asyncio.create_task(self._worker(i), name=f"agent-worker-{i}")
+            for i in range(self.max_workers)
+        ]
+        await self._recover_pending()
+
+    async def stop(self) -> None:
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._ready = None
+
+    def full(self) -> bool:
+        return self._queued >= self.max_queued
+
+    def submit(self, session_id: str, message_id: str) -> AgentJob:
+        """Queue a turn for a session. Raises AgentQueueFull when at capacity."""
+        if self.full():
+            self._rejected += 1
+            raise AgentQueueFull(f"Agent queue is full ({self.max_queued} pending turns)")
+        job = AgentJob(session_id=session_id, message_id=message_id)
+        queue = self._session_queues.get(session_id)
+        if queue is None:
+            # Session is idle: create its queue and mark it ready for a worker
+            queue = self._session_queues[session_id] = deque()
+            if self._ready is not None:
+                self._ready.put_nowait(session_id)
+        queue.append(job)
+        self._queued += 1
+        self._submitted += 1
+        return job
+
+    def stats(self) -> Dict[str, float]:
+        finished = self._completed + self._failed
+        started = finished + self._running
+        return {
+            "workers": self.max_workers,
+            "max_queued": self.max_queued,
+            "queued": self._queued,
+            "running": self._running,
+            "active_sessions": len(self._session_queues),
+            "submitted": self._submitted,
+            "completed": self._completed,
+            "failed": self._failed,
+            "rejected": self._rejected,
+            "wait_avg_s": self._wait_total / started if started else 0.0,
+            "wait_max_s": self._wait_max,
+            "run_avg_s": self._run_total / finished if finished else 0.0,
+            "run_max_s": self._run_max,
+        }
+
+    async def _worker(self, index: int) -> None:
+        assert self._ready is not None
+        while True:
+            session_id = await self._ready.get()
+            queue = self._session_queues.get(session_id)
+            if not queue:
+                self._session_queues.pop(session_id, None)
+                continue
+            job = queue.popleft()
+            self._queued -= 1
+            self._running += 1
+            waited = time.monotonic() - job.enqueued_at
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+            started = time.monotonic()
+            try:
+                await self._run_job(job)
+                self._completed += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self._failed += 1
+                logger.exception("Agent turn failed for session %s", job.session_id)
+            finally:
+                self._running -= 1
+                elapsed = time.monotonic() - started
+                self._run_total += elapsed
+                self._run_max = max(self._run_max, elapsed)
+                # Hand the session back to the pool if more turns are waiting
+                if queue:
+                    self._ready.put_nowait(session_id)
+                else:
+                    self._session_queues.pop(session_id, None)
+
+    async def _run_job(self, job: AgentJob) -> None:
+        db = AsyncDB()
+        try:
+            session = await db.get(SessionModel, job.session_id)
+            user_message = await db.get(MessageModel, job.message_id)
+            if not session or not user_message:
+                return
+            # The turn publishes events: keep the session's stream seq loaded
+            await stream_manager.open(session.id)
+            try:
+                await _set_agent_state(session, "running", job.message_id)
+                try:
+                    await run_agent_for_new_user_message(db, session, user_message)
+                except asyncio.CancelledError:
+                    await db.rollback()
+                    await _set_agent_state(session, "interrupted", job.message_id)
+                    raise
+                except Exception:
+                    await db.rollback()
+                    await _set_agent_state(session, "failed", job.message_id)
+                    raise
+                # A follow-up posted during the turn keeps its queued marker
+                await _set_agent_state(session, "idle", job.message_id, keep_queued=True)
+            finally:
+                stream_manager.close(session.id)
+        finally:
+            await db.close()
+
+    async def _recover_pending(self) -> None:
+        """Requeue turns that were queued when the process last stopped.
+
+        Queued turns are the user messages that have no transcript position
+        yet (see `place_user_message`); they are requeued oldest first. Turns
+        that were already running are not replayed, since their tool actions
+        may have partially executed; they are marked interrupted instead.
+        """
+        db = AsyncDB()
+        try:
+            sessions = {
+                session.id: session
+                for session in await db.scalars(select(SessionModel).where(SessionModel.status == "active"))
+            }
+            rows = await db.execute(
+                select(MessageModel.session_id, MessageModel.id)
+                .where(MessageModel.seq.is_(None), MessageModel.role == "user")
+                .order_by(MessageModel.created_at, MessageModel.id)
+            )
+            pending = [(session_id, message_id) for session_id, message_id in rows if session_id in sessions]
+            pending_sessions = {session_id for session_id, _ in pending}
+            # Settle the last run's states before a worker can pick up a requeued turn
+            for session in sessions.values():
+                state = session.last_agent_state or {}
+                if state.get("state") == "running" or (
+                    state.get("state") == "queued" and session.id not in pending_sessions
+                ):
+                    await _set_agent_state(session, "interrupted", state.get("message_id"))
+            requeued = set()
+            for n, (session_id, message_id) in enumerate(pending):
+                try:
+                    self.submit(session_id, message_id)
+                    requeued.add(session_id)
+                except AgentQueueFull:
+                    # The rest stay queued in the database for the next start
+                    for later_session, later_message in pending[n:]:
+                        if later_session not in requeued:
+                            requeued.add(later_session)
+                            await _set_agent_state(sessions[later_session], "interrupted", later_message)
+                    break
+        except Exception:
+            logger.exception("Failed to recover pending agent turns")
+        finally:
+            await db.close()
+
+
+def agent_state(state: str, message_id: Optional[str]) -> Dict[str, Optional[str]]:
+    return {"state": state, "message_id": message_id, "at": datetime.utcnow().isoformat()}
+
+
+async def _set_agent_state(
+    session: SessionModel, state: str, message_id: Optional[str], keep_queued: bool = False
+) -> None:
+    """Record a turn's state on its session. With `keep_queued`, a queued
+    marker left by a later message is not overwritten."""
+    new_state = agent_state(state, message_id)
+
+    def write(db):
+        row = db.get(SessionModel, session.id, with_for_update=True)
+        if row is None:
+            return False
+        current = row.last_agent_state or {}
+        if keep_queued and current.get("state") == "queued" and current.get("message_id") != message_id:
+            return False
+        row.last_agent_state = new_state
+        return True
+
+    if await db_writer.run(write):
+        # Not a pending change of the caller's DB session
+        set_committed_value(session, "last_agent_state", new_state)
+
+    await db_writer.run(write)
+
+
+agent_pool = AgentWorkerPool(
+    max_workers=settings.agent_max_workers,
+    max_queued=settings.agent_max_queued,
+)
@@ -1,15 +1,27 @@
 import asyncio
-from datetime import datetime
+import json
+from datetime import datetime, timedelta
 import uuid
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Sequence, Tuple
 
+from sqlalchemy import select, update
 from sqlalchemy.orm import Session as OrmSession
+from sqlalchemy.orm.attributes import set_committed_value
 
 from ..config import get_settings
+from ..database import AsyncDB
 from ..models.message import Message as MessageModel
 from ..models.session import Session as SessionModel
 from ..services.stream_manager import stream_manager
-from ..services.event_store import event_store
+from ..services.media_store import media_store
+from ..services.db_writer import db_writer
+from ..services.vm_controller import vm_controller
+from ..services.conversation_cache import (
+    CachedConversation,
+    conversation_cache,
+    copy_messages,
+    message_size,
+)
 
 from computer_use_demo.loop import (
     sampling_loop,
@@ -21,12 +33,47 @@ from computer_use_demo.tools.groups import ToolVersion
 settings = get_settings()
 
 
-def db_add_message(
-    db: OrmSession,
+def reserve_message_seqs(db: OrmSession, session_id: str, count: int) -> int:
+    """Reserve `count` consecutive transcript positions of a session; returns the first.
+
+    A single UPDATE ... RETURNING on the session row, so concurrent writers
+    never hand out the same position.
+    """
+    stmt = (
+        update(SessionModel)
+        .where(SessionModel.id == session_id)
+        .values(message_seq=SessionModel.message_seq + count)
+        .returning(SessionModel.message_seq)
+        .execution_options(synchronize_session=False)
+    )
+    return db.execute(stmt).scalar_one() - count + 1
+
+
+def backfill_message_seqs(db: OrmSession) -> None:
+    """Number rows stored before transcript positions existed, in their old (created_at, id) order."""
+    rows = db.execute(
+        select(MessageModel.id, MessageModel.session_id)
+        .where(MessageModel.seq.is_(None))
+        .order_by(MessageModel.session_id, MessageModel.created_at, MessageModel.id)
+    ).all()
+    counts: Dict[str, int] = {}
+    updates = []
+    for message_id, session_id in rows:
+        counts[session_id] = counts.get(session_id, 0) + 1
+        updates.append({"id": message_id, "seq": counts[session_id]})
+    if updates:
+        db.execute(update(MessageModel), updates)
+        db.execute(
+            update(SessionModel),
+            [{"id": session_id, "message_seq": count} for session_id, count in counts.items()],
+        )
+
+
+async def db_add_message_async(
     session_id: str,
     role: str,
     content: Optional[str] = None,
-    content_json: Optional[Dict[str, Any]] = None,
+    content_json: Optional[Any] = None,
 ) -> MessageModel:
     msg = MessageModel(
         id=str(uuid.uuid4()),
@@ -35,12 +82,82 @@ def db_add_message(
         content=content,
         content_json=content_json,
     )
-    db.add(msg)
-    db.commit()
-    db.refresh(msg)
+
+    def write(db: OrmSession) -> None:
+        msg.seq = reserve_message_seqs(db, session_id, 1)
+        db.add(msg)
+
+    await db_writer.run(write)
     return msg
 
 
+async def db_add_messages_async(
+    session_id: str,
+    items: Sequence[Tuple[str, Any]],
+) -> List[MessageModel]:
+    """Insert several (role, content_json) messages in one transaction.
+
+    The rows take consecutive transcript positions; created_at is strictly
+    increasing too, so they also list in order by time.
+    """
+    now = datetime.utcnow()
+    msgs = [
+        MessageModel(
+            id=str(uuid.uuid4()),
+            session_id=session_id,
+            role=role,
+            content_json=content_json,
+            created_at=now + timedelta(microseconds=i),
+        )
+        for i, (role, content_json) in enumerate(items)
+    ]
+
+    def write(db: OrmSession) -> None:
+        first = reserve_message_seqs(db, session_id, len(msgs))
+        for i, msg in enumerate(msgs):
+            msg.seq = first + i
+        db.add_all(msgs)
+
+    await db_writer.run(write)
+    return msgs
+
+
+async def place_user_message(message: MessageModel) -> None:
+    """Give a user message its transcript position when its turn starts.
+
+    Messages are stored without one when they are posted: the session may
+    still be running an earlier turn, whose steps belong before the new
+    message. A message that already has a position keeps it.
+    """
+    if message.seq is not None:
+        return
+
+    def write(db: OrmSession) -> int:
+        seq = reserve_message_seqs(db, message.session_id, 1)
+        db.execute(
+            update(MessageModel)
+            .where(MessageModel.id == message.id)
+            .values(seq=seq)
+            .execution_options(synchronize_session=False)
+        )
+        return seq
+
+    seq = await db_writer.run(write)
+    # The caller's session must not see this as a pending change
+    set_committed_value(message, "seq", seq)
+
+
+def stored_content(content: Any, images: Optional[Dict[str, Any]] = None) -> Any:
+    """Stable, detached serialization of message content for persistence.
+
+    Images move to the media store (straight from their tool's image handle
+    when `images` has it, see `MediaStore.externalize`) and the result is
+    round-tripped through JSON so later in-place edits by sampling_loop
+    (cache_control injection, image truncation) never reach the stored copy.
+    """
+    return json.loads(json.dumps(media_store.externalize(content, images)))
+
+
 def build_beta_messages(db_messages: List[MessageModel]) -> List[Dict[str, Any]]:
     beta_messages: List[Dict[str, Any]] = []
     for m in db_messages:
@@ -53,9 +170,14 @@ def build_beta_messages(db_messages: List[MessageModel]) -> List[Dict[str, Any]]
                     ],
                 }
             )
+        elif m.role == "tool":
+            # tool_result blocks sent back to the model as a user turn
+            beta_messages.append({"role": "user", "content": media_store.internalize(m.content_json)})
         elif m.role == "assistant":
             if m.content_json and isinstance(m.content_json, list):
-                beta_messages.append({"role": "assistant", "content": m.content_json})
+                beta_messages.append(
+                    {"role": "assistant", "content": media_store.internalize(m.content_json)}
+                )
             elif m.content:
                 beta_messages.append(
                     {"role": "assistant", "content": [{"type": "text", "text": m.content}]}
@@ -63,23 +185,81 @@ def build_beta_messages(db_messages: List[MessageModel]) -> List[Dict[str, Any]]
     return beta_messages
 
 
+def _convert_rows(rows: List[MessageModel]) -> Tuple[List[Dict[str, Any]], int]:
+    messages = build_beta_messages(rows)
+    return messages, sum(message_size(m) for m in messages)
+
+
+async def load_history(db: AsyncDB, session_id: str, upto: MessageModel) -> List[Dict[str, Any]]:
+    """Beta messages for every transcript row of a session up to and including `upto`.
+
+    Rows are read in transcript order (Message.seq), so `upto` must already be
+    placed. Uses the conversation cache so only rows newer than its high-water
+    mark are read and converted; falls back to a full rebuild when the session
+    is not cached.
+    """
+    upper = upto.seq
+    stmt = (
+        select(MessageModel)
+        .where(MessageModel.session_id == session_id, MessageModel.seq <= upper)
+        .order_by(MessageModel.seq)
+    )
+    cached = conversation_cache.get(session_id)
+    if cached is not None and cached.high_water > upper:
+        # Cache is ahead of the requested turn (should not happen); rebuild
+        conversation_cache.invalidate(session_id)
+        cached = None
+    if cached is not None:
+        stmt = stmt.where(MessageModel.seq > cached.high_water)
+
+    rows = await db.scalars(stmt)
+    # Converting rows reads and base64-encodes their stored screenshots; a full
+    # rebuild of a long session would stall every stream if done on the loop
+    new_messages, new_size = await asyncio.to_thread(_convert_rows, rows)
+    if cached is not None:
+        messages = cached.messages + new_messages
+        size = cached.size + new_size
+        high_water = rows[-1].seq if rows else cached.high_water
+    else:
+        messages = new_messages
+        size = new_size
+        high_water = rows[-1].seq if rows else None
+    if high_water is not None:
+        conversation_cache.put(session_id, CachedConversation(messages, high_water, size))
+    # sampling_loop mutates the list it is given, so never hand out the cached one
+    return copy_messages(messages)
+
+
 async def run_agent_for_new_user_message(
-    db: OrmSession,
+    db: AsyncDB,
     session: SessionModel,
     user_message: MessageModel,
 ) -> None:
-    # Build history
-    db.refresh(session)
-    beta_messages = build_beta_messages(session.messages)
+    # Build history; it ends with the new user message, which is already stored
+    # and goes after everything earlier turns stored
+    await place_user_message(user_message)
+    beta_messages = await load_history(db, session.id, user_message)
+    # End the read transaction so it doesn't pin the SQLite WAL snapshot for the
+    # whole turn; writes from here on go through db_writer
+    await db.commit()
+
+    # Image handles of the current step's tool results, by tool_use id
+    images: Dict[str, Any] = {}
 
     # callbacks
     def output_callback(block: Dict[str, Any]):
         # Stream each assistant content block as it arrives
         ev = {"type": "assistant_block", "at": datetime.utcnow().isoformat(), "data": block}
-        event_store.append(session.id, ev)
-        asyncio.get_event_loop().create_task(stream_manager.broadcast(session.id, ev))
+        stream_manager.publish(session.id, ev)
 
-    def tool_output_callback(tool_result, tool_use_id: str):
+    async def tool_output_callback(tool_result, tool_use_id: str):
+        # Screenshots go to the media store straight from the tool's bytes, in
+        # a worker thread; the stream manager turns the stored handle into a
+        # reference for the event
+        image = getattr(tool_result, "image", None)
+        if image is not None:
+            images[tool_use_id] = image
+            await media_store.put_image_async(image)
         ev = {
             "type": "tool_result",
             "at": datetime.utcnow().isoformat(),
@@ -87,12 +267,11 @@ async def run_agent_for_new_user_message(
             "data": {
                 "output": getattr(tool_result, "output", None),
                 "error": getattr(tool_result, "error", None),
-                "base64_image": getattr(tool_result, "base64_image", None),
+                "image": image,
                 "system": getattr(tool_result, "system", None),
             },
         }
-        event_store.append(session.id, ev)
-        asyncio.get_event_loop().create_task(stream_manager.broadcast(session.id, ev))
+        stream_manager.publish(session.id, ev)
 
     def api_response_callback(request, response_or_body, error):
         # Detailed API request/response event for live stream
@@ -135,20 +314,38 @@ async def run_agent_for_new_user_message(
                 "error": str(error) if error else None,
             },
         }
-        event_store.append(session.id, event)
-        asyncio.get_event_loop().create_task(stream_manager.broadcast(session.id, event))
+        stream_manager.publish(session.id, event)
+
+    def delta_callback(delta: Dict[str, Any]):
+        # Live preview only; each completed block still follows as assistant_block
+        if delta.get("type") not in ("text_delta", "thinking_delta"):
+            return
+        stream_manager.publish_transient(session.id, {
+            "type": "assistant_delta",
+            "at": datetime.utcnow().isoformat(),
+            "data": delta,
+        })
+
+    async def step_callback(step_messages: List[Dict[str, Any]]):
+        # Persist every message of the step (assistant + tool results) together,
+        # so the next turn's request prefix matches what the API already cached
+        # Off the event loop: any image not stored yet is hashed and written here
+        items = await asyncio.to_thread(
+            lambda: [
+                ("assistant" if m["role"] == "assistant" else "tool", stored_content(m["content"], images))
+                for m in step_messages
+            ]
+        )
+        images.clear()
+        await db_add_messages_async(session.id, items)
+        vm_controller.touch(session.id)
 
     # Run the sampling loop for one turn
     updated_messages = await sampling_loop(
         system_prompt_suffix="",
         model=settings.anthropic_model,
         provider=APIProvider.ANTHROPIC,
-        messages=beta_messages + [
-            {
-                "role": "user",
-                "content": [{"type": "text", "text": user_message.content or ""}],
-            }
-        ],
+        messages=beta_messages,
         output_callback=output_callback,
         tool_output_callback=tool_output_callback,
         api_response_callback=api_response_callback,
@@ -158,10 +355,14 @@ async def run_agent_for_new_user_message(
         max_tokens=4096,
         thinking_budget=None,
         token_efficient_tools_beta=False,
+        step_callback=step_callback,
+        stream=settings.anthropic_stream,
+        delta_callback=delta_callback,
+        image_encoding=(session.metadata_json or {}).get("screenshot_encoding")
+        or settings.screenshot_encoding,
     )
 
-    # Persist the last assistant message content_json
-    # Find the last assistant message in updated_messages
+    # Every step was persisted by step_callback; announce the final assistant message
     last_assistant_content = None
     for msg in reversed(updated_messages):
         if msg.get("role") == "assistant":
@@ -169,12 +370,13 @@ async def run_agent_for_new_user_message(
             break
 
     if last_assistant_content is not None:
-        db_add_message(db, session.id, role="assistant", content_json=last_assistant_content)
-        final_ev = {"type": "assistant_message", "at": datetime.utcnow().isoformat(), "data": last_assistant_content}
-        event_store.append(session.id, final_ev)
+        final_ev = {
+            "type": "assistant_message",
+            "at": datetime.utcnow().isoformat(),
+            "data": stored_content(last_assistant_content),
+        }
         await stream_manager.broadcast(session.id, final_ev)
         done_ev = {"type": "assistant_done", "at": datetime.utcnow().isoformat()}
-        event_store.append(session.id, done_ev)
         await stream_manager.broadcast(session.id, done_ev)
 
 
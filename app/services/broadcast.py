@@ -0,0 +1,439 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import uuid
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlalchemy.engine import make_url
+
+from ..config import get_settings
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+try:
+    import redis.asyncio as redis_asyncio  # type: ignore
+except Exception:  # pragma: no cover
+    redis_asyncio = None  # type: ignore
+
+try:
+    import asyncpg  # type: ignore
+except Exception:  # pragma: no cover
+    asyncpg = None  # type: ignore
+
+
+# Called with (session_id, seq, event type, serialized frame) for events published by other nodes
+Deliver = Callable[[str, int, Optional[str], str], None]
+
+
+class BroadcastBackend:
+    """Carries stream events between API nodes.
+
+    A node delivers its own events to its local subscribers directly and
+    publishes them once to the backend; the backend hands events published by
+    other nodes to `deliver`. Nodes only listen to sessions that have local
+    subscribers (`subscribe`/`unsubscribe` are reference counted).
+
+    Backends shared by several nodes also allocate event seqs
+    (`shared_seqs`), so nodes publishing for the same session never hand
+    out the same one.
+
+    The base class is the in-process backend: a single node, nothing to carry.
+    """
+
+    name = "inprocess"
+    shared_seqs = False
+
+    def __init__(self):
+        self.node_id = uuid.uuid4().hex
+        self._deliver: Optional[Deliver] = None
+        self._refs: Dict[str, int] = {}
+        self._published = 0
+        self._received = 0
+        self._dropped = 0
+        self._errors = 0
+
+    async def start(self, deliver: Deliver) -> None:
+        self._deliver = deliver
+
+    async def stop(self) -> None:
+        self._deliver = None
+
+    async def subscribe(self, session_id: str) -> None:
+        self._refs[session_id] = self._refs.get(session_id, 0) + 1
+        if self._refs[session_id] == 1:
+            await self._listen(session_id)
+
+    async def unsubscribe(self, session_id: str) -> None:
+        refs = self._refs.get(session_id, 0) - 1
+        if refs > 0:
+            self._refs[session_id] = refs
+            return
+        self._refs.pop(session_id, None)
+        if refs == 0:
+            await self._unlisten(session_id)
+
+    def publish(self, session_id: str, seq: int, kind: Optional[str], frame: str) -> None:
+        """Hand an event to the other nodes. Must not block."""
+
+    async def last_seq(self, session_id: str) -> int:
+        """Last seq any node allocated for a session (0 if unknown)."""
+        return 0
+
+    async def allocate_seqs(self, session_id: str, count: int, floor: int) -> int:
+        """Reserve the next `count` seqs of a session, after `floor` at least; returns the last.
+
+        `floor` is the last seq the caller knows of (e.g. from the event
+        store), in case the backend lost its counter. Only for `shared_seqs`
+        backends.
+        """
+        raise NotImplementedError
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": self.name,
+            "node_id": self.node_id,
+            "sessions": len(self._refs),
+            "published": self._published,
+            "received": self._received,
+            "dropped": self._dropped,
+            "errors": self._errors,
+        }
+
+    async def _listen(self, session_id: str) -> None:
+        pass
+
+    async def _unlisten(self, session_id: str) -> None:
+        pass
+
+    def _encode(self, seq: int, kind: Optional[str], frame: str) -> str:
+        # A small header in front of the frame, so receivers don't parse the JSON
+        return f"{self.node_id}\t{seq}\t{kind or ''}\t{frame}"
+
+    def _receive(self, session_id: str, payload: str) -> None:
+        node_id, seq, kind, frame = payload.split("\t", 3)
+        if node_id == self.node_id or self._deliver is None or session_id not in self._refs:
+            return
+        self._received += 1
+        self._deliver(session_id, int(seq), kind or None, frame)
+
+
+class MemoryBus:
+    """Shared in-process bus connecting MemoryBackend "nodes"; for tests."""
+
+    def __init__(self):
+        self.nodes: List["MemoryBackend"] = []
+        # Last allocated seq per session
+        self.seqs: Dict[str, int] = {}
+
+
+class MemoryBackend(BroadcastBackend):
+    """Fake multi-node backend: nodes on the same MemoryBus see each other's events.
+
+    Delivery is scheduled on the event loop rather than done inline, like a
+    real bus.
+    """
+
+    name = "memory"
+    shared_seqs = True
+
+    def __init__(self, bus: Optional[MemoryBus] = None):
+        super().__init__()
+        self.bus = bus or MemoryBus()
+
+    async def start(self, deliver: Deliver) -> None:
+        await super().start(deliver)
+        self.bus.nodes.append(self)
+
+    async def stop(self) -> None:
+        if self in self.bus.nodes:
+            self.bus.nodes.remove(self)
+        await super().stop()
+
+    def publish(self, session_id: str, seq: int, kind: Optional[str], frame: str) -> None:
+        payload = self._encode(seq, kind, frame)
+        self._published += 1
+        loop = asyncio.get_running_loop()
+        for node in self.bus.nodes:
+            if node is not self:
+                loop.call_soon(node._receive, session_id, payload)
+
+    async def last_seq(self, session_id: str) -> int:
+        return self.bus.seqs.get(session_id, 0)
+
+    async def allocate_seqs(self, session_id: str, count: int, floor: int) -> int:
+        # A round trip to a real backend lets other tasks run
+        await asyncio.sleep(0)
+        last = self.bus.seqs[session_id] = max(self.bus.seqs.get(session_id, 0), floor) + count
+        return last
+
+
+class _QueuedPublisher(BroadcastBackend):
+    """Base for network backends: `publish` enqueues, one task sends in order.
+
+    At most `max_queued` events wait to be sent; while the backend is down
+    or slow, further events are dropped (and counted) rather than buffered
+    without bound.
+    """
+
+    shared_seqs = True
+
+    def __init__(self, channel_prefix: str, max_queued: int):
+        super().__init__()
+        self.channel_prefix = channel_prefix
+        self.max_queued = max_queued
+        self._outbox: Optional[asyncio.Queue] = None
+        self._sender: Optional[asyncio.Task] = None
+
+    def channel(self, session_id: str) -> str:
+        return f"{self.channel_prefix}{session_id.replace('-', '')}"
+
+    async def start(self, deliver: Deliver) -> None:
+        await super().start(deliver)
+        self._outbox = asyncio.Queue(maxsize=self.max_queued)
+        self._sender = asyncio.create_task(self._send_loop(), name=f"{self.name}-publisher")
+
+    async def stop(self) -> None:
+        if self._sender is not None:
+            self._sender.cancel()
+            await asyncio.gather(self._sender, return_exceptions=True)
+            self._sender = None
+        await super().stop()
+
+    def publish(self, session_id: str, seq: int, kind: Optional[str], frame: str) -> None:
+        if self._outbox is None:
+            return
+        try:
+            self._outbox.put_nowait((self.channel(session_id), self._encode(seq, kind, frame)))
+        except asyncio.QueueFull:
+            self._dropped += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {**super().stats(), "queued": self._outbox.qsize() if self._outbox else 0}
+
+    async def _send_loop(self) -> None:
+        assert self._outbox is not None
+        while True:
+            channel, payload = await self._outbox.get()
+            try:
+                await self._send(channel, payload)
+                self._published += 1
+            except Exception:
+                self._errors += 1
+                logger.exception("Failed to publish stream event on %s", channel)
+
+    async def _send(self, channel: str, payload: str) -> None:
+        raise NotImplementedError
+
+
+class RedisBackend(_QueuedPublisher):
+    """Redis pub/sub with one channel per session; seqs are counters in Redis."""
+
+    name = "redis"
+    # Idle sessions' counters expire; the event store's last seq seeds them again
+    SEQ_TTL = 7 * 24 * 3600
+    ALLOCATE_SCRIPT = """
+local last = math.max(tonumber(redis.call('GET', KEYS[1]) or '0'), tonumber(ARGV[2])) + tonumber(ARGV[1])
+redis.call('SET', KEYS[1], last, 'EX', ARGV[3])
+return last
+"""
+
+    def __init__(self, url: str, channel_prefix: str, max_queued: int):
+        if redis_asyncio is None:
+            raise RuntimeError("stream_backend=redis requires the redis package")
+        super().__init__(channel_prefix, max_queued)
+        self._redis = redis_asyncio.from_url(url, decode_responses=True)
+        self._pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+        self._sessions: Dict[str, str] = {}
+        self._has_channels = asyncio.Event()
+        self._reader: Optional[asyncio.Task] = None
+
+    async def start(self, deliver: Deliver) -> None:
+        await super().start(deliver)
+        self._reader = asyncio.create_task(self._read_loop(), name="redis-subscriber")
+
+    async def stop(self) -> None:
+        if self._reader is not None:
+            self._reader.cancel()
+            await asyncio.gather(self._reader, return_exceptions=True)
+            self._reader = None
+        await super().stop()
+        await self._pubsub.aclose()
+        await self._redis.aclose()
+
+    async def _send(self, channel: str, payload: str) -> None:
+        await self._redis.publish(channel, payload)
+
+    def _seq_key(self, session_id: str) -> str:
+        return f"{self.channel_prefix}seq:{session_id}"
+
+    async def last_seq(self, session_id: str) -> int:
+        return int(await self._redis.get(self._seq_key(session_id)) or 0)
+
+    async def allocate_seqs(self, session_id: str, count: int, floor: int) -> int:
+        return int(
+            await self._redis.eval(self.ALLOCATE_SCRIPT, 1, self._seq_key(session_id), count, floor, self.SEQ_TTL)
+        )
+
+    async def _listen(self, session_id: str) -> None:
+        channel = self.channel(session_id)
+        self._sessions[channel] = session_id
+        await self._pubsub.subscribe(channel)
+        self._has_channels.set()
+
+    async def _unlisten(self, session_id: str) -> None:
+        channel = self.channel(session_id)
+        self._sessions.pop(channel, None)
+        await self._pubsub.unsubscribe(channel)
+        if not self._sessions:
+            self._has_channels.clear()
+
+    async def _read_loop(self) -> None:
+        while True:
+            # get_message needs at least one subscription
+            await self._has_channels.wait()
+            try:
+                message = await self._pubsub.get_message(timeout=1.0)
+            except Exception:
+                self._errors += 1
+                logger.exception("Redis subscriber failed, retrying")
+                await asyncio.sleep(1.0)
+                continue
+            if message and message.get("type") == "message":
+                session_id = self._sessions.get(message["channel"])
+                if session_id is not None:
+                    self._receive(session_id, message["data"])
+
+
+class PostgresBackend(_QueuedPublisher):
+    """Postgres LISTEN/NOTIFY with one channel per session.
+
+    NOTIFY payloads are limited to 8000 bytes; bigger events are written to an
+    unlogged spill table and the notification only carries the row id. Seqs
+    are counters in the `stream_seqs` table.
+    """
+
+    name = "postgres"
+    MAX_PAYLOAD = 7900
+    SPILL_TTL = "5 minutes"
+
+    def __init__(self, dsn: str, channel_prefix: str, max_queued: int):
+        if asyncpg is None:
+            raise RuntimeError("stream_backend=postgres requires the asyncpg package")
+        super().__init__(channel_prefix, max_queued)
+        self.dsn = dsn
+        # LISTEN connection; NOTIFYs and spill reads/writes use a small pool
+        self._listen_conn = None
+        self._listen_lock = asyncio.Lock()
+        self._pool = None
+        self._sessions: Dict[str, str] = {}
+        # Notifications are handled in arrival order by one task, since spilled
+        # payloads have to be fetched first
+        self._inbox: asyncio.Queue = asyncio.Queue()
+        self._reader: Optional[asyncio.Task] = None
+        self._spilled = 0
+
+    async def start(self, deliver: Deliver) -> None:
+        self._listen_conn = await asyncpg.connect(self.dsn)
+        self._pool = await asyncpg.create_pool(self.dsn, min_size=1, max_size=2)
+        await self._pool.execute(
+            "CREATE UNLOGGED TABLE IF NOT EXISTS stream_spill ("
+            "id bigserial PRIMARY KEY, payload text NOT NULL, created_at timestamptz NOT NULL DEFAULT now())"
+        )
+        await self._pool.execute(
+            "CREATE TABLE IF NOT EXISTS stream_seqs (session_id text PRIMARY KEY, seq bigint NOT NULL)"
+        )
+        await super().start(deliver)
+        self._reader = asyncio.create_task(self._read_loop(), name="postgres-listener")
+
+    async def stop(self) -> None:
+        if self._reader is not None:
+            self._reader.cancel()
+            await asyncio.gather(self._reader, return_exceptions=True)
+            self._reader = None
+        await super().stop()
+        if self._listen_conn is not None:
+            await self._listen_conn.close()
+            self._listen_conn = None
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+
+    async def _send(self, channel: str, payload: str) -> None:
+        if len(payload.encode()) > self.MAX_PAYLOAD:
+            row_id = await self._pool.fetchval(
+                "INSERT INTO stream_spill (payload) VALUES ($1) RETURNING id", payload
+            )
+            self._spilled += 1
+            if self._spilled % 100 == 0:
+                await self._pool.execute(
+                    f"DELETE FROM stream_spill WHERE created_at < now() - interval '{self.SPILL_TTL}'"
+                )
+            payload = f"@{row_id}"
+        await self._pool.execute("SELECT pg_notify($1, $2)", channel, payload)
+
+    async def last_seq(self, session_id: str) -> int:
+        return await self._pool.fetchval("SELECT seq FROM stream_seqs WHERE session_id = $1", session_id) or 0
+
+    async def allocate_seqs(self, session_id: str, count: int, floor: int) -> int:
+        return await self._pool.fetchval(
+            "INSERT INTO stream_seqs (session_id, seq) VALUES ($1, $3::bigint + $2::bigint) "
+            "ON CONFLICT (session_id) DO UPDATE SET seq = GREATEST(stream_seqs.seq, $3::bigint) + $2::bigint "
+            "RETURNING seq",
+            session_id,
+            count,
+            floor,
+        )
+
+    async def _listen(self, session_id: str) -> None:
+        channel = self.channel(session_id)
+        self._sessions[channel] = session_id
+        async with self._listen_lock:
+            await self._listen_conn.add_listener(channel, self._on_notify)
+
+    async def _unlisten(self, session_id: str) -> None:
+        channel = self.channel(session_id)
+        self._sessions.pop(channel, None)
+        async with self._listen_lock:
+            await self._listen_conn.remove_listener(channel, self._on_notify)
+
+    def _on_notify(self, connection, pid, channel: str, payload: str) -> None:
+        self._inbox.put_nowait((channel, payload))
+
+    async def _read_loop(self) -> None:
+        while True:
+            channel, payload = await self._inbox.get()
+            session_id = self._sessions.get(channel)
+            if session_id is None:
+                continue
+            try:
+                if payload.startswith("@"):
+                    payload = await self._pool.fetchval(
+                        "SELECT payload FROM stream_spill WHERE id = $1", int(payload[1:])
+                    )
+                    if payload is None:
+                        continue
+                self._receive(session_id, payload)
+            except Exception:
+                self._errors += 1
+                logger.exception("Failed to handle notification on %s", channel)
+
+    def stats(self) -> Dict[str, Any]:
+        return {**super().stats(), "spilled": self._spilled}
+
+
+def postgres_dsn(database_url: str) -> str:
+    """Plain libpq DSN for a SQLAlchemy Postgres URL (any driver)."""
+    return make_url(database_url).set(drivername="postgresql").render_as_string(hide_password=False)
+
+
+def create_backend() -> BroadcastBackend:
+    if settings.stream_backend == "redis":
+        return RedisBackend(settings.redis_url, settings.stream_channel_prefix, settings.stream_backend_max_queued)
+    if settings.stream_backend == "postgres":
+        dsn = settings.stream_postgres_dsn or postgres_dsn(settings.database_url)
+        return PostgresBackend(dsn, settings.stream_channel_prefix, settings.stream_backend_max_queued)
+    if settings.stream_backend == "memory":
+        return MemoryBackend()
+    return BroadcastBackend()
@@ -0,0 +1,98 @@
+from __future__ import annotations
+
+import json
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+from ..config import get_settings
+
+
+settings = get_settings()
+
+
+@dataclass
+class CachedConversation:
+    # Beta-format messages built from every stored row up to high_water
+    messages: List[Dict[str, Any]]
+    # Message.seq of the newest row already folded into `messages`
+    high_water: int
+    size: int
+
+
+def message_size(message: Dict[str, Any]) -> int:
+    """Approximate in-memory footprint of a message, measured as its JSON length."""
+    return len(json.dumps(message, default=str))
+
+
+def copy_messages(messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Copy messages deep enough that sampling_loop can mutate them safely.
+
+    The loop sets/pops `cache_control` on content blocks and filters tool_result
+    content lists, so messages and blocks are copied while strings (including
+    large base64 payloads) stay shared.
+    """
+    copied = []
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, list):
+            content = [dict(block) if isinstance(block, dict) else block for block in content]
+        copied.append({**message, "content": content})
+    return copied
+
+
+class ConversationCache:
+    """Per-session LRU of converted conversation history.
+
+    Bounded both by number of sessions and by the approximate total size of the
+    cached messages; the least recently used sessions are evicted first.
+    """
+
+    def __init__(self, max_sessions: int, max_bytes: int):
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, CachedConversation]" = OrderedDict()
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def get(self, session_id: str) -> Optional[CachedConversation]:
+        entry = self._entries.get(session_id)
+        if entry is None:
+            self._misses += 1
+            return None
+        self._hits += 1
+        self._entries.move_to_end(session_id)
+        return entry
+
+    def put(self, session_id: str, entry: CachedConversation) -> None:
+        self.invalidate(session_id)
+        if entry.size > self.max_bytes:
+            return
+        self._entries[session_id] = entry
+        self._bytes += entry.size
+        while len(self._entries) > self.max_sessions or self._bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= evicted.size
+            self._evictions += 1
+
+    def invalidate(self, session_id: str) -> None:
+        entry = self._entries.pop(session_id, None)
+        if entry is not None:
+            self._bytes -= entry.size
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "sessions": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self._hits,
+            "misses": self._misses,
+            "evictions": self._evictions,
+        }
+
+
+conversation_cache = ConversationCache(
+    max_sessions=settings.conversation_cache_max_sessions,
+    max_bytes=settings.conversation_cache_max_bytes,
+)
@@ -0,0 +1,174 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple, TypeVar
+
+from sqlalchemy.orm import Session as OrmSession
+
+from ..config import get_settings
+from ..database import AsyncSessionLocal, SessionLocal, is_sqlite, is_sqlite_memory
+
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+WriteFn = Callable[[OrmSession], Any]
+
+# Queue sentinel telling the writer to exit
+_STOP: Tuple[Any, Any] = (None, None)
+
+
+class DBWriter:
+    """Single serialized writer for message and session writes.
+
+    SQLite allows one writer at a time; letting every request and agent
+    callback open its own write transaction ends in busy waits or
+    `database is locked`. Instead, writes are submitted as functions that take
+    a sync ORM session, run one after another on a dedicated thread and
+    connection, and pending writes are group-committed in one transaction.
+
+    For other databases (or with `sqlite_single_writer` off) each write runs
+    in its own session without serialization.
+    """
+
+    def __init__(self, batch_size: int, serialize: bool):
+        self.batch_size = batch_size
+        self.serialize = serialize
+        self._queue: Optional[asyncio.Queue[Tuple[WriteFn, asyncio.Future]]] = None
+        self._task: Optional[asyncio.Task] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._session: Optional[OrmSession] = None
+        self._writes = 0
+        self._commits = 0
+        self._failed = 0
+        self._commit_time = 0.0
+
+    async def start(self) -> None:
+        if not self.serialize or self._task is not None:
+            return
+        self._queue = asyncio.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+        self._task = asyncio.create_task(self._drain(), name="db-writer")
+
+    async def stop(self) -> None:
+        if self._task is None or self._queue is None:
+            return
+        await self._queue.put(_STOP)
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        self._queue = None
+        if self._session is not None:
+            await self._in_writer(self._session.close)
+            self._session = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    async def run(self, fn: Callable[[OrmSession], T]) -> T:
+        """Apply `fn(session)` and commit. `fn` must not commit itself.
+
+        Objects returned by `fn` stay usable after the commit (attributes are
+        not expired) but are detached from the writer's session.
+        """
+        if self._queue is not None:
+            future = asyncio.get_running_loop().create_future()
+            await self._queue.put((fn, future))
+            return await future
+        if AsyncSessionLocal is not None:
+            async with AsyncSessionLocal() as db:
+                result = await db.run_sync(fn)
+                await db.commit()
+                return result
+        return await asyncio.to_thread(self._run_once, fn)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "serialized": self._queue is not None,
+            "queued": self._queue.qsize() if self._queue else 0,
+            "writes": self._writes,
+            "commits": self._commits,
+            "failed": self._failed,
+            "avg_batch": self._writes / self._commits if self._commits else 0.0,
+            "avg_commit_ms": 1000 * self._commit_time / self._commits if self._commits else 0.0,
+        }
+
+    @staticmethod
+    def _run_once(fn: WriteFn) -> Any:
+        db = SessionLocal(expire_on_commit=False)
+        try:
+            result = fn(db)
+            db.commit()
+            return result
+        finally:
+            db.close()
+
+    async def _in_writer(self, fn: Callable[..., T], *args) -> T:
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    async def _drain(self) -> None:
+        assert self._queue is not None
+        while True:
+            jobs = [await self._queue.get()]
+            while len(jobs) < self.batch_size and not self._queue.empty():
+                jobs.append(self._queue.get_nowait())
+            stopping = _STOP in jobs
+            jobs = [job for job in jobs if job is not _STOP]
+            if jobs:
+                await self._in_writer(self._apply_batch, jobs)
+            if stopping:
+                return
+
+    def _apply_batch(self, jobs: List[Tuple[WriteFn, asyncio.Future]]) -> None:
+        """Runs on the writer thread: group-commit a batch of writes."""
+        if self._session is None:
+            self._session = SessionLocal(expire_on_commit=False)
+        db = self._session
+        started = time.monotonic()
+        try:
+            results = []
+            for fn, _ in jobs:
+                results.append(fn(db))
+                db.flush()
+            db.commit()
+        except Exception as exc:
+            db.rollback()
+            if len(jobs) > 1:
+                # Retry one by one so a single bad write doesn't fail its neighbours
+                for job in jobs:
+                    self._apply_batch([job])
+                return
+            self._failed += 1
+            logger.exception("Database write failed")
+            self._resolve(jobs[0][1], error=exc)
+            return
+        finally:
+            db.expunge_all()
+        self._commits += 1
+        self._writes += len(jobs)
+        self._commit_time += time.monotonic() - started
+        for (_, future), result in zip(jobs, results):
+            self._resolve(future, result=result)
+
+    @staticmethod
+    def _resolve(future: asyncio.Future, result: Any = None, error: Optional[BaseException] = None) -> None:
+        loop = future.get_loop()
+
+        def _set():
+            if future.done():
+                return
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+        loop.call_soon_threadsafe(_set)
+
+
+db_writer = DBWriter(
+    batch_size=settings.db_writer_batch_size,
+    serialize=is_sqlite and not is_sqlite_memory and settings.sqlite_single_writer,
+)
@@ -1,10 +1,15 @@
 from __future__ import annotations
 
-from typing import Any, Dict, Optional
+import asyncio
+import logging
+import time
+from typing import Any, Dict, List, Optional
 
 from ..config import get_settings
+from .media_store import media_store
 
 settings = get_settings()
+logger = logging.getLogger(__name__)
 
 try:
     from pymongo import MongoClient  # type: ignore
@@ -12,35 +17,170 @@ except Exception:  # pragma: no cover
     MongoClient = None  # type: ignore
 
 
+# Queue sentinel telling the writer to flush and exit
+_STOP: Dict[str, Any] = {}
+
+
 class EventStore:
+    """Optional MongoDB event log with a write-behind buffer.
+
+    `append` only enqueues the event; a background task drains the queue and
+    writes batches with `insert_many` in a worker thread, so streaming never
+    waits on a Mongo round trip.
+    """
+
     def __init__(self):
         self.client = None
         self.coll = None
+        self.batch_size = settings.event_store_batch_size
+        self.flush_interval = settings.event_store_flush_interval
+        self.max_queued = settings.event_store_max_queued
+        # "drop": discard new events when full; "block": `append_async` waits
+        # for room (sync `append` still drops, it cannot wait)
+        self.overflow_policy = settings.event_store_overflow_policy
+        self._queue: Optional[asyncio.Queue[Dict[str, Any]]] = None
+        self._writer: Optional[asyncio.Task] = None
+        self._written = 0
+        self._dropped = 0
+        self._batches = 0
+        self._failed = 0
         if settings.mongodb_uri and MongoClient is not None:
             try:
                 self.client = MongoClient(settings.mongodb_uri)
                 self.coll = self.client[settings.mongodb_db]["session_events"]
                 self.coll.create_index("session_id")
                 self.coll.create_index("at")
+                self.coll.create_index([("session_id", 1), ("seq", 1)])
             except Exception:
                 self.client = None
                 self.coll = None
 
+    async def start(self) -> None:
+        if self.coll is None or self._writer is not None:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queued)
+        self._writer = asyncio.create_task(self._drain(), name="event-store-writer")
+
+    async def stop(self) -> None:
+        """Stop the writer and flush whatever is still buffered."""
+        if self._writer is None or self._queue is None:
+            return
+        await self._queue.put(_STOP)
+        await asyncio.gather(self._writer, return_exceptions=True)
+        self._writer = None
+        pending = self._take_batch(self._queue.qsize())
+        if pending:
+            await self._write(pending)
+        self._queue = None
+
     def append(self, session_id: str, event: Dict[str, Any]) -> None:
-        if not self.coll:
+        if self.coll is None:
+            return
+        # Events store media references, never image bytes
+        doc = media_store.resolve_images({"session_id": session_id, **event})
+        if self._queue is None:
+            # Writer not running (e.g. outside the app lifespan): write inline
+            self._insert([doc])
             return
-        doc = {"session_id": session_id, **event}
         try:
-            self.coll.insert_one(doc)
-        except Exception:
-            pass
+            self._queue.put_nowait(doc)
+        except asyncio.QueueFull:
+            # Even under "block": waiting here would stall the event loop, and a
+            # put task per event would pile up unboundedly and reorder events
+            self._dropped += 1
+
+    async def append_async(self, session_id: str, event: Dict[str, Any]) -> None:
+        """Like `append`, but waits for room when the buffer is full and the policy is "block"."""
+        if self.coll is None:
+            return
+        if self._queue is not None and self.overflow_policy == "block":
+            await self._queue.put(media_store.resolve_images({"session_id": session_id, **event}))
+            return
+        self.append(session_id, event)
 
-    def list(self, session_id: str, limit: int = 500) -> list[Dict[str, Any]]:
-        if not self.coll:
+    def list(self, session_id: str, limit: int = 500, since: Optional[int] = None) -> list[Dict[str, Any]]:
+        if self.coll is None:
             return []
-        return list(self.coll.find({"session_id": session_id}).sort("at", 1).limit(limit))
+        if since is not None:
+            query = {"session_id": session_id, "seq": {"$gt": since}}
+            return list(self.coll.find(query, {"_id": 0}).sort("seq", 1).limit(limit))
+        return list(self.coll.find({"session_id": session_id}, {"_id": 0}).sort("at", 1).limit(limit))
 
+    def list_range(self, session_id: str, after: int, upto: int) -> list[Dict[str, Any]]:
+        """Stored events with `after < seq <= upto`."""
+        if self.coll is None:
+            return []
+        query = {"session_id": session_id, "seq": {"$gt": after, "$lte": upto}}
+        return list(self.coll.find(query, {"_id": 0}).sort("seq", 1))
 
-event_store = EventStore()
+    def last_seq(self, session_id: str) -> int:
+        if self.coll is None:
+            return 0
+        try:
+            doc = self.coll.find_one(
+                {"session_id": session_id, "seq": {"$exists": True}},
+                {"seq": 1},
+                sort=[("seq", -1)],
+            )
+        except Exception:
+            logger.exception("Failed to read the last event seq for %s", session_id)
+            return 0
+        return doc["seq"] if doc else 0
 
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.coll is not None,
+            "queued": self._queue.qsize() if self._queue else 0,
+            "written": self._written,
+            "batches": self._batches,
+            "dropped": self._dropped,
+            "failed": self._failed,
+        }
+
+    async def _drain(self) -> None:
+        assert self._queue is not None
+        while True:
+            first = await self._queue.get()
+            if first is _STOP:
+                return
+            batch = [first]
+            # Keep collecting until the batch is full or the flush interval elapses
+            deadline = time.monotonic() + self.flush_interval
+            stopping = False
+            while len(batch) < self.batch_size:
+                more = self._take_batch(self.batch_size - len(batch))
+                if any(doc is _STOP for doc in more):
+                    more = [doc for doc in more if doc is not _STOP]
+                    stopping = True
+                batch.extend(more)
+                remaining = deadline - time.monotonic()
+                if stopping or remaining <= 0:
+                    break
+                await asyncio.sleep(min(remaining, 0.05))
+            await self._write(batch)
+            if stopping:
+                return
+
+    def _take_batch(self, n: int) -> List[Dict[str, Any]]:
+        batch: List[Dict[str, Any]] = []
+        while self._queue is not None and len(batch) < n:
+            try:
+                batch.append(self._queue.get_nowait())
+            except asyncio.QueueEmpty:
+                break
+        return batch
 
+    async def _write(self, batch: List[Dict[str, Any]]) -> None:
+        await asyncio.to_thread(self._insert, batch)
+
+    def _insert(self, batch: List[Dict[str, Any]]) -> None:
+        try:
+            self.coll.insert_many(batch, ordered=True)
+            self._written += len(batch)
+            self._batches += 1
+        except Exception:
+            self._failed += len(batch)
+            logger.exception("Failed to persist %d events", len(batch))
+
+
+event_store = EventStore()
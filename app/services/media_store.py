@@ -0,0 +1,212 @@
+from __future__ import annotations
+
+import asyncio
+import base64
+import contextlib
+import hashlib
+import os
+import tempfile
+import weakref
+from pathlib import Path
+from typing import IO, Any, Callable, Dict, Optional, Tuple
+
+from computer_use_demo.tools.base import ImageHandle
+
+from ..config import get_settings
+
+try:
+    from PIL import Image  # type: ignore
+except Exception:  # pragma: no cover
+    Image = None  # type: ignore
+
+
+settings = get_settings()
+
+MEDIA_URL_PREFIX = "/media"
+THUMBS_URL_PREFIX = "/thumbs"
+EXTENSIONS = {
+    "image/png": ".png",
+    "image/jpeg": ".jpg",
+    "image/webp": ".webp",
+    "image/gif": ".gif",
+}
+
+
+class MediaStore:
+    """Content-addressed file store for screenshots and other binary media.
+
+    Files are keyed by the SHA-256 of their bytes and served by the `/media`
+    static mount, so identical frames are written once and events/messages
+    only carry a small reference instead of inline base64.
+
+    Storing hashes and writes the file, so code on the event loop stores
+    images with `put_image_async`, which does that in a worker thread.
+    """
+
+    def __init__(self, root: str):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        # Refs of image handles already stored, for as long as the handle lives
+        self._image_refs: "weakref.WeakKeyDictionary[ImageHandle, Dict[str, str]]" = weakref.WeakKeyDictionary()
+
+    def put(self, data: bytes, media_type: str = "image/png") -> Dict[str, str]:
+        digest = hashlib.sha256(data).hexdigest()
+        rel = self._relpath(digest, media_type)
+        path = self.root / rel
+        if not path.exists():
+            _write_atomic(path, lambda f: f.write(data))
+        return {"sha256": digest, "media_type": media_type, "url": f"{MEDIA_URL_PREFIX}/{rel}"}
+
+    def put_base64(self, data: str, media_type: str = "image/png") -> Dict[str, str]:
+        return self.put(base64.b64decode(data), media_type)
+
+    def put_image(self, image: ImageHandle) -> Dict[str, str]:
+        """Store a tool result image from its raw bytes, without a base64 round trip.
+
+        The ref is remembered for the handle, so handing the same image over
+        again (in its event, then in the stored transcript) costs nothing.
+        """
+        ref = self._image_refs.get(image)
+        if ref is None:
+            ref = self._image_refs[image] = self.put(image.data, image.media_type)
+        return ref
+
+    async def put_image_async(self, image: ImageHandle) -> Dict[str, str]:
+        """`put_image` with the hashing and file write done in a worker thread."""
+        ref = self._image_refs.get(image)
+        if ref is None:
+            ref = await asyncio.to_thread(self.put, image.data, image.media_type)
+            self._image_refs[image] = ref
+        return ref
+
+    def resolve_images(self, value: Any) -> Any:
+        """Replace image handles in `value` (nested dicts and lists, in place) with media refs.
+
+        Handles not yet stored are stored inline; async callers store them
+        with `put_image_async` first.
+        """
+        if isinstance(value, ImageHandle):
+            return self.put_image(value)
+        if isinstance(value, dict):
+            for key, item in value.items():
+                if isinstance(item, (dict, list, ImageHandle)):
+                    value[key] = self.resolve_images(item)
+        elif isinstance(value, list):
+            for i, item in enumerate(value):
+                if isinstance(item, (dict, list, ImageHandle)):
+                    value[i] = self.resolve_images(item)
+        return value
+
+    def read(self, digest: str, media_type: str = "image/png") -> Optional[bytes]:
+        path = self.root / self._relpath(digest, media_type)
+        try:
+            return path.read_bytes()
+        except OSError:
+            return None
+
+    def thumbnail(self, digest: str, width: int) -> Optional[Tuple[Path, str]]:
+        """Path and media type of a JPEG thumbnail of a stored image, created on first use.
+
+        Falls back to the original image when Pillow isn't installed; None if
+        the image isn't in the store.
+        """
+        for media_type in EXTENSIONS:
+            source = self.root / self._relpath(digest, media_type)
+            if source.exists():
+                break
+        else:
+            return None
+        if Image is None:
+            return source, media_type
+        path = self.root / "thumbs" / digest[:2] / f"{digest}_{width}.jpg"
+        if not path.exists():
+            with Image.open(source) as image:
+                image.thumbnail((width, width * 4))
+                thumb = image.convert("RGB")
+            _write_atomic(path, lambda f: thumb.save(f, "JPEG", quality=70))
+        return path, "image/jpeg"
+
+    def externalize(self, content: Any, images: Optional[Dict[str, ImageHandle]] = None) -> Any:
+        """Return a copy of message content with base64 image sources replaced by media refs.
+
+        `images` maps tool_use ids to the image handle their tool result was
+        built from; those images are stored from the handle's bytes instead of
+        decoding the base64 again.
+        """
+        return self._externalize(content, images or {}, None)
+
+    def _externalize(self, content: Any, images: Dict[str, ImageHandle], image: Optional[ImageHandle]) -> Any:
+        if isinstance(content, list):
+            return [self._externalize(item, images, image) for item in content]
+        if not isinstance(content, dict):
+            return content
+        source = content.get("source")
+        if content.get("type") == "image" and isinstance(source, dict) and source.get("type") == "base64":
+            if image is not None and source["data"] is image.base64:
+                ref = self.put_image(image)
+            else:
+                ref = self.put_base64(source["data"], source.get("media_type", "image/png"))
+            return {**content, "source": {"type": "media", **ref}}
+        if isinstance(content.get("content"), list):
+            image = images.get(content["tool_use_id"]) if content.get("type") == "tool_result" else None
+            return {**content, "content": self._externalize(content["content"], images, image)}
+        return content
+
+    def internalize(self, content: Any) -> Any:
+        """Inverse of `externalize`: restore base64 image sources from the store."""
+        if isinstance(content, list):
+            return [self.internalize(item) for item in content]
+        if not isinstance(content, dict):
+            return content
+        source = content.get("source")
+        if content.get("type") == "image" and isinstance(source, dict) and source.get("type") == "media":
+            media_type = source.get("media_type", "image/png")
+            data = self.read(source["sha256"], media_type)
+            if data is None:
+                return {"type": "text", "text": "[image no longer available]"}
+            return {
+                **content,
+                "source": {
+                    "type": "base64",
+                    "media_type": media_type,
+                    "data": base64.b64encode(data).decode(),
+                },
+            }
+        if isinstance(content.get("content"), list):
+            return {**content, "content": self.internalize(content["content"])}
+        return content
+
+    @staticmethod
+    def _relpath(digest: str, media_type: str) -> str:
+        return f"{digest[:2]}/{digest}{EXTENSIONS.get(media_type, '.bin')}"
+
+
+def _write_atomic(path: Path, write: Callable[[IO[bytes]], Any]) -> None:
+    """Create `path` through a temp file, so readers never see a partial file.
+
+    The temp file gets a unique name: threads and processes storing the same
+    file at once each write their own and the last rename wins.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    f = tempfile.NamedTemporaryFile(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp", delete=False)
+    try:
+        with f:
+            write(f)
+        os.replace(f.name, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.unlink(f.name)
+        raise
+
+
+def thumbnail_ref(ref: Dict[str, str]) -> Dict[str, Any]:
+    """Reference to the thumbnail of a stored image; it is generated when first fetched."""
+    return {
+        "sha256": ref["sha256"],
+        "media_type": "image/jpeg",
+        "url": f"{THUMBS_URL_PREFIX}/{ref['sha256']}.jpg",
+        "thumbnail": True,
+    }
+
+
+media_store = MediaStore(settings.media_dir)
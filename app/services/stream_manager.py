@@ -1,39 +1,558 @@
 import asyncio
-from typing import Dict, List
+import json
+import logging
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple
 
 from starlette.websockets import WebSocket
 
+from ..config import get_settings
+from .broadcast import BroadcastBackend, create_backend
+from .event_store import event_store
+from .media_store import media_store
+from .stream_profiles import EventVariants
+
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+# Event types that only describe current state, so a slow subscriber can skip
+# straight to the newest one instead of receiving every intermediate value
+COALESCE_TYPES = {"api"}
+
+# Close code sent to subscribers evicted by the "disconnect" policy (try again later)
+SLOW_CONSUMER_CLOSE_CODE = 1013
+
+
+class Subscriber:
+    """One WebSocket connection: its session subscriptions, profile (see
+    services/stream_profiles.py), an optional event type filter, and a bounded
+    send queue drained by a writer task.
+
+    Frames are already-serialized JSON strings shared by every subscriber with
+    the same profile. `offer` never awaits, so a slow client only ever fills its
+    own queue.
+    """
+
+    def __init__(self, manager: "StreamManager", websocket: WebSocket, profile: str = "full", images: str = "ref"):
+        self.manager = manager
+        self.websocket = websocket
+        self.profile = profile
+        self.images = images
+        self.max_queued = manager.max_queued
+        self.policy = manager.policy
+        self.sessions: Set[str] = set()
+        # Event types to send; None sends everything
+        self.types: Optional[Set[str]] = None
+        self._queue: Deque[Tuple[Optional[str], str]] = deque()
+        # Live frames held back per session while its missed events are fetched
+        self._holding: Dict[str, List[Tuple[Optional[str], Optional[str], str]]] = {}
+        self._ready = asyncio.Event()
+        self._closed = asyncio.Event()
+        self._writer = asyncio.create_task(self._write(), name="ws-writer")
+
+    @property
+    def closed(self) -> bool:
+        return self._closed.is_set()
+
+    async def wait_closed(self) -> None:
+        await self._closed.wait()
+
+    def offer(self, session_id: str, kind: Optional[str], frame: str, key: Optional[str] = None) -> None:
+        if self.closed or (self.types is not None and kind not in self.types):
+            return
+        held = self._holding.get(session_id)
+        if held is not None:
+            held.append((kind, key, frame))
+            return
+        if len(self._queue) >= self.max_queued:
+            if self.policy == "disconnect":
+                self.manager._disconnected += 1
+                self._shutdown()
+                asyncio.get_running_loop().create_task(self._close_socket(SLOW_CONSUMER_CLOSE_CODE))
+                return
+            if self.policy == "coalesce" and key is not None and self._coalesce(key):
+                self.manager._coalesced += 1
+            else:
+                self.manager._dropped += 1
+                return
+        self._queue.append((key, frame))
+        self._ready.set()
+
+    def send_control(self, message: Dict[str, Any]) -> None:
+        """Queue a control frame (ping, reply, resync); filters and the queue bound don't apply."""
+        if self.closed:
+            return
+        self._queue.append((None, json.dumps(message, default=str)))
+        self._ready.set()
+
+    def hold(self, session_id: str) -> None:
+        self._holding.setdefault(session_id, [])
+
+    def release(self, session_id: str, replay: List[Tuple[Optional[str], str]]) -> None:
+        """Send the `replay` frames, then the live frames held since `hold`."""
+        held = self._holding.pop(session_id, [])
+        for kind, frame in replay:
+            if self.types is None or kind in self.types:
+                variant = EventVariants(frame).get(self.profile, self.images)
+                if variant is not None:
+                    self._queue.append((None, variant))
+        if self._queue:
+            self._ready.set()
+        for kind, key, frame in held:
+            self.offer(session_id, kind, frame, key)
+
+    def _coalesce(self, key: str) -> bool:
+        """Remove the queued frame the new one supersedes, if any."""
+        for i, (queued_key, _) in enumerate(self._queue):
+            if queued_key == key:
+                del self._queue[i]
+                return True
+        return False
+
+    async def close(self, code: int = 1000) -> None:
+        if self.closed:
+            return
+        self._shutdown()
+        await self._close_socket(code)
+
+    def _shutdown(self) -> None:
+        self._closed.set()
+        self._writer.cancel()
+        self._queue.clear()
+        self._holding.clear()
+        self.manager._remove(self)
+
+    async def _close_socket(self, code: int) -> None:
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            pass
+
+    async def _write(self) -> None:
+        try:
+            while True:
+                await self._ready.wait()
+                while self._queue:
+                    _, frame = self._queue.popleft()
+                    await self.websocket.send_text(frame)
+                    self.manager._sent += 1
+                self._ready.clear()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # Client went away; drop it without waiting for the route to notice
+            self._closed.set()
+            self._queue.clear()
+            self.manager._remove(self)
+
 
 class StreamManager:
-    def __init__(self):
-        self._session_connections: Dict[str, List[WebSocket]] = {}
-        self._lock = asyncio.Lock()
+    """Fans session events out to WebSocket subscribers.
+
+    Each event gets the next per-session `seq`, is serialized once (plus once
+    per subscriber profile that changes it), appended to the session's replay
+    ring and the event store, and enqueued on every subscriber's bounded queue
+    without awaiting; per-connection writer tasks do the sends. When a subscriber's queue is full the slow-consumer policy
+    applies: "drop" the new event, "coalesce" it with a queued event of the
+    same kind (falling back to drop), or "disconnect" the subscriber.
+
+    A session's last seq is loaded from the event store (in a worker thread)
+    when its stream is opened: by each subscription, and by publishers around
+    their events (`open`/`close`). It is dropped once nothing uses the session
+    and its replay ring has been evicted.
+
+    A connection can subscribe to several sessions; every frame carries its
+    `session_id`. Subscriber lists are immutable tuples replaced on
+    subscribe/unsubscribe, so publishing iterates a snapshot and needs no lock.
+
+    With several API nodes, each event is also published once on the broadcast
+    backend (see services/broadcast.py); every node delivers events from the
+    others to its own subscribers and records them in its ring, so any node can
+    serve a resume. Such backends allocate the seqs, so two nodes publishing
+    for one session never reuse a seq: events then wait in a per-session
+    queue until a sequencer task has reserved seqs for them, and go out in
+    the order they were published.
+    """
+
+    def __init__(
+        self,
+        max_queued: int,
+        policy: str,
+        replay_buffer: int,
+        replay_sessions: int,
+        replay_max_events: int,
+        backend: Optional[BroadcastBackend] = None,
+    ):
+        self.backend = backend or BroadcastBackend()
+        self.max_queued = max_queued
+        self.policy = policy
+        self.replay_buffer = replay_buffer
+        self.replay_sessions = replay_sessions
+        self.replay_max_events = replay_max_events
+        self._session_connections: Dict[str, Tuple[Subscriber, ...]] = {}
+        # Last assigned seq of sessions that are open or still have a replay
+        # ring; the ring's last event bounds any seq handed out before
+        self._seqs: Dict[str, int] = {}
+        # Open subscriptions and publishers per session
+        self._users: Dict[str, int] = {}
+        self._seq_loads: Dict[str, asyncio.Task] = {}
+        self._seq_loads_inline = 0
+        # Shared seqs: (message, transient, done) waiting for seqs, and the
+        # task reserving them, per session
+        self._unsequenced: Dict[str, Deque[Tuple[Dict[str, Any], bool, Optional[asyncio.Future]]]] = {}
+        self._sequencers: Dict[str, asyncio.Task] = {}
+        self._seq_errors = 0
+        # Recent (seq, type, frame) of the most recently active sessions
+        self._rings: "OrderedDict[str, Deque[Tuple[int, Optional[str], str]]]" = OrderedDict()
+        self._published = 0
+        self._sent = 0
+        self._dropped = 0
+        self._coalesced = 0
+        self._disconnected = 0
+        self._replayed = 0
+        self._resyncs = 0
+
+    async def start(self) -> None:
+        await self.backend.start(self._deliver_remote)
 
-    async def connect(self, session_id: str, websocket: WebSocket):
+    async def stop(self) -> None:
+        # Let queued events get their seqs and go out first
+        await asyncio.gather(*self._sequencers.values(), return_exceptions=True)
+        await self.backend.stop()
+
+    async def accept(self, websocket: WebSocket, profile: str = "full", images: str = "ref") -> Subscriber:
         await websocket.accept()
-        async with self._lock:
-            self._session_connections.setdefault(session_id, []).append(websocket)
+        return Subscriber(self, websocket, profile, images)
+
+    async def subscribe(self, subscriber: Subscriber, session_id: str, since: Optional[int] = None) -> int:
+        """Subscribe a connection to a session and return the session's current seq.
+
+        With `since`, events with a greater seq are replayed from the ring (or
+        the event store) before live ones; subscribing again to the same session
+        this way resumes it. If the missed events can no longer be replayed the
+        client gets a `resync` event and should reload the history instead.
+        """
+        if session_id in subscriber.sessions:
+            if since is None:
+                return self.current_seq(session_id)
+            self._detach(subscriber, session_id)
+        # Listen for other nodes' events first, so none fall between the
+        # subscription and reading the current seq below
+        await self.backend.subscribe(session_id)
+        await self.open(session_id)
+        if subscriber.closed:
+            latest = self.current_seq(session_id)
+            self.close(session_id)
+            await self.backend.unsubscribe(session_id)
+            return latest
+        # Registering and reading the current seq happen without an await in
+        # between, so every later event reaches the subscriber live
+        subscriber.sessions.add(session_id)
+        self._session_connections[session_id] = self._session_connections.get(session_id, ()) + (subscriber,)
+        latest = self.current_seq(session_id)
+        if since is None or since == latest:
+            return latest
+        subscriber.hold(session_id)
+        missed = await self._missed(session_id, since, latest)
+        if missed is None:
+            self._resyncs += 1
+            subscriber.send_control({"type": "resync", "session_id": session_id, "seq": latest})
+            subscriber.release(session_id, [])
+        else:
+            self._replayed += len(missed)
+            subscriber.release(session_id, missed)
+        return latest
+
+    async def unsubscribe(self, subscriber: Subscriber, session_id: str) -> None:
+        self._detach(subscriber, session_id)
+
+    async def connect(self, session_id: str, websocket: WebSocket, since: Optional[int] = None) -> Subscriber:
+        """Accept `websocket` and subscribe it to one session."""
+        subscriber = await self.accept(websocket)
+        await self.subscribe(subscriber, session_id, since)
+        return subscriber
 
     async def disconnect(self, session_id: str, websocket: WebSocket):
-        async with self._lock:
-            if session_id in self._session_connections:
-                conns = self._session_connections[session_id]
-                if websocket in conns:
-                    conns.remove(websocket)
-                if not conns:
-                    self._session_connections.pop(session_id, None)
+        for subscriber in self._session_connections.get(session_id, ()):
+            if subscriber.websocket is websocket:
+                await subscriber.close()
+
+    async def open(self, session_id: str) -> None:
+        """Start using a session's stream; pair with `close`.
+
+        The first user loads the session's last stored seq in a worker thread,
+        so numbering continues after it and resuming clients never see a seq
+        reused.
+        """
+        self._users[session_id] = self._users.get(session_id, 0) + 1
+        if session_id in self._seqs:
+            return
+        load = self._seq_loads.get(session_id)
+        if load is None:
+            load = self._seq_loads[session_id] = asyncio.create_task(self._load_seq(session_id))
+            load.add_done_callback(lambda _: self._seq_loads.pop(session_id, None))
+        try:
+            stored = await asyncio.shield(load)
+        except BaseException:
+            self.close(session_id)
+            raise
+        # Events recorded while loading (e.g. from other nodes) count too
+        self._seqs[session_id] = max(stored, self._seqs.get(session_id, 0))
+
+    def close(self, session_id: str) -> None:
+        users = self._users.get(session_id, 0) - 1
+        if users > 0:
+            self._users[session_id] = users
+            return
+        self._users.pop(session_id, None)
+        if session_id not in self._rings:
+            self._seqs.pop(session_id, None)
+
+    def current_seq(self, session_id: str) -> int:
+        seq = self._seqs.get(session_id)
+        if seq is None:
+            # Only for sessions nobody opened: the lookup blocks the event loop
+            self._seq_loads_inline += 1
+            seq = self._seqs[session_id] = event_store.last_seq(session_id)
+        return seq
+
+    def publish(self, session_id: str, message: Dict[str, Any]) -> None:
+        """Sequence, record and persist `message`, then enqueue it for every subscriber.
+
+        `seq` and `session_id` are added to `message` in place (with shared
+        seqs, once the sequencer gets to it).
+        """
+        if self.backend.shared_seqs:
+            self._enqueue(session_id, message)
+            return
+        frame = self._record(session_id, message)
+        event_store.append(session_id, message)
+        self._emit(session_id, message, frame)
+
+    def publish_transient(self, session_id: str, message: Dict[str, Any]) -> None:
+        """Send a live-only event, such as a text delta, to current subscribers.
+
+        It gets no `seq` and is neither stored nor replayed; whatever it
+        previews must also be published as a regular event.
+        """
+        if session_id in self._unsequenced:
+            # Keep it behind the events still waiting for seqs
+            self._enqueue(session_id, message, transient=True)
+            return
+        message["session_id"] = session_id
+        frame = json.dumps(message, default=str)
+        self._fan_out(session_id, message.get("type"), frame, message)
+        self.backend.publish(session_id, 0, message.get("type"), frame)
 
     async def broadcast(self, session_id: str, message: dict):
-        async with self._lock:
-            conns = list(self._session_connections.get(session_id, []))
-        for ws in conns:
+        """Like `publish`, but opens the session itself and waits for room in
+        the event store buffer when its policy is "block"."""
+        await self.open(session_id)
+        try:
+            if self.backend.shared_seqs:
+                done = asyncio.get_running_loop().create_future()
+                self._enqueue(session_id, message, done=done)
+                await done
+            else:
+                self._emit(session_id, message, self._record(session_id, message))
+        finally:
+            self.close(session_id)
+        await event_store.append_async(session_id, message)
+
+    def stats(self) -> Dict[str, Any]:
+        connections = {s for subs in self._session_connections.values() for s in subs}
+        return {
+            "sessions": len(self._session_connections),
+            "connections": len(connections),
+            "subscriptions": sum(len(subs) for subs in self._session_connections.values()),
+            "queued": sum(len(s._queue) for s in connections),
+            "published": self._published,
+            "sent": self._sent,
+            "dropped": self._dropped,
+            "coalesced": self._coalesced,
+            "disconnected": self._disconnected,
+            "replay_sessions": len(self._rings),
+            "replayed": self._replayed,
+            "resyncs": self._resyncs,
+            "seq_sessions": len(self._seqs),
+            "seq_loads_inline": self._seq_loads_inline,
+            "seq_errors": self._seq_errors,
+            "unsequenced": sum(len(queue) for queue in self._unsequenced.values()),
+            "backend": self.backend.stats(),
+        }
+
+    async def _load_seq(self, session_id: str) -> int:
+        seq = await asyncio.to_thread(event_store.last_seq, session_id)
+        if self.backend.shared_seqs:
             try:
-                await ws.send_json(message)
+                seq = max(seq, await self.backend.last_seq(session_id))
             except Exception:
-                # Best-effort cleanup
-                await self.disconnect(session_id, ws)
+                self._seq_errors += 1
+                logger.exception("Failed to read the shared seq of %s", session_id)
+        return seq
+
+    def _enqueue(
+        self,
+        session_id: str,
+        message: Dict[str, Any],
+        transient: bool = False,
+        done: Optional[asyncio.Future] = None,
+    ) -> None:
+        """Queue an event for the session's sequencer (shared seqs only).
+
+        `done` is resolved once the event went out; events without one are
+        also appended to the event store.
+        """
+        queue = self._unsequenced.get(session_id)
+        if queue is None:
+            queue = self._unsequenced[session_id] = deque()
+            self._sequencers[session_id] = asyncio.get_running_loop().create_task(
+                self._sequence(session_id), name=f"stream-sequencer-{session_id}"
+            )
+        queue.append((message, transient, done))
+
+    async def _sequence(self, session_id: str) -> None:
+        """Reserve seqs for the session's queued events and send them, in order, until none are left."""
+        queue = self._unsequenced[session_id]
+        opened = False
+        try:
+            await self.open(session_id)
+            opened = True
+            while queue:
+                # Everything queued so far shares one reservation
+                batch = list(queue)
+                count = sum(not transient for _, transient, _ in batch)
+                seq = await self._allocate(session_id, count) - count if count else 0
+                for _ in batch:
+                    queue.popleft()
+                for message, transient, done in batch:
+                    try:
+                        if transient:
+                            message["session_id"] = session_id
+                            frame = json.dumps(message, default=str)
+                            self._fan_out(session_id, message.get("type"), frame, message)
+                            self.backend.publish(session_id, 0, message.get("type"), frame)
+                        else:
+                            seq += 1
+                            self._emit(session_id, message, self._record(session_id, message, seq))
+                            if done is None:
+                                event_store.append(session_id, message)
+                    except Exception as exc:
+                        logger.exception("Failed to publish an event of %s", session_id)
+                        if done is not None and not done.done():
+                            done.set_exception(exc)
+                        continue
+                    if done is not None and not done.done():
+                        done.set_result(None)
+        finally:
+            for _, _, done in queue:
+                if done is not None and not done.done():
+                    done.cancel()
+            self._unsequenced.pop(session_id, None)
+            self._sequencers.pop(session_id, None)
+            if opened:
+                self.close(session_id)
+
+    async def _allocate(self, session_id: str, count: int) -> int:
+        floor = self._seqs.get(session_id, 0)
+        try:
+            return await self.backend.allocate_seqs(session_id, count, floor)
+        except Exception:
+            # Keep streaming on local numbering, which may collide with other nodes
+            self._seq_errors += 1
+            logger.exception("Failed to allocate shared seqs for %s", session_id)
+            return max(floor, self._seqs.get(session_id, 0)) + count
+
+    def _emit(self, session_id: str, message: Dict[str, Any], frame: str) -> None:
+        self._fan_out(session_id, message.get("type"), frame, message)
+        self.backend.publish(session_id, message["seq"], message.get("type"), frame)
+
+    def _record(self, session_id: str, message: Dict[str, Any], seq: Optional[int] = None) -> str:
+        # Image handles (tool result screenshots) go out as media references
+        media_store.resolve_images(message)
+        if seq is None:
+            seq = self.current_seq(session_id) + 1
+        message["seq"] = seq
+        message["session_id"] = session_id
+        frame = json.dumps(message, default=str)
+        self._remember(session_id, seq, message.get("type"), frame)
+        self._published += 1
+        return frame
+
+    def _deliver_remote(self, session_id: str, seq: int, kind: Optional[str], frame: str) -> None:
+        """Handle an event another node published."""
+        if seq:  # 0 for transient events
+            self._remember(session_id, seq, kind, frame)
+        self._fan_out(session_id, kind, frame)
+
+    def _remember(self, session_id: str, seq: int, kind: Optional[str], frame: str) -> None:
+        self._seqs[session_id] = max(seq, self._seqs.get(session_id, 0))
+        ring = self._rings.get(session_id)
+        if ring is None:
+            ring = self._rings[session_id] = deque(maxlen=self.replay_buffer)
+            while len(self._rings) > self.replay_sessions:
+                evicted, _ = self._rings.popitem(last=False)
+                if evicted not in self._users:
+                    self._seqs.pop(evicted, None)
+        else:
+            self._rings.move_to_end(session_id)
+        ring.append((seq, kind, frame))
+
+    def _fan_out(
+        self, session_id: str, kind: Optional[str], frame: str, message: Optional[Dict[str, Any]] = None
+    ) -> None:
+        subscribers = self._session_connections.get(session_id)
+        if not subscribers:
+            return
+        key = kind if kind in COALESCE_TYPES else None
+        # Each profile's variant is built once and shared
+        variants = EventVariants(frame, message)
+        for subscriber in subscribers:
+            variant = variants.get(subscriber.profile, subscriber.images)
+            if variant is not None:
+                subscriber.offer(session_id, kind, variant, key)
+
+    async def _missed(self, session_id: str, since: int, latest: int) -> Optional[List[Tuple[Optional[str], str]]]:
+        """(type, frame) for seqs in (since, latest], or None if they can't all be replayed."""
+        if since < 0 or since > latest or latest - since > self.replay_max_events:
+            return None
+        frames: Dict[int, Tuple[Optional[str], str]] = {}
+        ring = self._rings.get(session_id, ())
+        if not ring or ring[0][0] > since + 1:
+            # The ring doesn't reach back far enough; fill in from the event store
+            docs = await asyncio.to_thread(event_store.list_range, session_id, since, latest)
+            frames.update((doc["seq"], (doc.get("type"), json.dumps(doc, default=str))) for doc in docs)
+            ring = self._rings.get(session_id, ())
+        # The ring is re-read after the store lookup; it also covers events the
+        # store hasn't flushed yet
+        frames.update((seq, (kind, frame)) for seq, kind, frame in ring if since < seq <= latest)
+        if len(frames) != latest - since:
+            return None
+        return [frames[seq] for seq in range(since + 1, latest + 1)]
 
+    def _remove(self, subscriber: Subscriber) -> None:
+        for session_id in list(subscriber.sessions):
+            self._detach(subscriber, session_id)
 
-stream_manager = StreamManager()
+    def _detach(self, subscriber: Subscriber, session_id: str) -> None:
+        if session_id not in subscriber.sessions:
+            return
+        subscriber.sessions.discard(session_id)
+        self.close(session_id)
+        asyncio.get_running_loop().create_task(self.backend.unsubscribe(session_id))
+        remaining = tuple(s for s in self._session_connections.get(session_id, ()) if s is not subscriber)
+        if remaining:
+            self._session_connections[session_id] = remaining
+        else:
+            self._session_connections.pop(session_id, None)
 
 
+stream_manager = StreamManager(
+    max_queued=settings.stream_send_queue_size,
+    policy=settings.stream_slow_consumer_policy,
+    replay_buffer=settings.stream_replay_buffer,
+    replay_sessions=settings.stream_replay_sessions,
+    replay_max_events=settings.stream_replay_max_events,
+    backend=create_backend(),
+)
@@ -0,0 +1,81 @@
+from __future__ import annotations
+
+import json
+from typing import Any, Dict, Optional, Tuple
+
+from .media_store import thumbnail_ref
+
+
+# What a subscriber receives:
+#   full  - every event; `api` events without headers and body previews (default)
+#   chat  - conversation text only: user messages, text blocks, turn boundaries
+#   debug - every event in full, including API exchanges
+PROFILES = ("full", "chat", "debug")
+# How tool_result screenshots are sent: media reference, thumbnail reference, or not at all
+IMAGE_MODES = ("ref", "thumb", "none")
+
+CHAT_TYPES = {"user_message", "assistant_delta", "assistant_block", "assistant_message", "assistant_done"}
+
+
+def build_variant(event: Dict[str, Any], profile: str, images: str) -> Optional[Dict[str, Any]]:
+    """The event as sent to a subscriber with this profile, or None to skip it.
+
+    Returns `event` itself when nothing changes, so callers can reuse its frame.
+    """
+    kind = event.get("type")
+    if profile == "chat":
+        if kind not in CHAT_TYPES:
+            return None
+        if kind == "assistant_block":
+            return event if (event.get("data") or {}).get("type") == "text" else None
+        if kind == "assistant_delta":
+            return event if (event.get("data") or {}).get("type") == "text_delta" else None
+        if kind == "assistant_message":
+            blocks = event.get("data") or []
+            return {**event, "data": [b for b in blocks if isinstance(b, dict) and b.get("type") == "text"]}
+        return event
+    if kind == "api" and profile != "debug":
+        return {**event, "data": _api_summary(event.get("data") or {})}
+    if kind == "tool_result" and images != "ref":
+        data = event.get("data") or {}
+        image = data.get("image")
+        if not image:
+            return event
+        return {**event, "data": {**data, "image": thumbnail_ref(image) if images == "thumb" else None}}
+    return event
+
+
+def _api_summary(data: Dict[str, Any]) -> Dict[str, Any]:
+    request = {k: v for k, v in (data.get("request") or {}).items() if k != "headers"}
+    response = {k: v for k, v in (data.get("response") or {}).items() if k not in ("headers", "body_preview")}
+    return {**data, "request": request, "response": response}
+
+
+class EventVariants:
+    """Lazily built per-subscriber variants of one event.
+
+    Each (profile, images) variant is built and serialized at most once and
+    shared by every subscriber that asked for it. `frame` is the event as
+    published; the event dict is parsed from it only when a variant needs it.
+    """
+
+    def __init__(self, frame: str, event: Optional[Dict[str, Any]] = None):
+        self.frame = frame
+        self._event = event
+        self._frames: Dict[Tuple[str, str], Optional[str]] = {}
+
+    def get(self, profile: str, images: str) -> Optional[str]:
+        key = (profile, images)
+        if key == ("debug", "ref"):
+            return self.frame
+        if key not in self._frames:
+            if self._event is None:
+                self._event = json.loads(self.frame)
+            variant = build_variant(self._event, profile, images)
+            if variant is None:
+                self._frames[key] = None
+            elif variant is self._event:
+                self._frames[key] = self.frame
+            else:
+                self._frames[key] = json.dumps(variant, default=str)
+        return self._frames[key]
@@ -0,0 +1,262 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, Optional, Set
+
+from sqlalchemy import select
+
+from ..config import get_settings
+from ..database import AsyncDB
+from ..models.session import Session as SessionModel
+from .db_writer import db_writer
+from .stream_manager import stream_manager
+from .vm_manager import VMManager, vm_manager
+
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+# Lifecycle of a session's VM, as stored in session.metadata_json.vm.status
+VM_STATUSES = ("pending", "ready", "failed", "stopping", "stopped")
+
+
+@dataclass
+class VMHandle:
+    session_id: str
+    status: str = "pending"
+    container_id: Optional[str] = None
+    novnc_port: Optional[int] = None
+    vnc_port: Optional[int] = None
+    # Why the VM was stopped: "archived" or "idle"
+    reason: Optional[str] = None
+    last_active: float = field(default_factory=time.monotonic)
+    # Archived while still provisioning: stop the container as soon as it's up
+    released: bool = False
+
+    def info(self) -> Dict[str, Any]:
+        info = {
+            "status": self.status,
+            "container_id": self.container_id,
+            "novnc_port": self.novnc_port,
+            "vnc_port": self.vnc_port,
+        }
+        if self.reason:
+            info["reason"] = self.reason
+        return info
+
+
+class VMController:
+    """Runs session VM lifecycle operations in the background.
+
+    Request handlers never wait on Docker: `create` returns at once, with a
+    ready VM when the warm pool has one and a pending handle otherwise; the
+    container is then provisioned by a task. Each status change is saved to
+    `session.metadata_json.vm` and pushed to the session's stream as a
+    `vm_status` event.
+
+    An idle reaper stops the VMs of sessions with no activity (messages, agent
+    steps) for `vm_idle_timeout` seconds; the next message brings one back.
+    """
+
+    def __init__(self, manager: VMManager, idle_timeout: float, reap_interval: float):
+        self.manager = manager
+        self.idle_timeout = idle_timeout
+        self.reap_interval = reap_interval
+        self._handles: Dict[str, VMHandle] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self._reaper: Optional[asyncio.Task] = None
+        # metrics
+        self._provisioned = 0
+        self._failed = 0
+        self._stopped = 0
+        self._reaped = 0
+        self._provision_total = 0.0
+        self._provision_max = 0.0
+
+    async def start(self) -> None:
+        if self._reaper is not None:
+            return
+        await self._load_running()
+        if self.idle_timeout > 0:
+            self._reaper = asyncio.create_task(self._reap_loop(), name="vm-reaper")
+
+    async def stop(self) -> None:
+        tasks = list(self._tasks)
+        if self._reaper is not None:
+            tasks.append(self._reaper)
+            self._reaper = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    async def create(self, session_id: str) -> Dict[str, Any]:
+        """Give a newly created session a VM. Returns its `metadata_json.vm`, which
+        is either ready (warm pool hit) or pending until a `vm_status` event says
+        otherwise. The session row must already exist."""
+        handle = self._handles[session_id] = VMHandle(session_id)
+        # Without Docker create_vm returns the static fallback ports right away
+        info = self.manager.take_ready() if self.manager.client is not None else self.manager.create_vm()
+        if info is None:
+            self._spawn(self._provision(handle))
+            return handle.info()
+        self._set_ready(handle, info)
+        await self._save(handle)
+        return handle.info()
+
+    def release(self, session_id: str, container_id: Optional[str] = None, reason: str = "archived") -> None:
+        """Stop a session's VM in the background."""
+        handle = self._handles.get(session_id)
+        if handle is None:
+            if not container_id:
+                return
+            handle = self._handles[session_id] = VMHandle(session_id, status="ready", container_id=container_id)
+        if handle.status == "pending":
+            handle.released = True
+            handle.reason = reason
+            return
+        if handle.status == "stopping":
+            # The reaper got there first; forget the session once it's done
+            handle.reason = reason
+            return
+        if handle.status != "ready":
+            # Nothing running (failed, or already stopped by the reaper)
+            if reason == "archived" and handle.status in ("failed", "stopped"):
+                self._handles.pop(session_id, None)
+            return
+        self._spawn(self._stop(handle, reason))
+
+    def touch(self, session_id: str) -> None:
+        """Record activity for a session, bringing its VM back if the reaper stopped it."""
+        handle = self._handles.get(session_id)
+        if handle is None:
+            return
+        handle.last_active = time.monotonic()
+        if handle.status == "stopped" and handle.reason == "idle":
+            handle.status, handle.reason = "pending", None
+            handle.container_id = handle.novnc_port = handle.vnc_port = None
+            self._spawn(self._provision(handle))
+
+    def status(self, session_id: str) -> Optional[Dict[str, Any]]:
+        handle = self._handles.get(session_id)
+        return handle.info() if handle else None
+
+    def stats(self) -> Dict[str, Any]:
+        counts = {status: 0 for status in VM_STATUSES}
+        for handle in self._handles.values():
+            counts[handle.status] += 1
+        return {
+            **counts,
+            "tasks": len(self._tasks),
+            "provisioned": self._provisioned,
+            "failed": self._failed,
+            "stopped_total": self._stopped,
+            "reaped": self._reaped,
+            "provision_avg_s": self._provision_total / self._provisioned if self._provisioned else 0.0,
+            "provision_max_s": self._provision_max,
+        }
+
+    def _spawn(self, coro) -> None:
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _set_ready(self, handle: VMHandle, info: Dict[str, Any]) -> None:
+        handle.status = "ready"
+        handle.container_id = info.get("container_id")
+        handle.novnc_port = info.get("novnc_port")
+        handle.vnc_port = info.get("vnc_port")
+        handle.last_active = time.monotonic()
+
+    async def _provision(self, handle: VMHandle) -> None:
+        started = time.monotonic()
+        try:
+            info = await self.manager.acquire()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Failed to start a VM for session %s", handle.session_id)
+            self._failed += 1
+            handle.status = "failed"
+            await self._announce(handle)
+            return
+        elapsed = time.monotonic() - started
+        self._provisioned += 1
+        self._provision_total += elapsed
+        self._provision_max = max(self._provision_max, elapsed)
+        self._set_ready(handle, info)
+        if handle.released:
+            await self._stop(handle, handle.reason or "archived")
+            return
+        await self._announce(handle)
+
+    async def _stop(self, handle: VMHandle, reason: str) -> None:
+        handle.status, handle.reason = "stopping", reason
+        await self._announce(handle)
+        if handle.container_id:
+            await self.manager.release(handle.container_id)
+        handle.status = "stopped"
+        handle.container_id = handle.novnc_port = handle.vnc_port = None
+        self._stopped += 1
+        await self._announce(handle)
+        if handle.reason == "archived":
+            self._handles.pop(handle.session_id, None)
+
+    async def _announce(self, handle: VMHandle) -> None:
+        info = await self._save(handle)
+        await stream_manager.broadcast(handle.session_id, {
+            "type": "vm_status",
+            "at": datetime.utcnow().isoformat(),
+            "data": info,
+        })
+
+    async def _save(self, handle: VMHandle) -> Dict[str, Any]:
+        info = handle.info()
+
+        def write(db):
+            row = db.get(SessionModel, handle.session_id)
+            if row is not None:
+                row.metadata_json = {**(row.metadata_json or {}), "vm": info}
+
+        try:
+            await db_writer.run(write)
+        except Exception:
+            logger.exception("Failed to save VM status for session %s", handle.session_id)
+        return info
+
+    async def _reap_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.reap_interval)
+            cutoff = time.monotonic() - self.idle_timeout
+            for handle in list(self._handles.values()):
+                if handle.status == "ready" and handle.container_id and handle.last_active < cutoff:
+                    self._reaped += 1
+                    self._spawn(self._stop(handle, "idle"))
+
+    async def _load_running(self) -> None:
+        """Track VMs of active sessions left running by a previous process,
+        so the reaper and archive see them; their idle clock starts now."""
+        db = AsyncDB()
+        try:
+            sessions = await db.scalars(select(SessionModel).where(SessionModel.status == "active"))
+            for session in sessions:
+                vm = (session.metadata_json or {}).get("vm") or {}
+                if vm.get("container_id") and vm.get("status", "ready") == "ready":
+                    handle = VMHandle(session.id)
+                    self._set_ready(handle, vm)
+                    self._handles[session.id] = handle
+        except Exception:
+            logger.exception("Failed to load running session VMs")
+        finally:
+            await db.close()
+
+
+vm_controller = VMController(
+    vm_manager,
+    idle_timeout=settings.vm_idle_timeout,
+    reap_interval=settings.vm_reap_interval,
+)
@@ -1,7 +1,11 @@
 from __future__ import annotations
 
+import asyncio
+import logging
 import os
-from typing import Dict
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Set
 
 try:
     import docker  # type: ignore
@@ -12,21 +16,123 @@ from ..config import get_settings
 
 
 settings = get_settings()
+logger = logging.getLogger(__name__)
+
+# Label put on every container started here, so they can be found with `docker ps --filter`
+VM_LABEL = "cua.vm"
+# Wait this long after a batch of failed boots before trying again (seconds)
+BOOT_RETRY_DELAY = 5.0
 
 
 class VMManager:
-    def __init__(self):
+    """Starts per-session desktop containers.
+
+    A warm pool of `pool_size` containers is booted ahead of demand and
+    health-checked until Xvfb and noVNC are up, so `acquire` hands one out
+    without touching Docker. A background task tops the pool back up after each
+    handout and drops ready containers that died while idle. When the pool is
+    empty (or disabled) `acquire` falls back to a cold start.
+
+    `client` is a docker SDK client (`docker.from_env()` by default); anything
+    with the same `containers.run/get` interface works, e.g. a fake in tests.
+    """
+
+    def __init__(
+        self,
+        client: Any = None,
+        image: Optional[str] = None,
+        pool_size: Optional[int] = None,
+    ):
         # connect via docker socket if available, else fallback
-        self.client = None
-        if docker is not None:
+        self.client = client
+        if client is None and docker is not None:
             try:
                 self.client = docker.from_env()
             except Exception:
                 self.client = None
-        self.image = os.environ.get(
+        self.image = image or os.environ.get(
             "VM_BASE_IMAGE",
             "ghcr.io/anthropics/anthropic-quickstarts:computer-use-demo-latest",
         )
+        self.pool_size = settings.vm_pool_size if pool_size is None else pool_size
+        self.health_command = settings.vm_health_command
+        self.health_timeout = settings.vm_health_timeout
+        self.health_interval = settings.vm_health_interval
+        self.check_interval = settings.vm_pool_check_interval
+        # Per-container limits, so many desktops can share a host
+        self.cpus = settings.vm_cpus
+        self.memory = settings.vm_memory
+        self.pids_limit = settings.vm_pids_limit
+        self._ready: Deque[Dict] = deque()
+        self._starting = 0
+        # Containers created by a boot that hasn't finished yet, and the
+        # `containers.run` calls still in flight; removed/awaited on stop
+        self._booting: Set[str] = set()
+        self._runs: Set[asyncio.Future] = set()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._filler: Optional[asyncio.Task] = None
+        # metrics
+        self._hits = 0
+        self._misses = 0
+        self._booted = 0
+        self._boot_failures = 0
+        self._unhealthy = 0
+        self._destroyed = 0
+        self._boot_total = 0.0
+        self._boot_max = 0.0
+
+    @property
+    def pooled(self) -> bool:
+        return self.client is not None and self.pool_size > 0
+
+    async def start(self) -> None:
+        if not self.pooled or self._filler is not None:
+            return
+        self._wakeup = asyncio.Event()
+        self._filler = asyncio.create_task(self._fill_loop(), name="vm-pool-filler")
+
+    async def stop(self) -> None:
+        """Stop filling the pool and remove the containers nobody was given."""
+        if self._filler is None:
+            return
+        self._filler.cancel()
+        await asyncio.gather(self._filler, return_exceptions=True)
+        self._filler = None
+        self._wakeup = None
+        # A cancelled boot's container may still be coming up in its thread
+        await asyncio.gather(*self._runs, return_exceptions=True)
+        unused = [info["container_id"] for info in self._ready] + list(self._booting)
+        self._ready.clear()
+        self._booting.clear()
+        await asyncio.gather(*(asyncio.to_thread(self.stop_vm, cid) for cid in unused))
+
+    async def acquire(self, name_prefix: str = "vm-session") -> Dict:
+        """VM for a new session: a ready warm container if there is one, else a cold start.
+
+        Returns: {container_id, novnc_port, vnc_port}
+        """
+        info = self.take_ready()
+        if info is not None:
+            return info
+        if self.pooled:
+            self._misses += 1
+            self._refill()
+        return await asyncio.to_thread(self.create_vm, name_prefix)
+
+    def take_ready(self) -> Optional[Dict]:
+        """A ready warm container, or None when the pool is empty. Never blocks."""
+        if not self._ready:
+            return None
+        self._hits += 1
+        info = self._ready.popleft()
+        self._refill()
+        return info
+
+    async def release(self, container_id: str) -> None:
+        """Give back a session's container: it is removed. Never reused, since
+        its filesystem (browser profile, downloads, files) belongs to the
+        session; the pool is filled with fresh containers from the image."""
+        await asyncio.to_thread(self.stop_vm, container_id)
 
     def create_vm(self, name_prefix: str = "vm-session") -> Dict:
         """Start a new VM container and return connection info.
@@ -38,29 +144,9 @@ class VMManager:
             # Note: compose maps 6080:6080 and 5901:5900
             return {"container_id": None, "novnc_port": 6080, "vnc_port": 5901}
         try:
-            container = self.client.containers.run(
-                self.image,
-                name=f"{name_prefix}-{os.urandom(4).hex()}",
-                detach=True,
-                environment={
-                    "WIDTH": str(os.environ.get("WIDTH", 1024)),
-                    "HEIGHT": str(os.environ.get("HEIGHT", 768)),
-                },
-                ports={
-                    "6080/tcp": None,  # random host port
-                    "5900/tcp": None,
-                },
-                shm_size="2g",
-            )
+            container = self._run_container(name_prefix, "session")
             container.reload()
-            ports = container.attrs.get("NetworkSettings", {}).get("Ports", {})
-            novnc = ports.get("6080/tcp", [{}])[0].get("HostPort")
-            vnc = ports.get("5900/tcp", [{}])[0].get("HostPort")
-            return {
-                "container_id": container.id,
-                "novnc_port": int(novnc) if novnc else None,
-                "vnc_port": int(vnc) if vnc else None,
-            }
+            return self._info(container)
         except Exception:
             return {"container_id": None, "novnc_port": 6080, "vnc_port": 5901}
 
@@ -69,10 +155,154 @@ class VMManager:
             c = self.client.containers.get(container_id)
             c.stop(timeout=10)
             c.remove()
+            self._destroyed += 1
         except Exception:
             pass
 
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.pooled,
+            "pool_size": self.pool_size,
+            "ready": len(self._ready),
+            "starting": self._starting,
+            "hits": self._hits,
+            "misses": self._misses,
+            "booted": self._booted,
+            "boot_failures": self._boot_failures,
+            "unhealthy": self._unhealthy,
+            "destroyed": self._destroyed,
+            "boot_avg_s": self._boot_total / self._booted if self._booted else 0.0,
+            "boot_max_s": self._boot_max,
+        }
 
-vm_manager = VMManager()
+    def _run_container(self, name_prefix: str, role: str):
+        limits: Dict[str, Any] = {}
+        if self.cpus:
+            limits["nano_cpus"] = int(self.cpus * 1e9)
+        if self.memory:
+            limits["mem_limit"] = self.memory
+        if self.pids_limit:
+            limits["pids_limit"] = self.pids_limit
+        return self.client.containers.run(
+            self.image,
+            name=f"{name_prefix}-{os.urandom(4).hex()}",
+            detach=True,
+            environment={
+                "WIDTH": str(os.environ.get("WIDTH", 1024)),
+                "HEIGHT": str(os.environ.get("HEIGHT", 768)),
+            },
+            ports={
+                "6080/tcp": None,  # random host port
+                "5900/tcp": None,
+            },
+            labels={VM_LABEL: role},
+            shm_size="2g",
+            **limits,
+        )
 
+    @staticmethod
+    def _info(container) -> Dict:
+        ports = container.attrs.get("NetworkSettings", {}).get("Ports", {}) or {}
+        novnc = (ports.get("6080/tcp") or [{}])[0].get("HostPort")
+        vnc = (ports.get("5900/tcp") or [{}])[0].get("HostPort")
+        return {
+            "container_id": container.id,
+            "novnc_port": int(novnc) if novnc else None,
+            "vnc_port": int(vnc) if vnc else None,
+        }
 
+    def _healthy(self, container_id: str) -> bool:
+        try:
+            result = self.client.containers.get(container_id).exec_run(["sh", "-c", self.health_command])
+            return result.exit_code == 0
+        except Exception:
+            return False
+
+    async def _wait_healthy(self, container_id: str) -> bool:
+        deadline = time.monotonic() + self.health_timeout
+        while True:
+            if await asyncio.to_thread(self._healthy, container_id):
+                return True
+            if time.monotonic() >= deadline:
+                return False
+            await asyncio.sleep(self.health_interval)
+
+    def _missing(self) -> int:
+        return self.pool_size - len(self._ready) - self._starting
+
+    def _refill(self) -> None:
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _fill_loop(self) -> None:
+        assert self._wakeup is not None
+        while True:
+            missing = self._missing()
+            if missing > 0:
+                results = await asyncio.gather(*(self._boot() for _ in range(missing)))
+                if not all(results):
+                    await asyncio.sleep(BOOT_RETRY_DELAY)
+                continue
+            self._wakeup.clear()
+            # Not wait_for: on Python 3.11 it swallows a cancel that lands just as
+            # the wakeup fires (e.g. stop() right after a handout) and stop() hangs
+            wakeup = asyncio.ensure_future(self._wakeup.wait())
+            try:
+                done, _ = await asyncio.wait({wakeup}, timeout=self.check_interval)
+            finally:
+                wakeup.cancel()
+            if not done:
+                await self._check_ready()
+
+    async def _boot(self) -> bool:
+        self._starting += 1
+        started = time.monotonic()
+        container_id = None
+        try:
+            run = asyncio.ensure_future(asyncio.to_thread(self._start_container))
+            self._runs.add(run)
+            run.add_done_callback(self._runs.discard)
+            container = await asyncio.shield(run)
+            container_id = container.id
+            if await self._wait_healthy(container_id):
+                elapsed = time.monotonic() - started
+                self._booted += 1
+                self._boot_total += elapsed
+                self._boot_max = max(self._boot_max, elapsed)
+                self._ready.append(self._info(container))
+                self._booting.discard(container_id)
+                return True
+            self._unhealthy += 1
+            logger.warning("VM container %s not healthy after %.0fs", container_id, self.health_timeout)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self._boot_failures += 1
+            logger.exception("Failed to start a warm VM container")
+        finally:
+            self._starting -= 1
+        if container_id is not None:
+            self._booting.discard(container_id)
+            await asyncio.to_thread(self.stop_vm, container_id)
+        return False
+
+    def _start_container(self):
+        container = self._run_container("vm-pool", "pool")
+        # Tracked from here on, so stop() can remove it if the boot is cancelled
+        self._booting.add(container.id)
+        container.reload()
+        return container
+
+    async def _check_ready(self) -> None:
+        """Drop ready containers that stopped while waiting in the pool."""
+        for info in list(self._ready):
+            if not await asyncio.to_thread(self._healthy, info["container_id"]):
+                try:
+                    self._ready.remove(info)
+                except ValueError:
+                    continue  # handed out meanwhile
+                self._unhealthy += 1
+                await asyncio.to_thread(self.stop_vm, info["container_id"])
+
+
+vm_manager = VMManager()
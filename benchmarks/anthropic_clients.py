@@ -0,0 +1,104 @@
+"""Per-step API latency with a new Anthropic client per step vs the shared client registry.
+
+Usage: python benchmarks/anthropic_clients.py [--steps 50] [--setup-ms 30]
+
+A local stub of the Messages API answers every request with a short message.
+It charges `--setup-ms` once per new TCP connection, standing in for the TCP
+and TLS handshakes to the real API. "per-step" builds a new client for every
+request, the way sampling_loop used to; "registry" takes the client from a
+ClientRegistry, so requests after the first reuse a keep-alive connection.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "computer-use-demo"))
+
+from anthropic import Anthropic  # noqa: E402
+
+from computer_use_demo.clients import APIProvider, ClientRegistry  # noqa: E402
+
+RESPONSE = json.dumps({
+    "id": "msg_bench",
+    "type": "message",
+    "role": "assistant",
+    "model": "stub",
+    "content": [{"type": "text", "text": "ok"}],
+    "stop_reason": "end_turn",
+    "stop_sequence": None,
+    "usage": {"input_tokens": 10, "output_tokens": 1},
+}).encode()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # headers and body go out in separate writes; don't let Nagle hold the body back
+    disable_nagle_algorithm = True
+    setup_delay = 0.0
+    connections = 0
+
+    def setup(self):
+        super().setup()
+        StubHandler.connections += 1
+        time.sleep(self.setup_delay)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("content-length", 0)))
+        self.send_response(200)
+        self.send_header("content-type", "application/json")
+        self.send_header("content-length", str(len(RESPONSE)))
+        self.end_headers()
+        self.wfile.write(RESPONSE)
+
+    def log_message(self, *args):
+        pass
+
+
+def step(client) -> float:
+    started = time.perf_counter()
+    client.beta.messages.with_raw_response.create(
+        model="stub",
+        max_tokens=16,
+        messages=[{"role": "user", "content": "hi"}],
+    ).parse()
+    return time.perf_counter() - started
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--steps", type=int, default=50)
+    parser.add_argument("--setup-ms", type=float, default=30.0)
+    args = parser.parse_args()
+
+    StubHandler.setup_delay = args.setup_ms / 1000
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    registry = ClientRegistry()
+    runs = {
+        "per-step": lambda: Anthropic(api_key="bench", base_url=base_url, max_retries=4),
+        "registry": lambda: registry.get(APIProvider.ANTHROPIC, api_key="bench", base_url=base_url),
+    }
+    try:
+        for name, get_client in runs.items():
+            StubHandler.connections = 0
+            times = [step(get_client()) for _ in range(args.steps)]
+            print(
+                f"{name:>8}: median {statistics.median(times) * 1000:.1f} ms/step, "
+                f"mean {statistics.mean(times) * 1000:.1f} ms, "
+                f"{StubHandler.connections} connections for {args.steps} steps"
+            )
+    finally:
+        registry.close()
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Input latency: an xdotool subprocess per action vs one persistent XTest connection.
+
+Usage: python benchmarks/input_latency.py [--actions 50] [--display 1]
+
+Without --display, starts its own Xvfb on :96 (needs Xvfb on PATH). Each action
+is the chain the computer tool sends for a click at a point,
+`mousemove --sync X Y click 1`. "xdotool" runs it the way the tool's fallback
+does, through a shell; "in-process" sends it with XInput.
+"""
+
+import argparse
+import asyncio
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "computer-use-demo"))
+
+from computer_use_demo.tools.input import XInput  # noqa: E402
+from computer_use_demo.tools.run import run  # noqa: E402
+
+
+def chain(n: int) -> str:
+    return f"mousemove --sync {100 + n % 200} {100 + n % 150} click 1"
+
+
+async def act_with_xdotool(display: str, n: int) -> float:
+    started = time.perf_counter()
+    code, _, stderr = await run(f"DISPLAY={display} xdotool {chain(n)}")
+    if code:
+        raise RuntimeError(f"xdotool failed: {stderr}")
+    return time.perf_counter() - started
+
+
+async def act_in_process(x_input: XInput, n: int) -> float:
+    started = time.perf_counter()
+    if await x_input.run(chain(n)) is None:
+        raise RuntimeError("in-process input failed; is python-xlib installed and the display up?")
+    return time.perf_counter() - started
+
+
+def report(name: str, times: list[float]) -> None:
+    print(
+        f"{name:>10}: median {statistics.median(times) * 1000:.1f} ms/action, "
+        f"mean {statistics.mean(times) * 1000:.1f} ms, max {max(times) * 1000:.1f} ms"
+    )
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--actions", type=int, default=50)
+    parser.add_argument("--display", type=int, default=None)
+    args = parser.parse_args()
+
+    xvfb = None
+    display_num = args.display
+    if display_num is None:
+        display_num = 96
+        xvfb = subprocess.Popen(["Xvfb", f":{display_num}", "-screen", "0", "1280x800x24"])
+        time.sleep(1)
+    x_input = XInput(display_num)
+    try:
+        # the first action opens the X connection
+        await act_in_process(x_input, 0)
+        runs = {"in-process": [await act_in_process(x_input, n) for n in range(args.actions)]}
+        if shutil.which("xdotool"):
+            await act_with_xdotool(f":{display_num}", 0)
+            runs["xdotool"] = [await act_with_xdotool(f":{display_num}", n) for n in range(args.actions)]
+        else:
+            print("xdotool not found; skipping the xdotool run")
+        print(f"{args.actions} actions of `{chain(0)}`")
+        for name, times in runs.items():
+            report(name, times)
+    finally:
+        x_input.close()
+        if xvfb is not None:
+            xvfb.terminate()
+            xvfb.wait()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
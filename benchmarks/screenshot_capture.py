@@ -0,0 +1,100 @@
+"""Screenshot latency: scrot + ImageMagick subprocesses vs in-process capture.
+
+Usage: python benchmarks/screenshot_capture.py [--shots 30] [--display 1] [--size 1280x800]
+
+Without --display, starts its own Xvfb on :97 with a screen of --size (needs
+Xvfb on PATH). "commands" is the computer tool's fallback path: scrot writes a
+PNG, `convert` resizes it in place and the file is read back. "in-process" is
+ScreenCapture: one X connection, capture into memory, resize with Pillow and
+encode once. Both produce an XGA (1024x768) or WXGA (1280x800) PNG, depending
+on the screen's aspect ratio, like the tool does.
+"""
+
+import argparse
+import asyncio
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "computer-use-demo"))
+
+from computer_use_demo.tools.computer import MAX_SCALING_TARGETS  # noqa: E402
+from computer_use_demo.tools.screen import ScreenCapture  # noqa: E402
+
+
+def target_size(width: int, height: int) -> tuple[int, int]:
+    for target in MAX_SCALING_TARGETS.values():
+        if abs(target["width"] / target["height"] - width / height) < 0.02 and target["width"] < width:
+            return target["width"], target["height"]
+    return width, height
+
+
+def capture_with_commands(display: str, size: tuple[int, int], output_dir: str) -> float:
+    started = time.perf_counter()
+    path = os.path.join(output_dir, "screenshot.png")
+    subprocess.run(f"DISPLAY={display} scrot -o -p {path}", shell=True, check=True, capture_output=True)
+    subprocess.run(f"convert {path} -resize {size[0]}x{size[1]}! {path}", shell=True, check=True)
+    with open(path, "rb") as f:
+        f.read()
+    os.remove(path)
+    return time.perf_counter() - started
+
+
+async def capture_in_process(capture: ScreenCapture, size: tuple[int, int]) -> float:
+    started = time.perf_counter()
+    if await capture.grab(size) is None:
+        raise RuntimeError("in-process capture failed; is mss installed and the display up?")
+    return time.perf_counter() - started
+
+
+def report(name: str, times: list[float]) -> None:
+    print(
+        f"{name:>10}: median {statistics.median(times) * 1000:.1f} ms/shot, "
+        f"mean {statistics.mean(times) * 1000:.1f} ms, max {max(times) * 1000:.1f} ms"
+    )
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--shots", type=int, default=30)
+    parser.add_argument("--display", type=int, default=None)
+    parser.add_argument("--size", default="1280x800")
+    args = parser.parse_args()
+    width, height = (int(n) for n in args.size.split("x"))
+
+    xvfb = None
+    display_num = args.display
+    if display_num is None:
+        display_num = 97
+        xvfb = subprocess.Popen(["Xvfb", f":{display_num}", "-screen", "0", f"{width}x{height}x24"])
+        time.sleep(1)
+    size = target_size(width, height)
+    capture = ScreenCapture(display_num)
+    try:
+        # first captures open the X connection / warm the page cache
+        await capture_in_process(capture, size)
+        runs = {"in-process": [await capture_in_process(capture, size) for _ in range(args.shots)]}
+        if shutil.which("scrot") and shutil.which("convert"):
+            with tempfile.TemporaryDirectory() as output_dir:
+                capture_with_commands(f":{display_num}", size, output_dir)
+                runs["commands"] = [
+                    capture_with_commands(f":{display_num}", size, output_dir) for _ in range(args.shots)
+                ]
+        else:
+            print("scrot or convert not found; skipping the commands run")
+        print(f"{width}x{height} screen, resized to {size[0]}x{size[1]}, {args.shots} shots")
+        for name, times in runs.items():
+            report(name, times)
+    finally:
+        capture.close()
+        if xvfb is not None:
+            xvfb.terminate()
+            xvfb.wait()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
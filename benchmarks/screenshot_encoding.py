@@ -0,0 +1,72 @@
+"""Screenshot encodings: size and encode time of each tool-result image encoding.
+
+Usage: python benchmarks/screenshot_encoding.py [IMAGE ...] [--display 1] [--runs 5]
+           [--encodings png,png:9,png-palette,jpeg:75,webp:80]
+
+Encodes each IMAGE (e.g. saved screenshots of the desktop the agent works on)
+with every encoding, or, with --display, a capture of that X display. Reports
+the encoded size, how much smaller that is than raw 24-bit RGB and the median
+encode time. Lossy and palette encodings should be checked by eye too: small
+text is what suffers first.
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "computer-use-demo"))
+
+from PIL import Image  # noqa: E402
+
+from computer_use_demo.tools.screen import Encoding, ScreenCapture  # noqa: E402
+
+DEFAULT_ENCODINGS = "png:1,png,png:9,png-palette,png-palette:64,jpeg:60,jpeg:75,jpeg:90,webp:60,webp:80"
+
+
+def load_images(args) -> dict[str, Image.Image]:
+    images = {path: Image.open(path).convert("RGB") for path in args.images}
+    if args.display is not None:
+        capture = ScreenCapture(args.display)
+        try:
+            images[f"display :{args.display}"] = capture._executor.submit(capture._grab).result()
+        finally:
+            capture.close()
+    return images
+
+
+def measure(image: Image.Image, encoding: Encoding, runs: int) -> tuple[int, float]:
+    times = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        data = encoding.encode(image)
+        times.append(time.perf_counter() - started)
+    return len(data), statistics.median(times)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("images", nargs="*")
+    parser.add_argument("--display", type=int, default=None)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--encodings", default=DEFAULT_ENCODINGS)
+    args = parser.parse_args()
+    encodings = [Encoding.parse(spec) for spec in args.encodings.split(",")]
+
+    images = load_images(args)
+    if not images:
+        parser.error("give at least one image or --display")
+    for name, image in images.items():
+        raw = image.width * image.height * 3
+        print(f"{name} ({image.width}x{image.height}, {raw / 1024:.0f} KiB raw)")
+        for encoding in encodings:
+            size, seconds = measure(image, encoding, args.runs)
+            print(
+                f"  {str(encoding):>16}: {size / 1024:8.1f} KiB, {raw / size:5.1f}x smaller, "
+                f"{seconds * 1000:6.1f} ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
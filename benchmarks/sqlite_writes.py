@@ -0,0 +1,74 @@
+"""Concurrent message-write throughput on SQLite, with and without the single writer.
+
+Usage: python benchmarks/sqlite_writes.py [--sessions 16] [--writes 50]
+
+Each simulated session appends messages one after another, the way an agent
+turn persists its steps; all sessions run concurrently. "direct" commits every
+write in its own session from a worker thread, "writer" goes through the
+serialized, group-committing DBWriter.
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+_tmp = tempfile.mkdtemp(prefix="sqlite-bench-")
+os.environ["DATABASE_URL"] = f"sqlite:///{_tmp}/bench.db"
+os.environ.setdefault("MEDIA_DIR", os.path.join(_tmp, "media"))
+
+from app.config import get_settings  # noqa: E402
+from app.database import Base, engine  # noqa: E402
+from app.models.message import Message as MessageModel  # noqa: E402
+from app.models.session import Session as SessionModel  # noqa: E402
+from app.services.db_writer import DBWriter  # noqa: E402
+
+
+async def run(writer: DBWriter, sessions: int, writes: int) -> float:
+    ids = [str(uuid.uuid4()) for _ in range(sessions)]
+    await writer.run(lambda db: db.add_all(SessionModel(id=i, title="bench") for i in ids))
+
+    async def session_writes(session_id: str) -> None:
+        for n in range(writes):
+            msg = MessageModel(
+                id=str(uuid.uuid4()),
+                session_id=session_id,
+                role="assistant",
+                content_json=[{"type": "text", "text": f"step {n} " + "x" * 200}],
+            )
+            await writer.run(lambda db: db.add(msg))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(session_writes(i) for i in ids))
+    return time.perf_counter() - started
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=16)
+    parser.add_argument("--writes", type=int, default=50)
+    args = parser.parse_args()
+
+    Base.metadata.create_all(bind=engine)
+    total = args.sessions * args.writes
+    batch_size = get_settings().db_writer_batch_size
+    for name, serialize in (("direct", False), ("writer", True)):
+        writer = DBWriter(batch_size=batch_size, serialize=serialize)
+        await writer.start()
+        try:
+            elapsed = await run(writer, args.sessions, args.writes)
+        finally:
+            await writer.stop()
+        stats = writer.stats()
+        print(
+            f"{name:>7}: {total} writes in {elapsed:.2f}s = {total / elapsed:,.0f} writes/s"
+            + (f" (avg batch {stats['avg_batch']:.1f})" if serialize else "")
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
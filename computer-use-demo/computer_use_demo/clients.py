@@ -0,0 +1,177 @@
+"""
+Shared Anthropic API clients, so sampling loops reuse warm HTTP connections.
+"""
+
+import importlib.util
+import threading
+from collections.abc import Callable
+from enum import StrEnum
+from typing import Any, NamedTuple
+
+import httpx
+from anthropic import (
+    Anthropic,
+    AnthropicBedrock,
+    AnthropicVertex,
+    DefaultHttpxClient,
+)
+
+
+class APIProvider(StrEnum):
+    ANTHROPIC = "anthropic"
+    BEDROCK = "bedrock"
+    VERTEX = "vertex"
+
+
+AnthropicClient = Anthropic | AnthropicBedrock | AnthropicVertex
+
+
+class ClientKey(NamedTuple):
+    provider: APIProvider
+    api_key: str | None
+    base_url: str | None
+
+
+class ClientRegistry:
+    """
+    Caches one API client per (provider, api_key, base_url).
+
+    Clients for the same provider and base_url share one httpx connection pool
+    (the API key is a header, not part of the connection), so every step of a
+    sampling loop, and every loop in the process, reuses keep-alive connections
+    instead of paying for a new TCP/TLS handshake. HTTP/2 is used when the `h2`
+    package is installed.
+
+    Lifecycle hooks: `on_create(hook)` runs `hook(key, client)` for each new
+    client, `on_close(hook)` runs `hook(key, client)` for each client dropped by
+    `close()`. The registry is thread-safe; clients are synchronous and can be
+    used from any event loop.
+    """
+
+    def __init__(
+        self,
+        *,
+        max_connections: int = 20,
+        max_keepalive_connections: int = 10,
+        keepalive_expiry: float = 60.0,
+        http2: bool | None = None,
+        timeout: float | httpx.Timeout | None = None,
+        max_retries: int = 4,
+    ):
+        self._lock = threading.Lock()
+        self._clients: dict[ClientKey, AnthropicClient] = {}
+        self._pools: dict[tuple[APIProvider, str | None], httpx.Client] = {}
+        self._on_create: list[Callable[[ClientKey, AnthropicClient], None]] = []
+        self._on_close: list[Callable[[ClientKey, AnthropicClient], None]] = []
+        self.hits = 0
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections
+        self.keepalive_expiry = keepalive_expiry
+        self.http2 = _use_http2(http2)
+        self.timeout = timeout
+        self.max_retries = max_retries
+
+    def configure(
+        self,
+        *,
+        max_connections: int | None = None,
+        max_keepalive_connections: int | None = None,
+        keepalive_expiry: float | None = None,
+        http2: bool | None = None,
+        timeout: float | httpx.Timeout | None = None,
+        max_retries: int | None = None,
+    ):
+        """Change pool settings. Applies to clients created afterwards, so call
+        it at startup or after `close()`."""
+        if max_connections is not None:
+            self.max_connections = max_connections
+        if max_keepalive_connections is not None:
+            self.max_keepalive_connections = max_keepalive_connections
+        if keepalive_expiry is not None:
+            self.keepalive_expiry = keepalive_expiry
+        if http2 is not None:
+            self.http2 = _use_http2(http2)
+        if timeout is not None:
+            self.timeout = timeout
+        if max_retries is not None:
+            self.max_retries = max_retries
+
+    def on_create(self, hook: Callable[[ClientKey, AnthropicClient], None]):
+        self._on_create.append(hook)
+
+    def on_close(self, hook: Callable[[ClientKey, AnthropicClient], None]):
+        self._on_close.append(hook)
+
+    def get(
+        self,
+        provider: APIProvider,
+        api_key: str | None = None,
+        base_url: str | None = None,
+    ) -> AnthropicClient:
+        key = ClientKey(APIProvider(provider), api_key, base_url)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is not None:
+                self.hits += 1
+                return client
+            pool = self._pools.get((key.provider, base_url))
+            if pool is None:
+                pool = self._pools[(key.provider, base_url)] = self._new_pool()
+            client = self._clients[key] = self._new_client(key, pool)
+        for hook in self._on_create:
+            hook(key, client)
+        return client
+
+    def close(self):
+        """Close every connection pool and forget the clients."""
+        with self._lock:
+            clients, self._clients = self._clients, {}
+            pools, self._pools = self._pools, {}
+        for key, client in clients.items():
+            for hook in self._on_close:
+                hook(key, client)
+        for pool in pools.values():
+            pool.close()
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "clients": len(self._clients),
+            "pools": len(self._pools),
+            "hits": self.hits,
+            "http2": self.http2,
+        }
+
+    def _new_pool(self) -> httpx.Client:
+        kwargs: dict[str, Any] = {
+            "limits": httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_keepalive_connections,
+                keepalive_expiry=self.keepalive_expiry,
+            ),
+            "http2": self.http2,
+        }
+        if self.timeout is not None:
+            kwargs["timeout"] = self.timeout
+        return DefaultHttpxClient(**kwargs)
+
+    def _new_client(self, key: ClientKey, pool: httpx.Client) -> AnthropicClient:
+        if key.provider == APIProvider.ANTHROPIC:
+            return Anthropic(
+                api_key=key.api_key,
+                base_url=key.base_url,
+                max_retries=self.max_retries,
+                http_client=pool,
+            )
+        if key.provider == APIProvider.VERTEX:
+            return AnthropicVertex(base_url=key.base_url, http_client=pool)
+        return AnthropicBedrock(base_url=key.base_url, http_client=pool)
+
+
+def _use_http2(http2: bool | None) -> bool:
+    # httpx needs the optional h2 package for HTTP/2
+    available = importlib.util.find_spec("h2") is not None
+    return available if http2 is None else http2 and available
+
+
+# Shared by every sampling_loop in the process (FastAPI runner, Streamlit app)
+client_registry = ClientRegistry()
@@ -2,17 +2,16 @@
 Agentic sampling loop that calls the Anthropic API and local implementation of anthropic-defined computer use tools.
 """
 
+import asyncio
+import inspect
 import platform
-from collections.abc import Callable
+import threading
+from collections.abc import Awaitable, Callable
 from datetime import datetime
-from enum import StrEnum
 from typing import Any, cast
 
 import httpx
 from anthropic import (
-    Anthropic,
-    AnthropicBedrock,
-    AnthropicVertex,
     APIError,
     APIResponseValidationError,
     APIStatusError,
@@ -29,22 +28,19 @@ from anthropic.types.beta import (
     BetaToolUseBlockParam,
 )
 
+from .clients import APIProvider, client_registry
 from .tools import (
     TOOL_GROUPS_BY_VERSION,
+    BaseComputerTool,
     ToolCollection,
     ToolResult,
     ToolVersion,
 )
+from .tools.screen import Encoding
 
 PROMPT_CACHING_BETA_FLAG = "prompt-caching-2024-07-31"
 
 
-class APIProvider(StrEnum):
-    ANTHROPIC = "anthropic"
-    BEDROCK = "bedrock"
-    VERTEX = "vertex"
-
-
 # This system prompt is optimized for the Docker environment in this repository and
 # specific tool combinations enabled.
 # We encourage modifying this system prompt to ensure the model has context for the
@@ -74,7 +70,7 @@ async def sampling_loop(
     system_prompt_suffix: str,
     messages: list[BetaMessageParam],
     output_callback: Callable[[BetaContentBlockParam], None],
-    tool_output_callback: Callable[[ToolResult, str], None],
+    tool_output_callback: Callable[[ToolResult, str], Awaitable[None] | None],
     api_response_callback: Callable[
         [httpx.Request, httpx.Response | object | None, Exception | None], None
     ],
@@ -84,16 +80,59 @@ async def sampling_loop(
     tool_version: ToolVersion,
     thinking_budget: int | None = None,
     token_efficient_tools_beta: bool = False,
+    step_callback: Callable[[list[BetaMessageParam]], Awaitable[None] | None]
+    | None = None,
+    stream: bool = False,
+    delta_callback: Callable[[dict[str, Any]], None] | None = None,
+    image_encoding: str | None = None,
 ):
     """
     Agentic sampling loop for the assistant/tool interaction of computer use.
+
+    If given, `step_callback` is called after every step with the messages that
+    step appended (the assistant message and, if tools ran, the tool_result
+    message), so callers can persist the transcript as it grows.
+
+    With `stream=True` the response is streamed: `output_callback` gets each
+    content block as soon as it is complete rather than after the whole
+    message, and `delta_callback` (if given) gets every content block delta as
+    it arrives, e.g. `{"index": 0, "type": "text_delta", "text": "Hel"}`.
+    `api_response_callback` is called once the message is complete, with a
+    response that has the stream's status and headers and the assembled
+    message as its (readable) JSON body.
+
+    The tool calls of a step run concurrently where they don't conflict (see
+    `ToolCollection`); `tool_output_callback` and the tool_result message
+    keep the order the model called them in, and a step only completes once
+    every `tool_output_callback` has returned (or, if it returns an
+    awaitable, that has finished). Streamed tool_use blocks are run
+    as soon as they are complete, so tools execute while the model is still
+    writing the rest of the message.
+
+    Screenshots are encoded as `image_encoding` (e.g. "png-palette" or
+    "jpeg:70", see `Encoding`), by default the tool version's.
     """
     tool_group = TOOL_GROUPS_BY_VERSION[tool_version]
     tool_collection = ToolCollection(*(ToolCls() for ToolCls in tool_group.tools))
+    encoding = Encoding.parse(image_encoding or tool_group.image_encoding)
+    for tool in tool_collection.tools:
+        if isinstance(tool, BaseComputerTool):
+            tool.image_encoding = encoding
     system = BetaTextBlockParam(
         type="text",
         text=f"{SYSTEM_PROMPT}{' ' + system_prompt_suffix if system_prompt_suffix else ''}",
     )
+    # Tools of the current step that were started while its response was
+    # streaming, by tool_use id
+    tool_runs: dict[str, asyncio.Task[ToolResult]] = {}
+
+    def on_block(block: BetaContentBlockParam):
+        output_callback(block)
+        if block["type"] == "tool_use":
+            previous = next(reversed(tool_runs.values()), None)
+            tool_runs[block["id"]] = asyncio.create_task(
+                _run_tool(tool_collection, block, tool_output_callback, previous)
+            )
 
     while True:
         enable_prompt_caching = False
@@ -101,13 +140,12 @@ async def sampling_loop(
         if token_efficient_tools_beta:
             betas.append("token-efficient-tools-2025-02-19")
         image_truncation_threshold = only_n_most_recent_images or 0
+        # Clients are shared across steps and loops, so connections stay warm
         if provider == APIProvider.ANTHROPIC:
-            client = Anthropic(api_key=api_key, max_retries=4)
+            client = client_registry.get(provider, api_key=api_key)
             enable_prompt_caching = True
-        elif provider == APIProvider.VERTEX:
-            client = AnthropicVertex()
-        elif provider == APIProvider.BEDROCK:
-            client = AnthropicBedrock()
+        else:
+            client = client_registry.get(provider)
 
         if enable_prompt_caching:
             betas.append(PROMPT_CACHING_BETA_FLAG)
@@ -131,58 +169,215 @@ async def sampling_loop(
                 "thinking": {"type": "enabled", "budget_tokens": thinking_budget}
             }
 
+        request = dict(
+            max_tokens=max_tokens,
+            messages=messages,
+            model=model,
+            system=[system],
+            tools=tool_collection.to_params(),
+            betas=betas,
+            extra_body=extra_body,
+        )
+
         # Call the API
         # we use raw_response to provide debug information to streamlit. Your
         # implementation may be able call the SDK directly with:
         # `response = client.messages.create(...)` instead.
         try:
-            raw_response = client.beta.messages.with_raw_response.create(
-                max_tokens=max_tokens,
-                messages=messages,
-                model=model,
-                system=[system],
-                tools=tool_collection.to_params(),
-                betas=betas,
-                extra_body=extra_body,
+            try:
+                if stream:
+                    response = await _stream_message(
+                        client,
+                        request,
+                        on_response=lambda r: api_response_callback(r.request, r, None),
+                        on_block=on_block,
+                        on_delta=delta_callback,
+                    )
+                else:
+                    raw_response = client.beta.messages.with_raw_response.create(
+                        **request
+                    )
+                    api_response_callback(
+                        raw_response.http_response.request,
+                        raw_response.http_response,
+                        None,
+                    )
+                    response = raw_response.parse()
+            except (APIStatusError, APIResponseValidationError) as e:
+                api_response_callback(e.request, e.response, e)
+                return messages
+            except APIError as e:
+                api_response_callback(e.request, e.body, e)
+                return messages
+
+            response_params = _response_to_params(response)
+            messages.append(
+                {
+                    "role": "assistant",
+                    "content": response_params,
+                }
             )
-        except (APIStatusError, APIResponseValidationError) as e:
-            api_response_callback(e.request, e.response, e)
-            return messages
-        except APIError as e:
-            api_response_callback(e.request, e.body, e)
-            return messages
 
-        api_response_callback(
-            raw_response.http_response.request, raw_response.http_response, None
-        )
-
-        response = raw_response.parse()
-
-        response_params = _response_to_params(response)
-        messages.append(
-            {
-                "role": "assistant",
-                "content": response_params,
-            }
-        )
-
-        tool_result_content: list[BetaToolResultBlockParam] = []
-        for content_block in response_params:
-            output_callback(content_block)
-            if content_block["type"] == "tool_use":
-                result = await tool_collection.run(
-                    name=content_block["name"],
-                    tool_input=cast(dict[str, Any], content_block["input"]),
-                )
-                tool_result_content.append(
-                    _make_api_tool_result(result, content_block["id"])
+            tool_uses = [
+                cast(BetaToolUseBlockParam, block)
+                for block in response_params
+                if block["type"] == "tool_use"
+            ]
+            if stream:
+                # streamed blocks were handed out and their tools started as
+                # they completed
+                results = [await tool_runs.pop(block["id"]) for block in tool_uses]
+            else:
+                for content_block in response_params:
+                    output_callback(content_block)
+                # Tracked in tool_runs, so if one raises the others are
+                # cancelled below instead of running on
+                for block in tool_uses:
+                    tool_runs[block["id"]] = asyncio.create_task(
+                        tool_collection.run(
+                            name=block["name"],
+                            tool_input=cast(dict[str, Any], block["input"]),
+                        )
+                    )
+                results = await asyncio.gather(
+                    *(tool_runs[block["id"]] for block in tool_uses)
                 )
-                tool_output_callback(result, content_block["id"])
+                for block, result in zip(tool_uses, results, strict=True):
+                    await _notify(tool_output_callback, result, block["id"])
+
+            tool_result_content: list[BetaToolResultBlockParam] = [
+                _make_api_tool_result(result, block["id"])
+                for block, result in zip(tool_uses, results, strict=True)
+            ]
+        finally:
+            # Left over only if the step failed: don't run the rest of its tools
+            for run in tool_runs.values():
+                run.cancel()
+            await asyncio.gather(*tool_runs.values(), return_exceptions=True)
+            tool_runs.clear()
 
         if not tool_result_content:
+            await _notify(step_callback, messages[-1:])
             return messages
 
         messages.append({"content": tool_result_content, "role": "user"})
+        await _notify(step_callback, messages[-2:])
+
+
+async def _notify(callback: Callable[..., Awaitable[None] | None] | None, *args: Any):
+    """Call a callback that may be sync or async."""
+    if callback is None:
+        return
+    result = callback(*args)
+    if inspect.isawaitable(result):
+        await result
+
+
+async def _run_tool(
+    tool_collection: ToolCollection,
+    block: BetaContentBlockParam,
+    tool_output_callback: Callable[[ToolResult, str], Awaitable[None] | None],
+    after: asyncio.Task[ToolResult] | None = None,
+) -> ToolResult:
+    block = cast(BetaToolUseBlockParam, block)
+    result = await tool_collection.run(
+        name=block["name"],
+        tool_input=cast(dict[str, Any], block["input"]),
+    )
+    if after is not None:
+        # Report results in the order the model called the tools
+        await after
+    await _notify(tool_output_callback, result, block["id"])
+    return result
+
+
+async def _stream_message(
+    client: Any,
+    request: dict[str, Any],
+    *,
+    on_response: Callable[[httpx.Response], None],
+    on_block: Callable[[BetaContentBlockParam], None],
+    on_delta: Callable[[dict[str, Any]], None] | None,
+) -> BetaMessage:
+    """
+    Stream one message, calling back on the event loop as events arrive.
+
+    The SDK clients are synchronous, so the stream is read in a worker thread
+    and its events are handed to the loop; the loop stays free to forward them
+    while the model is still generating. Returns the assembled message.
+    """
+    loop = asyncio.get_running_loop()
+    events: asyncio.Queue[tuple[str, Any]] = asyncio.Queue()
+    stop = threading.Event()
+
+    def put(kind: str, value: Any):
+        loop.call_soon_threadsafe(events.put_nowait, (kind, value))
+
+    def read():
+        try:
+            with client.beta.messages.stream(**request) as message_stream:
+                for event in message_stream:
+                    if stop.is_set():
+                        return
+                    if event.type in ("content_block_delta", "content_block_stop"):
+                        put(event.type, event)
+                message = message_stream.get_final_message()
+                put("response", _streamed_response(message_stream.response, message))
+                put("message", message)
+        except BaseException as e:
+            put("error", e)
+
+    reader = loop.run_in_executor(None, read)
+    try:
+        while True:
+            kind, value = await events.get()
+            if kind == "response":
+                on_response(value)
+            elif kind == "content_block_delta":
+                if on_delta is not None:
+                    on_delta({"index": value.index, **value.delta.model_dump()})
+            elif kind == "content_block_stop":
+                block = _block_to_params(value.content_block)
+                if block is not None:
+                    on_block(block)
+                    # Let a tool started by on_block begin before more events
+                    await asyncio.sleep(0)
+            elif kind == "message":
+                return value
+            else:
+                raise value
+    finally:
+        # On cancellation, let the reader drop the stream at its next event
+        stop.set()
+        if reader.done():
+            reader.result()
+
+
+def _streamed_response(
+    response: httpx.Response, message: BetaMessage
+) -> httpx.Response:
+    """
+    A read response standing in for a streamed one: the streamed body was
+    consumed event by event and can't be read again, so the assembled message
+    takes its place.
+    """
+    headers = {
+        key: value
+        for key, value in response.headers.items()
+        if key.lower()
+        not in (
+            "content-encoding",
+            "content-length",
+            "content-type",
+            "transfer-encoding",
+        )
+    }
+    return httpx.Response(
+        status_code=response.status_code,
+        headers=headers,
+        json=message.model_dump(mode="json"),
+        request=response.request,
+    )
 
 
 def _maybe_filter_to_n_most_recent_images(
@@ -239,24 +434,30 @@ def _response_to_params(
 ) -> list[BetaContentBlockParam]:
     res: list[BetaContentBlockParam] = []
     for block in response.content:
-        if isinstance(block, BetaTextBlock):
-            if block.text:
-                res.append(BetaTextBlockParam(type="text", text=block.text))
-            elif getattr(block, "type", None) == "thinking":
-                # Handle thinking blocks - include signature field
-                thinking_block = {
-                    "type": "thinking",
-                    "thinking": getattr(block, "thinking", None),
-                }
-                if hasattr(block, "signature"):
-                    thinking_block["signature"] = getattr(block, "signature", None)
-                res.append(cast(BetaContentBlockParam, thinking_block))
-        else:
-            # Handle tool use blocks normally
-            res.append(cast(BetaToolUseBlockParam, block.model_dump()))
+        param = _block_to_params(block)
+        if param is not None:
+            res.append(param)
     return res
 
 
+def _block_to_params(block: Any) -> BetaContentBlockParam | None:
+    if isinstance(block, BetaTextBlock):
+        if block.text:
+            return BetaTextBlockParam(type="text", text=block.text)
+        elif getattr(block, "type", None) == "thinking":
+            # Handle thinking blocks - include signature field
+            thinking_block = {
+                "type": "thinking",
+                "thinking": getattr(block, "thinking", None),
+            }
+            if hasattr(block, "signature"):
+                thinking_block["signature"] = getattr(block, "signature", None)
+            return cast(BetaContentBlockParam, thinking_block)
+        return None
+    # Handle tool use blocks normally
+    return cast(BetaToolUseBlockParam, block.model_dump())
+
+
 def _inject_prompt_caching(
     messages: list[BetaMessageParam],
 ):
@@ -299,14 +500,15 @@ def _make_api_tool_result(
                     "text": _maybe_prepend_system_tool_result(result, result.output),
                 }
             )
-        if result.base64_image:
+        if result.image:
+            # The image's cached base64 string, not a copy of it
             tool_result_content.append(
                 {
                     "type": "image",
                     "source": {
                         "type": "base64",
-                        "media_type": "image/png",
-                        "data": result.base64_image,
+                        "media_type": cast(Any, result.image.media_type),
+                        "data": result.image.base64,
                     },
                 }
             )
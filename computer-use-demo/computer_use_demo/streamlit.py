@@ -3,7 +3,6 @@ Entrypoint for streamlit, see https://docs.streamlit.io/
 """
 
 import asyncio
-import base64
 import os
 import subprocess
 import traceback
@@ -13,7 +12,7 @@ from datetime import datetime, timedelta
 from enum import StrEnum
 from functools import partial
 from pathlib import PosixPath
-from typing import cast, get_args
+from typing import Any, cast, get_args
 
 import httpx
 import streamlit as st
@@ -136,6 +135,10 @@ def setup_state():
         st.session_state.token_efficient_tools_beta = False
     if "in_sampling_loop" not in st.session_state:
         st.session_state.in_sampling_loop = False
+    if "stream" not in st.session_state:
+        st.session_state.stream = True
+    if "image_encoding" not in st.session_state:
+        st.session_state.image_encoding = ""
 
 
 def _reset_model():
@@ -217,6 +220,19 @@ async def main():
             ),
         )
         st.checkbox("Hide screenshots", key="hide_images")
+        st.checkbox(
+            "Stream responses",
+            key="stream",
+            help="Show text as the model generates it",
+        )
+        st.selectbox(
+            "Screenshot encoding",
+            key="image_encoding",
+            options=["", "png", "png:9", "png-palette", "jpeg:75", "webp:80"],
+            format_func=lambda spec: spec or "Tool version default",
+            help="How screenshots are encoded for the model; lossy and palette "
+            "encodings make requests smaller",
+        )
         st.checkbox(
             "Enable token-efficient tools beta", key="token_efficient_tools_beta"
         )
@@ -310,6 +326,7 @@ async def main():
             # we don't have a user message to respond to, exit early
             return
 
+        streamed_text = _StreamedText()
         with track_sampling_loop():
             # run the agent sampling loop with the newest message
             st.session_state.messages = await sampling_loop(
@@ -317,7 +334,7 @@ async def main():
                 model=st.session_state.model,
                 provider=st.session_state.provider,
                 messages=st.session_state.messages,
-                output_callback=partial(_render_message, Sender.BOT),
+                output_callback=streamed_text.block,
                 tool_output_callback=partial(
                     _tool_output_callback, tool_state=st.session_state.tools
                 ),
@@ -334,6 +351,9 @@ async def main():
                 if st.session_state.thinking
                 else None,
                 token_efficient_tools_beta=st.session_state.token_efficient_tools_beta,
+                stream=st.session_state.stream,
+                delta_callback=streamed_text.delta,
+                image_encoding=st.session_state.image_encoding or None,
             )
 
 
@@ -460,7 +480,10 @@ def _render_api_response(
                 st.markdown(
                     f"`{response.status_code}`{newline}{newline.join(f'`{k}: {v}`' for k, v in response.headers.items())}"
                 )
-                st.json(response.text)
+                try:
+                    st.json(response.text)
+                except httpx.ResponseNotRead:
+                    st.write("(streamed response body)")
             else:
                 st.write(response)
 
@@ -480,6 +503,31 @@ def _render_error(error: Exception):
     st.error(f"**{error.__class__.__name__}**\n\n{body}", icon=":material/error:")
 
 
+class _StreamedText:
+    """Renders text deltas into a placeholder message while the model generates."""
+
+    def __init__(self):
+        self.placeholder = None
+        self.text = ""
+
+    def delta(self, delta: dict[str, Any]):
+        if delta.get("type") != "text_delta":
+            return
+        if self.placeholder is None:
+            self.placeholder = st.chat_message(Sender.BOT).empty()
+        self.text += delta.get("text", "")
+        self.placeholder.markdown(self.text)
+
+    def block(self, block: BetaContentBlockParam):
+        if block["type"] == "text" and self.placeholder is not None:
+            # the completed block replaces its preview
+            self.placeholder.markdown(block["text"])
+        else:
+            _render_message(Sender.BOT, block)
+        self.placeholder = None
+        self.text = ""
+
+
 def _render_message(
     sender: Sender,
     message: str | BetaContentBlockParam | ToolResult,
@@ -504,8 +552,8 @@ def _render_message(
                     st.markdown(message.output)
             if message.error:
                 st.error(message.error)
-            if message.base64_image and not st.session_state.hide_images:
-                st.image(base64.b64decode(message.base64_image))
+            if message.image and not st.session_state.hide_images:
+                st.image(message.image.data)
         elif isinstance(message, dict):
             if message["type"] == "text":
                 st.write(message["text"])
@@ -1,14 +1,16 @@
-from .base import CLIResult, ToolResult
+from .base import CLIResult, ImageHandle, ToolResult
 from .bash import BashTool20241022, BashTool20250124
 from .collection import ToolCollection
-from .computer import ComputerTool20241022, ComputerTool20250124
+from .computer import BaseComputerTool, ComputerTool20241022, ComputerTool20250124
 from .edit import EditTool20241022, EditTool20250124, EditTool20250429
 from .groups import TOOL_GROUPS_BY_VERSION, ToolVersion
 
 __ALL__ = [
+    BaseComputerTool,
     BashTool20241022,
     BashTool20250124,
     CLIResult,
+    ImageHandle,
     ComputerTool20241022,
     ComputerTool20250124,
     EditTool20241022,
@@ -1,4 +1,6 @@
+import base64
 from abc import ABCMeta, abstractmethod
+from collections.abc import Hashable
 from dataclasses import dataclass, fields, replace
 from typing import Any
 
@@ -19,6 +21,55 @@ class BaseAnthropicTool(metaclass=ABCMeta):
     ) -> BetaToolUnionParam:
         raise NotImplementedError
 
+    def concurrency_key(self, **kwargs) -> Hashable:
+        """
+        The resource a call with these arguments needs to itself. Calls with the
+        same key run one at a time, in order; calls with different keys may run
+        concurrently. By default every call of a tool shares one key.
+        """
+        return self
+
+
+class ImageHandle:
+    """
+    An encoded image (e.g. a screenshot), held once as raw bytes. The base64
+    text the API wants is made the first time it is asked for and then
+    shared, so passing the image along never copies it into new strings.
+    """
+
+    __slots__ = ("data", "media_type", "_base64", "__weakref__")
+
+    def __init__(self, data: bytes, media_type: str = "image/png"):
+        self.data = data
+        self.media_type = media_type
+        self._base64: str | None = None
+
+    @classmethod
+    def from_base64(cls, data: str, media_type: str = "image/png") -> "ImageHandle":
+        handle = cls(base64.b64decode(data), media_type)
+        handle._base64 = data
+        return handle
+
+    @property
+    def base64(self) -> str:
+        if self._base64 is None:
+            self._base64 = base64.b64encode(self.data).decode("ascii")
+        return self._base64
+
+    def __len__(self):
+        return len(self.data)
+
+    def __eq__(self, other):
+        if not isinstance(other, ImageHandle):
+            return NotImplemented
+        return self.media_type == other.media_type and self.data == other.data
+
+    def __hash__(self):
+        return hash((self.media_type, self.data))
+
+    def __repr__(self):
+        return f"ImageHandle({self.media_type!r}, {len(self.data)} bytes)"
+
 
 @dataclass(kw_only=True, frozen=True)
 class ToolResult:
@@ -26,16 +77,19 @@ class ToolResult:
 
     output: str | None = None
     error: str | None = None
-    base64_image: str | None = None
+    image: ImageHandle | None = None
     system: str | None = None
 
+    @property
+    def base64_image(self) -> str | None:
+        """The image as base64, encoded on first use."""
+        return self.image.base64 if self.image is not None else None
+
     def __bool__(self):
         return any(getattr(self, field.name) for field in fields(self))
 
     def __add__(self, other: "ToolResult"):
-        def combine_fields(
-            field: str | None, other_field: str | None, concatenate: bool = True
-        ):
+        def combine_fields(field: Any, other_field: Any, concatenate: bool = True):
             if field and other_field:
                 if concatenate:
                     return field + other_field
@@ -45,7 +99,7 @@ class ToolResult:
         return ToolResult(
             output=combine_fields(self.output, other.output),
             error=combine_fields(self.error, other.error),
-            base64_image=combine_fields(self.base64_image, other.base64_image, False),
+            image=combine_fields(self.image, other.image, False),
             system=combine_fields(self.system, other.system),
         )
 
@@ -1,5 +1,7 @@
 """Collection classes for managing multiple tools."""
 
+import asyncio
+from collections.abc import Hashable
 from typing import Any
 
 from anthropic.types.beta import BetaToolUnionParam
@@ -13,11 +15,21 @@ from .base import (
 
 
 class ToolCollection:
-    """A collection of anthropic-defined tools."""
+    """
+    A collection of anthropic-defined tools.
+
+    `run` may be called concurrently, e.g. with `asyncio.gather` for the tool
+    calls of one response: each call holds a lock on its tool's
+    `concurrency_key` while it runs, so conflicting calls (the same display,
+    file or shell session) run one at a time in the order they were made, and
+    the rest overlap.
+    """
 
     def __init__(self, *tools: BaseAnthropicTool):
         self.tools = tools
         self.tool_map = {tool.to_params()["name"]: tool for tool in tools}
+        # One per (tool, concurrency key) seen; a collection lives for one loop
+        self._locks: dict[tuple[str, Hashable], asyncio.Lock] = {}
 
     def to_params(
         self,
@@ -29,6 +41,16 @@ class ToolCollection:
         if not tool:
             return ToolFailure(error=f"Tool {name} is invalid")
         try:
-            return await tool(**tool_input)
+            key = (name, tool.concurrency_key(**tool_input))
+        except Exception as e:
+            # Malformed input from the model, e.g. {"path": None}: report it
+            # like any other tool error instead of failing the loop
+            return ToolFailure(error=f"Invalid input for {name}: {e}")
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        try:
+            async with lock:
+                return await tool(**tool_input)
         except ToolError as e:
             return ToolFailure(error=e.message)
@@ -1,5 +1,4 @@
 import asyncio
-import base64
 import os
 import shlex
 import shutil
@@ -10,8 +9,10 @@ from uuid import uuid4
 
 from anthropic.types.beta import BetaToolComputerUse20241022Param, BetaToolUnionParam
 
-from .base import BaseAnthropicTool, ToolError, ToolResult
+from .base import BaseAnthropicTool, ImageHandle, ToolError, ToolResult
+from .input import get_x_input
 from .run import run
+from .screen import PNG, Encoding, FrameCache, get_screen_capture, settle_stats
 
 OUTPUT_DIR = "/tmp/outputs"
 
@@ -83,6 +84,12 @@ def chunks(s: str, chunk_size: int) -> list[str]:
     return [s[i : i + chunk_size] for i in range(0, len(s), chunk_size)]
 
 
+def _join_output(output: str | None, note: str | None) -> str | None:
+    if not note:
+        return output
+    return f"{output}\n{note}" if output else note
+
+
 class BaseComputerTool:
     """
     A tool that allows the agent to interact with the screen, keyboard, and mouse of the current computer.
@@ -95,7 +102,19 @@ class BaseComputerTool:
     display_num: int | None
 
     _screenshot_delay = 2.0
+    # After an action, wait until the screen has been still for this long
+    # (checked every _settle_interval seconds) rather than always sleeping
+    # _screenshot_delay, which becomes the upper bound. None: always sleep
+    _settle_quiet: float | None = 0.3
+    _settle_interval = 0.05
     _scaling_enabled = True
+    # After an action, send a short note instead of a screenshot identical to
+    # the last one, and (optionally) only the part of the screen that changed
+    _skip_unchanged_screenshots = True
+    _crop_changed_screenshots = False
+    # How screenshots are encoded for the model; sampling_loop sets it per
+    # tool version or session
+    image_encoding: Encoding = PNG
 
     @property
     def options(self) -> ComputerToolOptions:
@@ -122,6 +141,17 @@ class BaseComputerTool:
             self._display_prefix = ""
 
         self.xdotool = f"{self._display_prefix}xdotool"
+        self._capture = get_screen_capture(self.display_num)
+        self._input = get_x_input(self.display_num)
+        # What this tool last showed the model, and actions since without a change
+        self._frames = FrameCache()
+        self._unchanged_actions = 0
+        # The action being run, for the settle statistics
+        self._action = "unknown"
+
+    def concurrency_key(self, **kwargs):
+        # Input and screenshots act on the whole display
+        return ("display", self.display_num)
 
     async def __call__(
         self,
@@ -131,6 +161,7 @@ class BaseComputerTool:
         coordinate: tuple[int, int] | None = None,
         **kwargs,
     ):
+        self._action = action
         if action in ("mouse_move", "left_click_drag"):
             if coordinate is None:
                 raise ToolError(f"coordinate is required for {action}")
@@ -170,11 +201,14 @@ class BaseComputerTool:
                     results.append(
                         await self.shell(" ".join(command_parts), take_screenshot=False)
                     )
-                screenshot_base64 = (await self.screenshot()).base64_image
+                screenshot = await self.screenshot(changes_only=True)
                 return ToolResult(
-                    output="".join(result.output or "" for result in results),
+                    output=_join_output(
+                        "".join(result.output or "" for result in results),
+                        screenshot.output,
+                    ),
                     error="".join(result.error or "" for result in results),
-                    base64_image=screenshot_base64,
+                    image=screenshot.image,
                 )
 
         if action in (
@@ -219,8 +253,48 @@ class BaseComputerTool:
 
         return self.scale_coordinates(ScalingSource.API, coordinate[0], coordinate[1])
 
-    async def screenshot(self):
-        """Take a screenshot of the current screen and return the base64 encoded image."""
+    async def screenshot(self, *, changes_only: bool = False):
+        """Take a screenshot of the current screen and return it as an image.
+
+        With `changes_only` (screenshots taken after an action), an unchanged
+        screen gives a text note instead of an image, and a changed one may be
+        cropped to the changed region; see `_skip_unchanged_screenshots`.
+        """
+        size = None
+        if self._scaling_enabled:
+            size = self.scale_coordinates(
+                ScalingSource.COMPUTER, self.width, self.height
+            )
+        # Capture in-process when possible; the commands below are the fallback
+        frame = await self._capture.grab(
+            size,
+            frames=self._frames,
+            changes_only=changes_only and self._skip_unchanged_screenshots,
+            crop=self._crop_changed_screenshots,
+            encoding=self.image_encoding,
+        )
+        if frame is not None:
+            if frame.data is None:
+                self._unchanged_actions += 1
+                return ToolResult(
+                    output=f"The screen has not changed since the last screenshot "
+                    f"({self._unchanged_actions} action(s) ago); no new screenshot."
+                )
+            self._unchanged_actions = 0
+            output = None
+            if frame.region is not None:
+                left, top, right, bottom = frame.region
+                output = (
+                    f"Only the changed part of the screen is shown: {right - left}x"
+                    f"{bottom - top} at ({left}, {top}). The rest is unchanged."
+                )
+            return ToolResult(
+                output=output, image=ImageHandle(frame.data, frame.media_type)
+            )
+        # The model is shown a frame this cache didn't see, always as PNG
+        self._frames.reset()
+        self._unchanged_actions = 0
+
         output_dir = Path(OUTPUT_DIR)
         output_dir.mkdir(parents=True, exist_ok=True)
         path = output_dir / f"screenshot_{uuid4().hex}.png"
@@ -233,31 +307,50 @@ class BaseComputerTool:
             screenshot_cmd = f"{self._display_prefix}scrot -p {path}"
 
         result = await self.shell(screenshot_cmd, take_screenshot=False)
-        if self._scaling_enabled:
-            x, y = self.scale_coordinates(
-                ScalingSource.COMPUTER, self.width, self.height
-            )
+        if size is not None:
+            x, y = size
             await self.shell(
                 f"convert {path} -resize {x}x{y}! {path}", take_screenshot=False
             )
 
         if path.exists():
-            return result.replace(
-                base64_image=base64.b64encode(path.read_bytes()).decode()
-            )
+            image = ImageHandle(path.read_bytes())
+            path.unlink()
+            return result.replace(image=image)
         raise ToolError(f"Failed to take screenshot: {result.error}")
 
     async def shell(self, command: str, take_screenshot=True) -> ToolResult:
         """Run a shell command and return the output, error, and optionally a screenshot."""
-        _, stdout, stderr = await run(command)
-        base64_image = None
+        output = None
+        if command.startswith(f"{self.xdotool} "):
+            # xdotool commands go over a persistent X connection when possible
+            output = await self._input.run(command.removeprefix(f"{self.xdotool} "))
+        if output is not None:
+            stdout, stderr = output, ""
+        else:
+            _, stdout, stderr = await run(command)
+        image = None
 
         if take_screenshot:
-            # delay to let things settle before taking a screenshot
-            await asyncio.sleep(self._screenshot_delay)
-            base64_image = (await self.screenshot()).base64_image
-
-        return ToolResult(output=stdout, error=stderr, base64_image=base64_image)
+            await self.settle()
+            screenshot = await self.screenshot(changes_only=True)
+            stdout = _join_output(stdout, screenshot.output)
+            image = screenshot.image
+
+        return ToolResult(output=stdout, error=stderr, image=image)
+
+    async def settle(self):
+        """Let things settle after an action, before taking a screenshot."""
+        if self._settle_quiet is not None:
+            settled = await self._capture.settle(
+                quiet=self._settle_quiet,
+                timeout=self._screenshot_delay,
+                interval=self._settle_interval,
+            )
+            if settled is not None:
+                settle_stats.record(self._action, *settled)
+                return
+        await asyncio.sleep(self._screenshot_delay)
 
     def scale_coordinates(self, source: ScalingSource, x: int, y: int):
         """Scale coordinates to a target maximum resolution."""
@@ -313,6 +406,7 @@ class ComputerTool20250124(BaseComputerTool, BaseAnthropicTool):
         key: str | None = None,
         **kwargs,
     ):
+        self._action = action
         if action in ("left_mouse_down", "left_mouse_up"):
             if coordinate is not None:
                 raise ToolError(f"coordinate is not accepted for {action=}.")
@@ -372,7 +466,7 @@ class ComputerTool20250124(BaseComputerTool, BaseAnthropicTool):
 
             if action == "wait":
                 await asyncio.sleep(duration)
-                return await self.screenshot()
+                return await self.screenshot(changes_only=True)
 
         if action in (
             "left_click",
@@ -43,6 +43,10 @@ class EditTool20250124(BaseAnthropicTool):
             "type": self.api_type,
         }
 
+    def concurrency_key(self, *, path: str = "", **kwargs):
+        # Operations on different files don't conflict
+        return ("path", Path(path))
+
     async def __call__(
         self,
         *,
@@ -316,6 +320,10 @@ class EditTool20250429(BaseAnthropicTool):
             "type": self.api_type,
         }
 
+    def concurrency_key(self, *, path: str = "", **kwargs):
+        # Operations on different files don't conflict
+        return ("path", Path(path))
+
     async def __call__(
         self,
         *,
@@ -19,6 +19,8 @@ class ToolGroup:
     version: ToolVersion
     tools: list[type[BaseAnthropicTool]]
     beta_flag: BetaFlag | None = None
+    # Screenshot encoding spec, see computer_use_demo.tools.screen.Encoding
+    image_encoding: str = "png"
 
 
 TOOL_GROUPS: list[ToolGroup] = [
@@ -0,0 +1,372 @@
+"""In-process keyboard and mouse input for the computer tool."""
+
+import asyncio
+import shlex
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+from .base import ToolError
+
+try:
+    from Xlib import XK, X, display as xdisplay
+    from Xlib.ext import xtest
+except ImportError:  # optional: the computer tool falls back to running xdotool
+    XK = X = xdisplay = xtest = None
+
+# xdotool's defaults, in milliseconds
+KEY_DELAY_MS = 12
+CLICK_REPEAT_DELAY_MS = 100
+
+# xdotool chain commands run here; a command line using anything else runs
+# through the real xdotool
+COMMANDS = {
+    "mousemove",
+    "click",
+    "mousedown",
+    "mouseup",
+    "key",
+    "keydown",
+    "keyup",
+    "type",
+    "sleep",
+    "getmouselocation",
+}
+
+# Options that take no value
+FLAGS = {"--sync", "--shell"}
+
+# Key names xdotool accepts besides X keysym names
+KEY_ALIASES = {
+    "alt": "Alt_L",
+    "ctrl": "Control_L",
+    "control": "Control_L",
+    "meta": "Meta_L",
+    "super": "Super_L",
+    "shift": "Shift_L",
+}
+
+# Characters typed with a named key
+TYPE_KEYS = {"\n": "Return", "\t": "Tab"}
+
+Op = tuple[str, Any]
+
+
+class UnsupportedCommand(Exception):
+    """The command can't be run in-process; run it with xdotool instead."""
+
+
+def parse_xdotool(command: str) -> list[Op]:
+    """
+    Split an xdotool command chain (the arguments after `xdotool`) into
+    operations, e.g. "mousemove --sync 10 20 click 1" into
+    [("mousemove", (10, 20, True)), ("click", (1, 1, 100))].
+    """
+    try:
+        args = shlex.split(command)
+    except ValueError as e:
+        raise UnsupportedCommand(str(e)) from e
+    ops: list[Op] = []
+    i = 0
+
+    def options(names: set[str]) -> dict[str, str | bool]:
+        nonlocal i
+        found: dict[str, str | bool] = {}
+        while i < len(args) and args[i].startswith("--"):
+            name = args[i]
+            i += 1
+            if name == "--":
+                found["--"] = True
+                break
+            if name in FLAGS and name in names:
+                found[name] = True
+            elif name in names and i < len(args):
+                found[name] = args[i]
+                i += 1
+            else:
+                raise UnsupportedCommand(f"option {name}")
+        return found
+
+    def words(opts: dict[str, str | bool]) -> list[str]:
+        # A command's arguments run up to the next command in the chain, or
+        # after "--" to the end: "type -- type" types the word
+        nonlocal i
+        start = i
+        if "--" in opts:
+            i = len(args)
+        while i < len(args) and args[i] not in COMMANDS:
+            i += 1
+        return args[start:i]
+
+    def number(value: str | bool, cast=int):
+        try:
+            return cast(value)
+        except (TypeError, ValueError) as e:
+            raise UnsupportedCommand(f"bad number {value!r}") from e
+
+    while i < len(args):
+        name = args[i]
+        i += 1
+        if name not in COMMANDS:
+            raise UnsupportedCommand(f"command {name}")
+        if name == "mousemove":
+            opts = options({"--sync"})
+            position = words(opts)
+            if len(position) != 2:
+                raise UnsupportedCommand("mousemove needs x and y")
+            x, y = (number(value) for value in position)
+            ops.append((name, (x, y, "--sync" in opts)))
+        elif name == "click":
+            opts = options({"--repeat", "--delay"})
+            button = words(opts)
+            if len(button) != 1:
+                raise UnsupportedCommand("click needs one button")
+            ops.append(
+                (
+                    name,
+                    (
+                        number(button[0]),
+                        number(opts.get("--repeat", 1)),
+                        number(opts.get("--delay", CLICK_REPEAT_DELAY_MS)),
+                    ),
+                )
+            )
+        elif name in ("mousedown", "mouseup"):
+            button = words({})
+            if len(button) != 1:
+                raise UnsupportedCommand(f"{name} needs one button")
+            ops.append((name, number(button[0])))
+        elif name in ("key", "keydown", "keyup"):
+            opts = options({"--delay"})
+            keys = words(opts)
+            if not keys:
+                raise UnsupportedCommand(f"{name} needs a key")
+            ops.append((name, (keys, number(opts.get("--delay", KEY_DELAY_MS)))))
+        elif name == "type":
+            opts = options({"--delay"})
+            ops.append(
+                (
+                    name,
+                    ("".join(words(opts)), number(opts.get("--delay", KEY_DELAY_MS))),
+                )
+            )
+        elif name == "sleep":
+            seconds = words({})
+            if len(seconds) != 1:
+                raise UnsupportedCommand("sleep needs a duration")
+            ops.append((name, number(seconds[0], float)))
+        else:  # getmouselocation
+            opts = options({"--shell"})
+            if "--shell" not in opts or words(opts):
+                raise UnsupportedCommand("only getmouselocation --shell")
+            ops.append((name, None))
+    return ops
+
+
+class XInput:
+    """
+    Runs xdotool command chains over one persistent connection to an X
+    display, sending input with the XTest extension: no shell or xdotool
+    process per action, and a whole chain (e.g. move, click, release) goes out
+    in one call.
+
+    Like xdotool, key and type commands take keysym names, "ctrl+shift+t"
+    style combinations and plain text. Commands it can't run (unknown
+    options, keys or characters that aren't on the keyboard map) are
+    rejected before any input is sent, and `run` returns None so the caller
+    runs xdotool instead; so does a failed connection, as long as nothing was
+    sent yet. Once part of a chain went out a failure raises ToolError, since
+    running the whole chain again would repeat that input. Xlib connections
+    aren't thread-safe, so all input for a display goes through one worker
+    thread.
+    """
+
+    def __init__(self, display_num: int | None):
+        self.display = f":{display_num}" if display_num is not None else None
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix=f"x-input{self.display or ''}"
+        )
+        self._display: Any = None
+        # Whether the running command has sent any input yet
+        self._sent = False
+        # metrics
+        self.commands = 0
+        self.fallbacks = 0
+        self.failures = 0
+        self.command_total = 0.0
+
+    @property
+    def available(self) -> bool:
+        return xtest is not None
+
+    async def run(self, command: str) -> str | None:
+        """Run the arguments of an xdotool command line; returns its stdout, or
+        None if the caller should run xdotool itself. Raises ToolError if it
+        failed after sending part of the input."""
+        if not self.available:
+            return None
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._run, command)
+
+    def close(self):
+        self._executor.submit(self._disconnect).result()
+        self._executor.shutdown()
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "available": self.available,
+            "commands": self.commands,
+            "fallbacks": self.fallbacks,
+            "failures": self.failures,
+            "command_avg_ms": self.command_total / self.commands * 1000
+            if self.commands
+            else 0.0,
+        }
+
+    def _run(self, command: str) -> str | None:
+        started = time.perf_counter()
+        self._sent = False
+        try:
+            ops = parse_xdotool(command)
+            if self._display is None:
+                self._display = xdisplay.Display(self.display)
+            # Resolve every key before sending anything, so a chain is never
+            # half done when it has to fall back
+            steps = [self._resolve(name, arg) for name, arg in ops]
+            output = "".join(self._send(name, arg) for name, arg in steps)
+            self._display.sync()
+        except UnsupportedCommand:
+            self.fallbacks += 1
+            return None
+        except Exception as e:
+            # e.g. the display went away; reconnect next time
+            self._disconnect()
+            if self._sent:
+                self.failures += 1
+                raise ToolError(
+                    f"Input to display {self.display} failed part way through "
+                    f"`xdotool {command}`: {e}"
+                ) from e
+            self.fallbacks += 1
+            return None
+        self.commands += 1
+        self.command_total += time.perf_counter() - started
+        return output
+
+    def _resolve(self, name: str, arg: Any) -> Op:
+        if name in ("key", "keydown", "keyup"):
+            keys, delay = arg
+            return name, ([self._combo(key) for key in keys], delay)
+        if name == "type":
+            text, delay = arg
+            return name, ([self._char(char) for char in text], delay)
+        return name, arg
+
+    def _combo(self, key: str) -> list[int]:
+        # "shift+A" needs Shift once
+        keycodes = [code for part in key.split("+") for code in self._keycodes(part)]
+        return list(dict.fromkeys(keycodes))
+
+    def _keycodes(self, name: str) -> list[int]:
+        """Keycodes to press together for a key name, e.g. Shift and the A key
+        for "A", like xdotool."""
+        keysym = XK.string_to_keysym(KEY_ALIASES.get(name.lower(), name))
+        if not keysym and len(name) == 1:
+            keysym = _char_keysym(name)
+        return self._keysym_keycodes(keysym, f"key {name}")
+
+    def _char(self, char: str) -> list[int]:
+        """Keycodes to press together to type `char`."""
+        if char in TYPE_KEYS:
+            return self._keycodes(TYPE_KEYS[char])
+        return self._keysym_keycodes(_char_keysym(char), f"character {char!r}")
+
+    def _keysym_keycodes(self, keysym: int, what: str) -> list[int]:
+        # The keysym's key, after Shift if it's on the shifted level
+        for keycode, index in (
+            self._display.keysym_to_keycodes(keysym) if keysym else ()
+        ):
+            if index == 0:
+                return [keycode]
+            if index == 1:
+                return [*self._keycodes("Shift_L"), keycode]
+        raise UnsupportedCommand(what)
+
+    def _send(self, name: str, arg: Any) -> str:
+        if name == "mousemove":
+            x, y, sync = arg
+            self._fake(X.MotionNotify, x=x, y=y)
+            if sync:
+                self._display.sync()
+        elif name == "click":
+            button, repeat, delay = arg
+            for n in range(repeat):
+                if n:
+                    self._display.sync()
+                    time.sleep(delay / 1000)
+                self._fake(X.ButtonPress, button)
+                self._fake(X.ButtonRelease, button)
+        elif name in ("mousedown", "mouseup"):
+            event = X.ButtonPress if name == "mousedown" else X.ButtonRelease
+            self._fake(event, arg)
+        elif name in ("key", "keydown", "keyup", "type"):
+            combos, delay = arg
+            for n, keycodes in enumerate(combos):
+                if n and delay:
+                    self._display.sync()
+                    time.sleep(delay / 1000)
+                if name != "keyup":
+                    for keycode in keycodes:
+                        self._fake(X.KeyPress, keycode)
+                if name != "keydown":
+                    for keycode in reversed(keycodes):
+                        self._fake(X.KeyRelease, keycode)
+        elif name == "sleep":
+            self._display.sync()
+            time.sleep(arg)
+        elif name == "getmouselocation":
+            pointer = self._display.screen().root.query_pointer()
+            return (
+                f"X={pointer.root_x}\nY={pointer.root_y}\nSCREEN=0\n"
+                f"WINDOW={pointer.child or 0}\n"
+            )
+        return ""
+
+    def _fake(self, event: int, detail: int = 0, **position: int):
+        xtest.fake_input(self._display, event, detail, **position)
+        self._sent = True
+
+    def _disconnect(self):
+        if self._display is not None:
+            try:
+                self._display.close()
+            finally:
+                self._display = None
+
+
+def _char_keysym(char: str) -> int:
+    # Latin-1 keysyms equal the code point; others use the Unicode range
+    code = ord(char)
+    return code if code < 0x100 else 0x01000000 | code
+
+
+_inputs: dict[int | None, XInput] = {}
+_inputs_lock = threading.Lock()
+
+
+def get_x_input(display_num: int | None) -> XInput:
+    """The process-wide input connection for a display, shared by every
+    computer tool on it."""
+    with _inputs_lock:
+        x_input = _inputs.get(display_num)
+        if x_input is None:
+            x_input = _inputs[display_num] = XInput(display_num)
+        return x_input
+
+
+def x_input_stats() -> dict[str, Any]:
+    """Stats of every display's input connection, keyed by display."""
+    with _inputs_lock:
+        inputs = list(_inputs.values())
+    return {x_input.display or "default": x_input.stats() for x_input in inputs}
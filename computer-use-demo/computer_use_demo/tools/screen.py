@@ -0,0 +1,404 @@
+"""In-process screen capture for the computer tool."""
+
+import asyncio
+import io
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Literal, cast
+
+try:
+    import mss
+    from PIL import Image, ImageChops
+except ImportError:  # optional: the computer tool falls back to scrot + convert
+    mss = None
+    Image = ImageChops = None
+
+# A cropped frame is padded by this many pixels around the changed region, and
+# only sent cropped if the crop covers at most this fraction of the screen
+CROP_MARGIN = 16
+CROP_MAX_AREA = 0.5
+
+# While waiting for the screen to settle, frames are compared shrunk by this
+# factor (box-averaged): 1/16 of the pixels to compare and keep. A changed
+# character still shifts its block's average; only near-invisible changes
+# (a few levels in a single pixel) round away
+SETTLE_PROBE_REDUCE = 4
+
+Box = tuple[int, int, int, int]
+
+
+@dataclass(frozen=True)
+class Encoding:
+    """
+    How frames are encoded for the model, written as a spec like "jpeg:70":
+
+    - "png[:level]": lossless, zlib level 0-9 (default 6; 9 is smallest and
+      slowest)
+    - "png-palette[:colors]": PNG reduced to at most 2-256 colours (default
+      256); desktop UIs have few, so this usually halves the size
+    - "jpeg[:quality]", "webp[:quality]": lossy, quality 1-100 (defaults 75
+      and 80); cheapest for photos and gradients, blurs small text
+    """
+
+    format: Literal["png", "png-palette", "jpeg", "webp"] = "png"
+    level: int | None = None
+
+    @classmethod
+    def parse(cls, spec: str) -> "Encoding":
+        name, _, level = spec.strip().lower().partition(":")
+        if name not in ENCODING_LEVELS:
+            raise ValueError(f"unknown image encoding {spec!r}")
+        if not level:
+            return cls(cast(Any, name))
+        low, high = ENCODING_LEVELS[name]
+        if not level.isdigit() or not low <= int(level) <= high:
+            raise ValueError(f"{name} takes a level from {low} to {high}: {spec!r}")
+        return cls(cast(Any, name), int(level))
+
+    @property
+    def media_type(self) -> str:
+        return "image/png" if self.format.startswith("png") else f"image/{self.format}"
+
+    def encode(self, image) -> bytes:
+        buffer = io.BytesIO()
+        if self.format == "png":
+            image.save(buffer, "PNG", compress_level=self._level(6))
+        elif self.format == "png-palette":
+            image = image.quantize(self._level(256), Image.Quantize.FASTOCTREE)
+            image.save(buffer, "PNG")
+        elif self.format == "jpeg":
+            image.save(buffer, "JPEG", quality=self._level(75))
+        else:
+            image.save(buffer, "WEBP", quality=self._level(80))
+        return buffer.getvalue()
+
+    def _level(self, default: int) -> int:
+        return default if self.level is None else self.level
+
+    def __str__(self):
+        return self.format if self.level is None else f"{self.format}:{self.level}"
+
+
+# Valid levels of each format, see Encoding
+ENCODING_LEVELS = {
+    "png": (0, 9),
+    "png-palette": (2, 256),
+    "jpeg": (1, 100),
+    "webp": (1, 100),
+}
+
+PNG = Encoding()
+
+
+@dataclass(frozen=True)
+class Frame:
+    """A capture, encoded as `media_type`. `data` is None if only changes were
+    asked for and the screen is unchanged; `region` is the (left, top, right,
+    bottom) part of the screen `data` shows when it was cropped to the
+    change."""
+
+    data: bytes | None
+    region: Box | None = None
+    media_type: str = "image/png"
+
+
+class FrameCache:
+    """
+    The last frame one consumer (e.g. a computer tool) was shown of a display,
+    to tell whether the screen changed since. Compared pixel for pixel, so
+    even a one-character change counts.
+    """
+
+    def __init__(self):
+        self.image: Any = None
+        # metrics
+        self.frames = 0
+        self.unchanged = 0
+        self.cropped = 0
+
+    def update(self, image) -> Box | None:
+        """Remember `image`; return the bounding box of what changed since the
+        previous frame (the whole screen if there is none), or None."""
+        previous, self.image = self.image, image
+        self.frames += 1
+        if previous is None or previous.size != image.size:
+            return (0, 0, *image.size)
+        box = ImageChops.difference(previous, image).getbbox()
+        if box is None:
+            self.unchanged += 1
+        return box
+
+    def reset(self):
+        self.image = None
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "frames": self.frames,
+            "unchanged": self.unchanged,
+            "cropped": self.cropped,
+        }
+
+
+class ScreenCapture:
+    """
+    Grabs the screen of one X display straight into memory, resizes it there
+    and encodes it once (PNG unless asked otherwise): no subprocesses and no
+    temporary files.
+
+    Frames come from mss (XGetImage/XShm over a persistent X connection). mss
+    connections belong to the thread that opened them, so all captures for a
+    display run on one dedicated worker thread. `grab` returns None when mss or
+    Pillow isn't installed or the display can't be read, and the caller falls
+    back to its screenshot commands.
+    """
+
+    def __init__(self, display_num: int | None):
+        self.display = f":{display_num}" if display_num is not None else None
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix=f"screen-capture{self.display or ''}"
+        )
+        self._sct: Any = None
+        # metrics
+        self.captures = 0
+        self.failures = 0
+        self.capture_total = 0.0
+
+    @property
+    def available(self) -> bool:
+        return mss is not None and Image is not None
+
+    async def grab(
+        self,
+        size: tuple[int, int] | None = None,
+        *,
+        frames: FrameCache | None = None,
+        changes_only: bool = False,
+        crop: bool = False,
+        encoding: Encoding = PNG,
+    ) -> Frame | None:
+        """
+        Capture the screen as `encoding`, resized to `size` if given.
+
+        With `frames`, the capture is compared to (and replaces) the cache's
+        last frame. `changes_only` then skips encoding an unchanged screen
+        (`Frame.data` is None), and `crop` crops a changed one to the region
+        that changed when that is small enough.
+        """
+        if not self.available:
+            return None
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, self._capture, size, frames, changes_only, crop, encoding
+        )
+
+    async def settle(
+        self, *, quiet: float, timeout: float, interval: float
+    ) -> tuple[float, bool] | None:
+        """
+        Wait until the screen has stopped changing for `quiet` seconds, checking
+        every `interval` seconds, but no longer than `timeout`. Returns the time
+        waited and whether the screen settled, or None (without waiting) if the
+        screen can't be captured.
+
+        Polls compare downscaled probes (see SETTLE_PROBE_REDUCE); the
+        full-resolution frame is only captured by the `grab` that follows.
+        """
+        if not self.available:
+            return None
+        loop = asyncio.get_running_loop()
+        started = stable_since = time.monotonic()
+        last = await loop.run_in_executor(self._executor, self._sample)
+        if last is None:
+            return None
+        while True:
+            now = time.monotonic()
+            if now - stable_since >= quiet:
+                return now - started, True
+            if now - started >= timeout:
+                return now - started, False
+            await asyncio.sleep(min(interval, timeout - (now - started)))
+            sample = await loop.run_in_executor(self._executor, self._sample)
+            if sample != last:
+                last, stable_since = sample, time.monotonic()
+
+    def close(self):
+        self._executor.submit(self._disconnect).result()
+        self._executor.shutdown()
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "available": self.available,
+            "captures": self.captures,
+            "failures": self.failures,
+            "capture_avg_ms": self.capture_total / self.captures * 1000
+            if self.captures
+            else 0.0,
+        }
+
+    def _capture(
+        self,
+        size: tuple[int, int] | None,
+        frames: FrameCache | None,
+        changes_only: bool,
+        crop: bool,
+        encoding: Encoding,
+    ) -> Frame | None:
+        started = time.perf_counter()
+        try:
+            image = self._grab()
+        except Exception:
+            # e.g. the display isn't up yet; reconnect on the next capture
+            self.failures += 1
+            self._disconnect()
+            return None
+        if size is not None and size != image.size:
+            # Area averaging: a fraction of Lanczos' cost for these small
+            # downscales, and it keeps text legible with fewer new colours
+            # (smaller PNGs)
+            image = image.resize(size, Image.Resampling.BOX)
+        if frames is None:
+            changed = (0, 0, *image.size)
+        else:
+            changed = frames.update(image)
+        frame = Frame(None)
+        if changed is not None or not changes_only:
+            region = None
+            if changes_only and crop and frames is not None:
+                region = _crop_region(changed, image.size)
+                if region is not None:
+                    frames.cropped += 1
+                    image = image.crop(region)
+            encode_started = time.perf_counter()
+            data = encoding.encode(image)
+            encode_stats.record(
+                str(encoding),
+                image.width * image.height,
+                len(data),
+                time.perf_counter() - encode_started,
+            )
+            frame = Frame(data, region, encoding.media_type)
+        self.captures += 1
+        self.capture_total += time.perf_counter() - started
+        return frame
+
+    def _grab(self):
+        shot = self._grab_raw()
+        return Image.frombuffer("RGB", shot.size, shot.bgra, "raw", "BGRX")
+
+    def _grab_raw(self):
+        if self._sct is None:
+            self._sct = mss.mss(display=self.display)
+        return self._sct.grab(self._sct.monitors[0])
+
+    def _sample(self) -> bytes | None:
+        # A downscaled probe: shrinking is cheaper than comparing (and keeping)
+        # the full frame, and nothing is encoded
+        try:
+            return self._grab().reduce(SETTLE_PROBE_REDUCE).tobytes()
+        except Exception:
+            self._disconnect()
+            return None
+
+    def _disconnect(self):
+        if self._sct is not None:
+            try:
+                self._sct.close()
+            finally:
+                self._sct = None
+
+
+def _crop_region(changed: Box | None, size: tuple[int, int]) -> Box | None:
+    if changed is None:
+        return None
+    width, height = size
+    left, top, right, bottom = changed
+    region = (
+        max(left - CROP_MARGIN, 0),
+        max(top - CROP_MARGIN, 0),
+        min(right + CROP_MARGIN, width),
+        min(bottom + CROP_MARGIN, height),
+    )
+    area = (region[2] - region[0]) * (region[3] - region[1])
+    return region if area <= CROP_MAX_AREA * width * height else None
+
+
+class SettleStats:
+    """How long the computer tool waited for the screen to settle, per action."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._actions: dict[str, dict[str, float]] = {}
+
+    def record(self, action: str, waited: float, settled: bool):
+        with self._lock:
+            entry = self._actions.setdefault(
+                action, {"count": 0, "settled": 0, "total": 0.0, "max": 0.0}
+            )
+            entry["count"] += 1
+            entry["settled"] += settled
+            entry["total"] += waited
+            entry["max"] = max(entry["max"], waited)
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                action: {
+                    "count": entry["count"],
+                    "timed_out": entry["count"] - entry["settled"],
+                    "wait_avg_ms": entry["total"] / entry["count"] * 1000,
+                    "wait_max_ms": entry["max"] * 1000,
+                }
+                for action, entry in self._actions.items()
+            }
+
+
+class EncodeStats:
+    """Sizes and encode times of the frames sent to the model, per encoding."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._encodings: dict[str, dict[str, float]] = {}
+
+    def record(self, encoding: str, pixels: int, size: int, seconds: float):
+        with self._lock:
+            entry = self._encodings.setdefault(
+                encoding, {"count": 0, "pixels": 0, "bytes": 0, "total": 0.0}
+            )
+            entry["count"] += 1
+            entry["pixels"] += pixels
+            entry["bytes"] += size
+            entry["total"] += seconds
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                encoding: {
+                    "count": entry["count"],
+                    "bytes_avg": entry["bytes"] / entry["count"],
+                    # how much smaller than raw 24-bit RGB
+                    "compression_ratio": entry["pixels"] * 3 / entry["bytes"]
+                    if entry["bytes"]
+                    else 0.0,
+                    "encode_avg_ms": entry["total"] / entry["count"] * 1000,
+                }
+                for encoding, entry in self._encodings.items()
+            }
+
+
+settle_stats = SettleStats()
+encode_stats = EncodeStats()
+
+_captures: dict[int | None, ScreenCapture] = {}
+_captures_lock = threading.Lock()
+
+
+def get_screen_capture(display_num: int | None) -> ScreenCapture:
+    """The process-wide capture for a display, shared by every computer tool
+    on it so its X connection stays open between steps."""
+    with _captures_lock:
+        capture = _captures.get(display_num)
+        if capture is None:
+            capture = _captures[display_num] = ScreenCapture(display_num)
+        return capture
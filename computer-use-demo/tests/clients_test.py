@@ -0,0 +1,58 @@
+from unittest import mock
+
+from computer_use_demo.clients import APIProvider, ClientKey, ClientRegistry
+
+
+def test_get_reuses_client_per_key():
+    registry = ClientRegistry()
+    try:
+        first = registry.get(APIProvider.ANTHROPIC, api_key="key-a")
+        assert registry.get("anthropic", api_key="key-a") is first
+        assert registry.get(APIProvider.ANTHROPIC, api_key="key-b") is not first
+        assert registry.stats()["clients"] == 2
+        assert registry.stats()["hits"] == 1
+    finally:
+        registry.close()
+
+
+def test_clients_share_connection_pool_per_base_url():
+    registry = ClientRegistry(max_connections=3)
+    try:
+        a = registry.get(APIProvider.ANTHROPIC, api_key="key-a")
+        b = registry.get(APIProvider.ANTHROPIC, api_key="key-b")
+        c = registry.get(
+            APIProvider.ANTHROPIC, api_key="key-a", base_url="http://localhost:1"
+        )
+        assert a._client is b._client
+        assert c._client is not a._client
+        assert registry.stats()["pools"] == 2
+    finally:
+        registry.close()
+
+
+def test_lifecycle_hooks():
+    registry = ClientRegistry()
+    created, closed = mock.Mock(), mock.Mock()
+    registry.on_create(created)
+    registry.on_close(closed)
+
+    client = registry.get(APIProvider.ANTHROPIC, api_key="key")
+    registry.get(APIProvider.ANTHROPIC, api_key="key")
+    created.assert_called_once_with(
+        ClientKey(APIProvider.ANTHROPIC, "key", None), client
+    )
+
+    registry.close()
+    closed.assert_called_once_with(
+        ClientKey(APIProvider.ANTHROPIC, "key", None), client
+    )
+    assert client._client.is_closed
+    assert registry.stats()["clients"] == 0
+    # a new client after close() gets a fresh pool
+    assert registry.get(APIProvider.ANTHROPIC, api_key="key") is not client
+    registry.close()
+
+
+def test_http2_requires_h2():
+    with mock.patch("importlib.util.find_spec", return_value=None):
+        assert ClientRegistry(http2=True).http2 is False
@@ -3,6 +3,8 @@ from unittest import mock
 
 import pytest
 
+from computer_use_demo.clients import client_registry
+
 
 @pytest.fixture(autouse=True)
 def mock_screen_dimensions():
@@ -10,3 +12,10 @@ def mock_screen_dimensions():
         os.environ, {"HEIGHT": "768", "WIDTH": "1024", "DISPLAY_NUM": "1"}
     ):
         yield
+
+
+@pytest.fixture(autouse=True)
+def reset_client_registry():
+    # Clients are cached process-wide; don't let one test's mock leak into the next
+    yield
+    client_registry.close()
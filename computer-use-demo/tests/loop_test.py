@@ -1,9 +1,23 @@
+import asyncio
+import threading
+from typing import Any
 from unittest import mock
 
+import httpx
+import pytest
 from anthropic.types import TextBlock, ToolUseBlock
-from anthropic.types.beta import BetaMessage, BetaMessageParam, BetaTextBlockParam
+from anthropic.types.beta import (
+    BetaMessage,
+    BetaMessageParam,
+    BetaTextBlock,
+    BetaTextBlockParam,
+    BetaTextDelta,
+    BetaToolUseBlock,
+    BetaUsage,
+)
 
-from computer_use_demo.loop import APIProvider, sampling_loop
+from computer_use_demo.loop import APIProvider, _make_api_tool_result, sampling_loop
+from computer_use_demo.tools import ImageHandle, ToolCollection, ToolResult
 
 
 async def test_loop():
@@ -24,7 +38,7 @@ async def test_loop():
 
     tool_collection = mock.AsyncMock()
     tool_collection.run.return_value = mock.Mock(
-        output="Tool output", error=None, base64_image=None
+        output="Tool output", error=None, image=None
     )
 
     output_callback = mock.Mock()
@@ -32,7 +46,7 @@ async def test_loop():
     api_response_callback = mock.Mock()
 
     with mock.patch(
-        "computer_use_demo.loop.Anthropic", return_value=client
+        "computer_use_demo.clients.Anthropic", return_value=client
     ), mock.patch(
         "computer_use_demo.loop.ToolCollection", return_value=tool_collection
     ):
@@ -65,3 +79,423 @@ async def test_loop():
         assert output_callback.call_count == 3
         assert tool_output_callback.call_count == 1
         assert api_response_callback.call_count == 2
+
+
+async def test_loop_cancels_sibling_tools_when_one_raises():
+    client = mock.Mock()
+    client.beta.messages.with_raw_response.create.return_value.parse.return_value = (
+        mock.Mock(
+            spec=BetaMessage,
+            content=[
+                ToolUseBlock(type="tool_use", id="1", name="slow", input={}),
+                ToolUseBlock(type="tool_use", id="2", name="broken", input={}),
+            ],
+        )
+    )
+    slow_cancelled = asyncio.Event()
+
+    async def run_tool(*, name, tool_input):
+        if name == "broken":
+            raise RuntimeError("tool crashed")
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            slow_cancelled.set()
+            raise
+
+    tool_collection = mock.AsyncMock()
+    tool_collection.run.side_effect = run_tool
+
+    with mock.patch(
+        "computer_use_demo.clients.Anthropic", return_value=client
+    ), mock.patch(
+        "computer_use_demo.loop.ToolCollection", return_value=tool_collection
+    ):
+        with pytest.raises(RuntimeError, match="tool crashed"):
+            await sampling_loop(
+                model="test-model",
+                provider=APIProvider.ANTHROPIC,
+                system_prompt_suffix="",
+                messages=[{"role": "user", "content": "Test message"}],
+                output_callback=mock.Mock(),
+                tool_output_callback=mock.Mock(),
+                api_response_callback=mock.Mock(),
+                api_key="test-key",
+                tool_version="computer_use_20250124",
+            )
+    assert slow_cancelled.is_set()
+
+
+async def test_loop_step_callback():
+    client = mock.Mock()
+    client.beta.messages.with_raw_response.create.return_value = mock.Mock()
+    client.beta.messages.with_raw_response.create.return_value.parse.side_effect = [
+        mock.Mock(
+            spec=BetaMessage,
+            content=[
+                ToolUseBlock(
+                    type="tool_use", id="1", name="computer", input={"action": "test"}
+                ),
+            ],
+        ),
+        mock.Mock(spec=BetaMessage, content=[TextBlock(type="text", text="Done!")]),
+    ]
+
+    tool_collection = mock.AsyncMock()
+    tool_collection.run.return_value = mock.Mock(
+        output="Tool output", error=None, image=None, system=None
+    )
+    calls = []
+    step_callback = mock.AsyncMock(side_effect=lambda _: calls.append("step"))
+
+    async def tool_output_callback(result, tool_use_id):
+        # async callbacks finish before the step is reported
+        await asyncio.sleep(0.01)
+        calls.append(f"tool {tool_use_id}")
+
+    with mock.patch(
+        "computer_use_demo.clients.Anthropic", return_value=client
+    ), mock.patch(
+        "computer_use_demo.loop.ToolCollection", return_value=tool_collection
+    ):
+        messages: list[BetaMessageParam] = [{"role": "user", "content": "Test message"}]
+        result = await sampling_loop(
+            model="test-model",
+            provider=APIProvider.ANTHROPIC,
+            system_prompt_suffix="",
+            messages=messages,
+            output_callback=mock.Mock(),
+            tool_output_callback=tool_output_callback,
+            api_response_callback=mock.Mock(),
+            api_key="test-key",
+            tool_version="computer_use_20250124",
+            step_callback=step_callback,
+        )
+
+    assert step_callback.await_count == 2
+    first_step, second_step = (call.args[0] for call in step_callback.await_args_list)
+    assert [m["role"] for m in first_step] == ["assistant", "user"]
+    assert first_step[1]["content"][0]["type"] == "tool_result"
+    assert second_step == result[-1:]
+    # every message after the prompt was reported exactly once, in order
+    assert first_step + second_step == result[1:]
+    assert calls == ["tool 1", "step", "step"]
+
+
+class FakeMessageStream:
+    """Stands in for the SDK's BetaMessageStream."""
+
+    def __init__(self, message: BetaMessage):
+        self.message = message
+        # Like the SDK's: a streaming response whose body is never read
+        self.response = httpx.Response(
+            200,
+            headers={"content-type": "text/event-stream", "request-id": message.id},
+            stream=httpx.ByteStream(b""),
+            request=httpx.Request("POST", "https://api.anthropic.com/v1/messages"),
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return None
+
+    def __iter__(self):
+        for index, block in enumerate(self.message.content):
+            if block.type == "text":
+                for start in range(0, len(block.text), 3):
+                    yield mock.Mock(
+                        type="content_block_delta",
+                        index=index,
+                        delta=BetaTextDelta(
+                            type="text_delta", text=block.text[start : start + 3]
+                        ),
+                    )
+            yield mock.Mock(type="content_block_stop", index=index, content_block=block)
+        yield mock.Mock(type="message_stop")
+
+    def get_final_message(self):
+        return self.message
+
+
+async def test_loop_streaming():
+    responses = [
+        BetaMessage(
+            id="1",
+            type="message",
+            role="assistant",
+            model="test-model",
+            content=[
+                BetaTextBlock(type="text", text="Hello there"),
+                BetaToolUseBlock(
+                    type="tool_use", id="1", name="computer", input={"action": "test"}
+                ),
+            ],
+            stop_reason="tool_use",
+            usage=BetaUsage(input_tokens=1, output_tokens=1),
+        ),
+        BetaMessage(
+            id="2",
+            type="message",
+            role="assistant",
+            model="test-model",
+            content=[BetaTextBlock(type="text", text="Done!")],
+            stop_reason="end_turn",
+            usage=BetaUsage(input_tokens=1, output_tokens=1),
+        ),
+    ]
+    streams = [FakeMessageStream(message) for message in responses]
+    client = mock.Mock()
+    client.beta.messages.stream.side_effect = streams
+
+    events: list[tuple[str, Any]] = []
+    tool_collection = mock.AsyncMock()
+
+    async def run_tool(**kwargs):
+        events.append(("tool", kwargs["name"]))
+        return mock.Mock(output="Tool output", error=None, image=None)
+
+    tool_collection.run.side_effect = run_tool
+    api_response_callback = mock.Mock()
+
+    with mock.patch(
+        "computer_use_demo.clients.Anthropic", return_value=client
+    ), mock.patch(
+        "computer_use_demo.loop.ToolCollection", return_value=tool_collection
+    ):
+        messages: list[BetaMessageParam] = [{"role": "user", "content": "Test message"}]
+        result = await sampling_loop(
+            model="test-model",
+            provider=APIProvider.ANTHROPIC,
+            system_prompt_suffix="",
+            messages=messages,
+            output_callback=lambda block: events.append(("block", block["type"])),
+            tool_output_callback=mock.Mock(),
+            api_response_callback=api_response_callback,
+            api_key="test-key",
+            tool_version="computer_use_20250124",
+            stream=True,
+            delta_callback=lambda delta: events.append(("delta", delta["text"])),
+        )
+
+    assert client.beta.messages.stream.call_count == 2
+    assert not client.beta.messages.with_raw_response.create.called
+    assert [m["role"] for m in result] == ["user", "assistant", "user", "assistant"]
+    assert result[1]["content"][0] == {"type": "text", "text": "Hello there"}
+    assert result[1]["content"][1]["name"] == "computer"
+    assert events == [
+        ("delta", "Hel"),
+        ("delta", "lo "),
+        ("delta", "the"),
+        ("delta", "re"),
+        ("block", "text"),
+        ("block", "tool_use"),
+        ("tool", "computer"),
+        ("delta", "Don"),
+        ("delta", "e!"),
+        ("block", "text"),
+    ]
+    assert [
+        (call.args[0], call.args[1].headers["request-id"], call.args[2])
+        for call in api_response_callback.call_args_list
+    ] == [
+        (streams[0].response.request, "1", None),
+        (streams[1].response.request, "2", None),
+    ]
+
+
+async def test_loop_streaming_response_body_is_readable():
+    message = BetaMessage(
+        id="1",
+        type="message",
+        role="assistant",
+        model="test-model",
+        content=[BetaTextBlock(type="text", text="Done!")],
+        stop_reason="end_turn",
+        usage=BetaUsage(input_tokens=1, output_tokens=1),
+    )
+    client = mock.Mock()
+    client.beta.messages.stream.return_value = FakeMessageStream(message)
+    bodies = []
+
+    def api_response_callback(request, response, error):
+        # What the Streamlit app and the API server's callback do
+        bodies.append((response.status_code, response.text))
+
+    with mock.patch("computer_use_demo.clients.Anthropic", return_value=client):
+        await sampling_loop(
+            model="test-model",
+            provider=APIProvider.ANTHROPIC,
+            system_prompt_suffix="",
+            messages=[{"role": "user", "content": "Test message"}],
+            output_callback=mock.Mock(),
+            tool_output_callback=mock.Mock(),
+            api_response_callback=api_response_callback,
+            api_key="test-key",
+            tool_version="computer_use_20250124",
+            stream=True,
+        )
+
+    [(status, text)] = bodies
+    assert status == 200
+    assert BetaMessage.model_validate_json(text) == message
+
+
+class GatedMessageStream(FakeMessageStream):
+    """Holds back the rest of the message after each tool_use block until
+    `released` is set, like a model that is still generating."""
+
+    def __init__(self, message: BetaMessage, released: threading.Event):
+        super().__init__(message)
+        self.released = released
+        self.waited: list[bool] = []
+
+    def __iter__(self):
+        for event in super().__iter__():
+            yield event
+            if event.type == "content_block_stop" and event.content_block.type == (
+                "tool_use"
+            ):
+                self.waited.append(self.released.wait(timeout=5))
+                self.released.clear()
+
+
+async def test_loop_streaming_runs_tools_before_message_ends():
+    tool_uses = [
+        BetaToolUseBlock(
+            type="tool_use", id=str(i), name="computer", input={"action": str(i)}
+        )
+        for i in range(3)
+    ]
+    responses = [
+        BetaMessage(
+            id="1",
+            type="message",
+            role="assistant",
+            model="test-model",
+            content=[
+                tool_uses[0],
+                BetaTextBlock(type="text", text="and"),
+                *tool_uses[1:],
+            ],
+            stop_reason="tool_use",
+            usage=BetaUsage(input_tokens=1, output_tokens=1),
+        ),
+        BetaMessage(
+            id="2",
+            type="message",
+            role="assistant",
+            model="test-model",
+            content=[BetaTextBlock(type="text", text="Done!")],
+            stop_reason="end_turn",
+            usage=BetaUsage(input_tokens=1, output_tokens=1),
+        ),
+    ]
+    released = threading.Event()
+    stream = GatedMessageStream(responses[0], released)
+    client = mock.Mock()
+    client.beta.messages.stream.side_effect = [
+        stream,
+        FakeMessageStream(responses[1]),
+    ]
+
+    ran: list[str] = []
+    tool_collection = mock.AsyncMock()
+
+    async def run_tool(**kwargs):
+        action = kwargs["tool_input"]["action"]
+        released.set()
+        # later tools finish first if they run concurrently
+        await asyncio.sleep(0.15 - 0.05 * int(action))
+        ran.append(action)
+        return mock.Mock(output=f"out {action}", error=None, image=None, system=None)
+
+    tool_collection.run.side_effect = run_tool
+    tool_output_callback = mock.Mock()
+
+    with mock.patch(
+        "computer_use_demo.clients.Anthropic", return_value=client
+    ), mock.patch(
+        "computer_use_demo.loop.ToolCollection", return_value=tool_collection
+    ):
+        messages: list[BetaMessageParam] = [{"role": "user", "content": "Test message"}]
+        result = await sampling_loop(
+            model="test-model",
+            provider=APIProvider.ANTHROPIC,
+            system_prompt_suffix="",
+            messages=messages,
+            output_callback=mock.Mock(),
+            tool_output_callback=tool_output_callback,
+            api_response_callback=mock.Mock(),
+            api_key="test-key",
+            tool_version="computer_use_20250124",
+            stream=True,
+        )
+
+    # every tool started while the stream was held back after its block
+    assert stream.waited == [True, True, True]
+    # the tools overlapped, so the later (shorter) ones finished first
+    assert ran != ["0", "1", "2"]
+    assert sorted(ran) == ["0", "1", "2"]
+    tool_results = result[2]["content"]
+    assert [block["tool_use_id"] for block in tool_results] == ["0", "1", "2"]
+    assert [block["content"][0]["text"] for block in tool_results] == [
+        "out 0",
+        "out 1",
+        "out 2",
+    ]
+    assert [call.args[1] for call in tool_output_callback.call_args_list] == [
+        "0",
+        "1",
+        "2",
+    ]
+
+
+async def test_loop_image_encoding():
+    client = mock.Mock()
+    client.beta.messages.with_raw_response.create.return_value.parse.return_value = (
+        mock.Mock(spec=BetaMessage, content=[TextBlock(type="text", text="Hi")])
+    )
+    collections = []
+
+    def make_collection(*tools):
+        collections.append(ToolCollection(*tools))
+        return collections[-1]
+
+    with mock.patch(
+        "computer_use_demo.clients.Anthropic", return_value=client
+    ), mock.patch("computer_use_demo.loop.ToolCollection", side_effect=make_collection):
+        for image_encoding in (None, "jpeg:60"):
+            await sampling_loop(
+                model="test-model",
+                provider=APIProvider.ANTHROPIC,
+                system_prompt_suffix="",
+                messages=[{"role": "user", "content": "Test message"}],
+                output_callback=mock.Mock(),
+                tool_output_callback=mock.Mock(),
+                api_response_callback=mock.Mock(),
+                api_key="test-key",
+                tool_version="computer_use_20250124",
+                image_encoding=image_encoding,
+            )
+
+    # the tool version's default, then the session's choice
+    assert [str(c.tool_map["computer"].image_encoding) for c in collections] == [
+        "png",
+        "jpeg:60",
+    ]
+
+
+def test_tool_result_image():
+    image = ImageHandle(b"img", "image/webp")
+    result = _make_api_tool_result(ToolResult(image=image), "1")
+    assert result["content"][0]["source"] == {
+        "type": "base64",
+        "media_type": "image/webp",
+        "data": "aW1n",
+    }
+    # encoded once, and the payload holds that same string
+    assert result["content"][0]["source"]["data"] is image.base64
+    result = _make_api_tool_result(ToolResult(image=ImageHandle(b"img")), "1")
+    assert result["content"][0]["source"]["media_type"] == "image/png"
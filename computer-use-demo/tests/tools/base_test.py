@@ -0,0 +1,37 @@
+import base64
+
+import pytest
+
+from computer_use_demo.tools.base import ImageHandle, ToolResult
+
+
+def test_image_handle_encodes_once():
+    image = ImageHandle(b"png bytes")
+    assert image._base64 is None
+    encoded = image.base64
+    assert encoded == base64.b64encode(b"png bytes").decode()
+    assert image.base64 is encoded
+    assert len(image) == 9
+    assert repr(image) == "ImageHandle('image/png', 9 bytes)"
+
+
+def test_image_handle_from_base64():
+    encoded = base64.b64encode(b"jpeg bytes").decode()
+    image = ImageHandle.from_base64(encoded, "image/jpeg")
+    assert image == ImageHandle(b"jpeg bytes", "image/jpeg")
+    assert image != ImageHandle(b"jpeg bytes", "image/png")
+    # the given string is reused, not encoded again
+    assert image.base64 is encoded
+
+
+def test_tool_result_image():
+    image = ImageHandle(b"png bytes")
+    result = ToolResult(output="out", image=image)
+    assert result.base64_image is image.base64
+    assert ToolResult(output="out").base64_image is None
+    assert ToolResult(image=image)
+
+    combined = ToolResult(output="a") + ToolResult(output="b", image=image)
+    assert combined.output == "ab" and combined.image is image
+    with pytest.raises(ValueError):
+        result + ToolResult(image=image)
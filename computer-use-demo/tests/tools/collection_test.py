@@ -0,0 +1,131 @@
+import asyncio
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+
+from computer_use_demo.tools import (
+    BashTool20250124,
+    ComputerTool20250124,
+    EditTool20250124,
+    ToolCollection,
+)
+from computer_use_demo.tools.base import ToolResult
+
+
+@pytest.fixture
+def tools():
+    return ComputerTool20250124(), EditTool20250124(), BashTool20250124()
+
+
+def recorder(events: list, delays: dict[str, float]):
+    """A tool __call__ that records when each call starts and ends, labelled by
+    its action, command or path."""
+
+    async def call(self, **kwargs):
+        label = kwargs.get("path") or kwargs.get("action") or kwargs.get("command")
+        events.append(("start", label))
+        await asyncio.sleep(delays.get(label, 0))
+        events.append(("end", label))
+        return ToolResult(output=label)
+
+    return call
+
+
+def test_concurrency_keys(tools):
+    computer, edit, bash = tools
+    assert computer.concurrency_key(action="screenshot") == ("display", 1)
+    assert computer.concurrency_key(action="left_click") == ("display", 1)
+    assert edit.concurrency_key(command="view", path="/a") == ("path", Path("/a"))
+    assert edit.concurrency_key(command="view", path="/a") != edit.concurrency_key(
+        command="create", path="/b"
+    )
+    assert bash.concurrency_key(command="ls") == bash.concurrency_key(command="pwd")
+    assert bash.concurrency_key(command="ls") != BashTool20250124().concurrency_key(
+        command="ls"
+    )
+
+
+@pytest.mark.asyncio
+async def test_independent_calls_run_concurrently(tools):
+    collection = ToolCollection(*tools)
+    events = []
+    call = recorder(events, {"/a": 0.03, "/b": 0.01, "ls": 0.02})
+
+    with patch.object(EditTool20250124, "__call__", new=call), patch.object(
+        BashTool20250124, "__call__", new=call
+    ):
+        results = await asyncio.gather(
+            collection.run(
+                name="str_replace_editor", tool_input={"command": "view", "path": "/a"}
+            ),
+            collection.run(
+                name="str_replace_editor", tool_input={"command": "view", "path": "/b"}
+            ),
+            collection.run(name="bash", tool_input={"command": "ls"}),
+        )
+
+    # everything started before anything finished, and results keep call order
+    assert events[:3] == [("start", "/a"), ("start", "/b"), ("start", "ls")]
+    assert [result.output for result in results] == ["/a", "/b", "ls"]
+
+
+@pytest.mark.asyncio
+async def test_conflicting_calls_run_in_order(tools):
+    collection = ToolCollection(*tools)
+    events = []
+    # the first call of each pair is the slowest
+    call = recorder(events, {"screenshot": 0.03, "first": 0.02, "/a": 0.01})
+
+    with patch.object(ComputerTool20250124, "__call__", new=call), patch.object(
+        BashTool20250124, "__call__", new=call
+    ), patch.object(EditTool20250124, "__call__", new=call):
+        results = await asyncio.gather(
+            collection.run(name="computer", tool_input={"action": "screenshot"}),
+            collection.run(name="computer", tool_input={"action": "left_click"}),
+            collection.run(name="bash", tool_input={"command": "first"}),
+            collection.run(name="bash", tool_input={"command": "second"}),
+            collection.run(
+                name="str_replace_editor",
+                tool_input={"command": "create", "path": "/a", "file_text": ""},
+            ),
+            collection.run(
+                name="str_replace_editor", tool_input={"command": "view", "path": "/a"}
+            ),
+        )
+
+    assert [result.output for result in results] == [
+        "screenshot",
+        "left_click",
+        "first",
+        "second",
+        "/a",
+        "/a",
+    ]
+    assert events.index(("end", "screenshot")) < events.index(("start", "left_click"))
+    assert events.index(("end", "first")) < events.index(("start", "second"))
+    assert [kind for kind, label in events if label == "/a"] == [
+        "start",
+        "end",
+        "start",
+        "end",
+    ]
+    # the display, the shell and the file are independent of each other
+    assert events[:3] == [("start", "screenshot"), ("start", "first"), ("start", "/a")]
+
+
+@pytest.mark.asyncio
+async def test_invalid_tool(tools):
+    result = await ToolCollection(*tools).run(name="nope", tool_input={})
+    assert result.error == "Tool nope is invalid"
+
+
+@pytest.mark.asyncio
+async def test_malformed_input_is_a_tool_failure(tools):
+    # The model left out the path: no key to lock on
+    result = await ToolCollection(*tools).run(
+        name="str_replace_editor", tool_input={"command": "view", "path": None}
+    )
+    assert result.error and result.error.startswith(
+        "Invalid input for str_replace_editor"
+    )
@@ -5,6 +5,7 @@ import pytest
 from computer_use_demo.tools.computer import (
     ComputerTool20241022,
     ComputerTool20250124,
+    ImageHandle,
     ScalingSource,
     ToolError,
     ToolResult,
@@ -36,12 +37,12 @@ async def test_computer_tool_type(computer_tool):
         ) as mock_screenshot,
     ):
         mock_shell.return_value = ToolResult(output="Text typed")
-        mock_screenshot.return_value = ToolResult(base64_image="base64_screenshot")
+        mock_screenshot.return_value = ToolResult(image=ImageHandle(b"screenshot"))
         result = await computer_tool(action="type", text="Hello, World!")
         assert mock_shell.call_count == 1
         assert "type --delay 12 -- 'Hello, World!'" in mock_shell.call_args[0][0]
         assert result.output == "Text typed"
-        assert result.base64_image == "base64_screenshot"
+        assert result.image == ImageHandle(b"screenshot")
 
 
 @pytest.mark.asyncio
@@ -49,10 +50,10 @@ async def test_computer_tool_screenshot(computer_tool):
     with patch.object(
         computer_tool, "screenshot", new_callable=AsyncMock
     ) as mock_screenshot:
-        mock_screenshot.return_value = ToolResult(base64_image="base64_screenshot")
+        mock_screenshot.return_value = ToolResult(image=ImageHandle(b"screenshot"))
         result = await computer_tool(action="screenshot")
         mock_screenshot.assert_called_once()
-        assert result.base64_image == "base64_screenshot"
+        assert result.image == ImageHandle(b"screenshot")
 
 
 @pytest.mark.asyncio
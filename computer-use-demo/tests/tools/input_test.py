@@ -0,0 +1,292 @@
+import shutil
+import subprocess
+import time
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+from Xlib import XK, X
+
+from computer_use_demo.tools.base import ToolError
+from computer_use_demo.tools.computer import ComputerTool20250124
+from computer_use_demo.tools.input import (
+    UnsupportedCommand,
+    XInput,
+    get_x_input,
+    parse_xdotool,
+)
+
+SHIFT, CTRL, RETURN = 50, 37, 36
+
+
+class FakeDisplay:
+    """A display with a US-style keymap for letters, Return and modifiers."""
+
+    keymap = {
+        **{
+            10 + i: (ord(c), ord(c.upper()))
+            for i, c in enumerate("abcdefghijklmnopqrstuvwxyz")
+        },
+        SHIFT: (XK.XK_Shift_L,),
+        CTRL: (XK.XK_Control_L,),
+        RETURN: (XK.XK_Return,),
+    }
+
+    def __init__(self, name=None):
+        self.name = name
+        self.syncs = 0
+        self.closed = False
+
+    def keysym_to_keycode(self, keysym):
+        return next((code for code, syms in self.keymap.items() if keysym in syms), 0)
+
+    def keysym_to_keycodes(self, keysym):
+        for code, syms in self.keymap.items():
+            if keysym in syms:
+                yield code, syms.index(keysym)
+
+    def sync(self):
+        self.syncs += 1
+
+    def screen(self):
+        root = MagicMock()
+        root.query_pointer.return_value = MagicMock(root_x=12, root_y=34, child=0)
+        return MagicMock(root=root)
+
+    def close(self):
+        self.closed = True
+
+
+def keycode(char):
+    return 10 + ord(char) - ord("a")
+
+
+@pytest.fixture
+def x_input():
+    events = []
+
+    def fake_input(display, event_type, detail=0, x=0, y=0):
+        events.append((event_type, (x, y) if event_type == X.MotionNotify else detail))
+
+    x_input = XInput(1)
+    with patch("computer_use_demo.tools.input.xdisplay.Display", FakeDisplay), patch(
+        "computer_use_demo.tools.input.xtest.fake_input", fake_input
+    ):
+        yield x_input, events
+    x_input.close()
+
+
+def test_parse_chains():
+    assert parse_xdotool("mousemove --sync 10 20") == [("mousemove", (10, 20, True))]
+    assert parse_xdotool(
+        " mousemove --sync 1 2 keydown shift click --repeat 3 5 keyup shift"
+    ) == [
+        ("mousemove", (1, 2, True)),
+        ("keydown", (["shift"], 12)),
+        ("click", (5, 3, 100)),
+        ("keyup", (["shift"], 12)),
+    ]
+    assert parse_xdotool("click --repeat 2 --delay 10 1") == [("click", (1, 2, 10))]
+    assert parse_xdotool("key -- ctrl+a Return") == [
+        ("key", (["ctrl+a", "Return"], 12))
+    ]
+    assert parse_xdotool("type --delay 12 -- 'hello world'") == [
+        ("type", ("hello world", 12))
+    ]
+    assert parse_xdotool("keydown a sleep 0.5 keyup a") == [
+        ("keydown", (["a"], 12)),
+        ("sleep", 0.5),
+        ("keyup", (["a"], 12)),
+    ]
+    assert parse_xdotool("getmouselocation --shell") == [("getmouselocation", None)]
+
+
+def test_parse_literal_arguments():
+    # After "--" command names are text, not the next command in the chain
+    assert parse_xdotool("type --delay 12 -- type") == [("type", ("type", 12))]
+    assert parse_xdotool("type -- key ctrl+a") == [("type", ("keyctrl+a", 12))]
+    assert parse_xdotool("type -- 'key ctrl+a'") == [("type", ("key ctrl+a", 12))]
+    assert parse_xdotool("key -- ctrl+a click") == [("key", (["ctrl+a", "click"], 12))]
+    # Without it, they still start the next command
+    assert parse_xdotool("type x key a") == [
+        ("type", ("x", 12)),
+        ("key", (["a"], 12)),
+    ]
+
+
+@pytest.mark.parametrize(
+    "command",
+    [
+        "search --name firefox",
+        "mousemove --window 1 10 20",
+        "mousemove 10",
+        "click",
+        "getmouselocation",
+        "type 'unbalanced",
+    ],
+)
+def test_parse_unsupported(command):
+    with pytest.raises(UnsupportedCommand):
+        parse_xdotool(command)
+
+
+@pytest.mark.asyncio
+async def test_mouse(x_input):
+    x_input, events = x_input
+    assert (
+        await x_input.run("mousemove --sync 10 20 click --repeat 2 --delay 0 1") == ""
+    )
+    assert events == [
+        (X.MotionNotify, (10, 20)),
+        (X.ButtonPress, 1),
+        (X.ButtonRelease, 1),
+        (X.ButtonPress, 1),
+        (X.ButtonRelease, 1),
+    ]
+    assert (
+        await x_input.run("getmouselocation --shell")
+        == "X=12\nY=34\nSCREEN=0\nWINDOW=0\n"
+    )
+
+
+@pytest.mark.asyncio
+async def test_keys(x_input):
+    x_input, events = x_input
+    await x_input.run("key --delay 0 -- ctrl+a Return")
+    assert events == [
+        (X.KeyPress, CTRL),
+        (X.KeyPress, keycode("a")),
+        (X.KeyRelease, keycode("a")),
+        (X.KeyRelease, CTRL),
+        (X.KeyPress, RETURN),
+        (X.KeyRelease, RETURN),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_shifted_keys(x_input):
+    x_input, events = x_input
+    await x_input.run("key --delay 0 -- A ctrl+shift+T")
+    assert events == [
+        (X.KeyPress, SHIFT),
+        (X.KeyPress, keycode("a")),
+        (X.KeyRelease, keycode("a")),
+        (X.KeyRelease, SHIFT),
+        (X.KeyPress, CTRL),
+        (X.KeyPress, SHIFT),
+        (X.KeyPress, keycode("t")),
+        (X.KeyRelease, keycode("t")),
+        (X.KeyRelease, SHIFT),
+        (X.KeyRelease, CTRL),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_type(x_input):
+    x_input, events = x_input
+    await x_input.run("type --delay 0 -- 'hI\n'")
+    assert events == [
+        (X.KeyPress, keycode("h")),
+        (X.KeyRelease, keycode("h")),
+        (X.KeyPress, SHIFT),
+        (X.KeyPress, keycode("i")),
+        (X.KeyRelease, keycode("i")),
+        (X.KeyRelease, SHIFT),
+        (X.KeyPress, RETURN),
+        (X.KeyRelease, RETURN),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_unmapped_key_falls_back_before_any_input(x_input):
+    x_input, events = x_input
+    # é isn't on the fake keymap
+    assert await x_input.run("mousemove 1 1 type -- 'café'") is None
+    assert await x_input.run("key F13") is None
+    assert events == []
+    assert x_input.stats()["fallbacks"] == 2
+
+
+@pytest.mark.asyncio
+async def test_failure_after_input_is_an_error(x_input):
+    x_input, events = x_input
+    sent = []
+
+    def fake_input(display, event_type, detail=0, x=0, y=0):
+        if len(sent) == 2:
+            raise ConnectionResetError("display went away")
+        sent.append(event_type)
+
+    with patch("computer_use_demo.tools.input.xtest.fake_input", fake_input):
+        # Fails on the first event: nothing to repeat, so xdotool can run it
+        sent[:] = [X.MotionNotify, X.MotionNotify]
+        assert await x_input.run("click 1") is None
+        # Fails after the press went out: xdotool would click twice
+        sent.clear()
+        with pytest.raises(ToolError, match="part way through"):
+            await x_input.run("mousemove 1 1 click 1")
+    assert sent == [X.MotionNotify, X.ButtonPress]
+    assert x_input._display is None
+    stats = x_input.stats()
+    assert (stats["fallbacks"], stats["failures"], stats["commands"]) == (1, 1, 0)
+
+
+@pytest.mark.asyncio
+async def test_connection_failure_falls_back():
+    x_input = XInput(1)
+    try:
+        with patch(
+            "computer_use_demo.tools.input.xdisplay.Display",
+            side_effect=Exception("can't open display"),
+        ):
+            assert await x_input.run("mousemove 1 1") is None
+    finally:
+        x_input.close()
+
+
+@pytest.mark.asyncio
+async def test_tool_sends_xdotool_commands_in_process():
+    tool = ComputerTool20250124()
+    assert tool._input is get_x_input(1)
+    with patch.object(
+        tool._input, "run", AsyncMock(side_effect=["", None])
+    ) as x_input, patch(
+        "computer_use_demo.tools.computer.run", AsyncMock(return_value=(0, "out", ""))
+    ) as run:
+        in_process = await tool.shell(
+            "DISPLAY=:1 xdotool click 1", take_screenshot=False
+        )
+        fallback = await tool.shell(
+            "DISPLAY=:1 xdotool search x", take_screenshot=False
+        )
+        other = await tool.shell("echo hi", take_screenshot=False)
+
+    assert [call.args[0] for call in x_input.await_args_list] == ["click 1", "search x"]
+    assert in_process.output == "" and in_process.error == ""
+    assert [call.args[0] for call in run.await_args_list] == [
+        "DISPLAY=:1 xdotool search x",
+        "echo hi",
+    ]
+    assert fallback.output == other.output == "out"
+
+
+@pytest.fixture
+def xvfb_display():
+    if shutil.which("Xvfb") is None:
+        pytest.skip("Xvfb is not installed")
+    display = 98
+    xvfb = subprocess.Popen(["Xvfb", f":{display}", "-screen", "0", "640x480x24"])
+    time.sleep(1)
+    yield display
+    xvfb.terminate()
+    xvfb.wait()
+
+
+@pytest.mark.asyncio
+async def test_pointer_on_xvfb(xvfb_display):
+    x_input = XInput(xvfb_display)
+    try:
+        assert await x_input.run("mousemove --sync 100 200") == ""
+        location = await x_input.run("getmouselocation --shell")
+        assert location is not None and location.startswith("X=100\nY=200\n")
+    finally:
+        x_input.close()
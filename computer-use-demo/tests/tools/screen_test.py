@@ -0,0 +1,396 @@
+import io
+import shutil
+import subprocess
+import time
+from pathlib import Path
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+from PIL import Image
+
+from computer_use_demo.tools.computer import (
+    ComputerTool20250124,
+    ImageHandle,
+    ToolError,
+    ToolResult,
+)
+from computer_use_demo.tools.screen import (
+    PNG,
+    EncodeStats,
+    Encoding,
+    Frame,
+    FrameCache,
+    ScreenCapture,
+    SettleStats,
+    get_screen_capture,
+)
+
+
+def fake_mss(width=4, height=2):
+    """An mss.mss() factory whose grabs return a BGRA frame of one colour per row."""
+    rows = [bytes([255, 0, 0, 0]), bytes([0, 0, 255, 0])]  # blue, red
+    bgra = b"".join(rows[y % 2] * width for y in range(height))
+    sct = MagicMock()
+    sct.monitors = [{"left": 0, "top": 0, "width": width, "height": height}]
+    sct.grab.return_value = MagicMock(size=(width, height), bgra=bgra)
+    return MagicMock(return_value=sct)
+
+
+@pytest.fixture
+def capture():
+    capture = ScreenCapture(1)
+    yield capture
+    capture.close()
+
+
+@pytest.mark.asyncio
+async def test_grab(capture):
+    factory = fake_mss()
+    with patch("computer_use_demo.tools.screen.mss.mss", factory):
+        frame = await capture.grab()
+        await capture.grab()
+
+    assert frame.region is None
+    image = Image.open(io.BytesIO(frame.data))
+    assert image.size == (4, 2)
+    assert image.convert("RGB").getpixel((0, 0)) == (0, 0, 255)
+    assert image.convert("RGB").getpixel((0, 1)) == (255, 0, 0)
+    # one X connection for every capture
+    factory.assert_called_once_with(display=":1")
+    assert capture.stats()["captures"] == 2
+
+
+@pytest.mark.asyncio
+async def test_grab_resizes(capture):
+    with patch("computer_use_demo.tools.screen.mss.mss", fake_mss(8, 6)):
+        frame = await capture.grab((4, 3))
+    assert Image.open(io.BytesIO(frame.data)).size == (4, 3)
+
+
+@pytest.mark.asyncio
+async def test_grab_failure_reconnects(capture):
+    factory = fake_mss()
+    factory.return_value.grab.side_effect = [Exception("no display"), None]
+    with patch("computer_use_demo.tools.screen.mss.mss", factory):
+        assert await capture.grab() is None
+        factory.return_value.grab.side_effect = None
+        assert await capture.grab() is not None
+    assert factory.call_count == 2
+    assert capture.stats()["failures"] == 1
+
+
+@pytest.mark.asyncio
+async def test_grab_without_mss(capture):
+    with patch("computer_use_demo.tools.screen.mss", None):
+        assert await capture.grab() is None
+
+
+def test_encoding_parse():
+    for spec in ("png", "png:9", "png-palette", "png-palette:64", "jpeg:70", "webp"):
+        assert str(Encoding.parse(spec)) == spec
+    assert Encoding.parse(" JPEG:70 ") == Encoding("jpeg", 70)
+    assert Encoding.parse("webp").media_type == "image/webp"
+    assert Encoding.parse("png-palette").media_type == "image/png"
+    for spec in ("gif", "png:10", "png-palette:1", "jpeg:0", "webp:high"):
+        with pytest.raises(ValueError):
+            Encoding.parse(spec)
+
+
+@pytest.mark.parametrize(
+    "spec, image_format, mode",
+    [
+        ("png", "PNG", "RGB"),
+        ("png:1", "PNG", "RGB"),
+        ("png-palette:16", "PNG", "P"),
+        ("jpeg:60", "JPEG", "RGB"),
+        ("webp:60", "WEBP", "RGB"),
+    ],
+)
+@pytest.mark.asyncio
+async def test_grab_encodings(capture, spec, image_format, mode):
+    stats = EncodeStats()
+    encoding = Encoding.parse(spec)
+    with patch(
+        "computer_use_demo.tools.screen.mss.mss", frame_source(screen((0, 0, 9, 9)))
+    ), patch("computer_use_demo.tools.screen.encode_stats", stats):
+        frame = await capture.grab(encoding=encoding)
+
+    assert frame.media_type == encoding.media_type
+    image = Image.open(io.BytesIO(frame.data))
+    assert (image.format, image.mode, image.size) == (image_format, mode, (100, 100))
+    entry = stats.stats()[spec]
+    assert entry["count"] == 1 and entry["bytes_avg"] == len(frame.data)
+    assert entry["compression_ratio"] == 100 * 100 * 3 / len(frame.data)
+
+
+def test_encode_stats():
+    stats = EncodeStats()
+    stats.record("jpeg:70", 100, 30, 0.002)
+    stats.record("jpeg:70", 100, 10, 0.004)
+    assert stats.stats() == {
+        "jpeg:70": {
+            "count": 2,
+            "bytes_avg": 20.0,
+            "compression_ratio": 15.0,
+            "encode_avg_ms": 3.0,
+        }
+    }
+
+
+@pytest.mark.asyncio
+async def test_screenshot_encoding():
+    tool = ComputerTool20250124()
+    tool.image_encoding = Encoding.parse("webp:50")
+    frame = Frame(b"webp", media_type="image/webp")
+    with patch.object(tool._capture, "grab", AsyncMock(return_value=frame)) as grab:
+        result = await tool.screenshot()
+    assert grab.await_args.kwargs["encoding"] == Encoding("webp", 50)
+    assert result.image == ImageHandle(b"webp", "image/webp")
+
+
+def test_capture_shared_per_display():
+    assert get_screen_capture(1) is get_screen_capture(1)
+    assert get_screen_capture(1) is not get_screen_capture(2)
+    assert ComputerTool20250124()._capture is get_screen_capture(1)
+
+
+@pytest.mark.asyncio
+async def test_screenshot_uses_capture():
+    tool = ComputerTool20250124()
+    with patch.object(
+        tool._capture, "grab", AsyncMock(return_value=Frame(b"png"))
+    ) as grab, patch.object(tool, "shell", new_callable=AsyncMock) as shell:
+        result = await tool.screenshot()
+    grab.assert_awaited_once_with(
+        (1024, 768), frames=tool._frames, changes_only=False, crop=False, encoding=PNG
+    )
+    shell.assert_not_called()
+    assert result.image == ImageHandle(b"png")
+
+
+@pytest.mark.asyncio
+async def test_screenshot_falls_back_to_commands(tmp_path):
+    tool = ComputerTool20250124()
+
+    async def shell(command, take_screenshot=True):
+        if command.startswith("DISPLAY=:1 scrot -p "):
+            Path(command.split()[-1]).write_bytes(b"png")
+        return ToolResult(output="", error="")
+
+    with patch.object(tool._capture, "grab", AsyncMock(return_value=None)), patch(
+        "computer_use_demo.tools.computer.OUTPUT_DIR", str(tmp_path)
+    ), patch("shutil.which", return_value=None), patch.object(
+        tool, "shell", side_effect=shell
+    ) as mock_shell:
+        result = await tool.screenshot()
+
+    assert result.image == ImageHandle(b"png")
+    assert "convert" in mock_shell.call_args_list[-1].args[0]
+    # the temporary file is removed
+    assert list(tmp_path.iterdir()) == []
+
+
+def frame_source(*frames):
+    """An mss.mss() factory whose grabs return `frames` (PIL images) in turn."""
+    sct = MagicMock()
+    sct.monitors = [{}]
+    sct.grab.side_effect = [
+        MagicMock(size=frame.size, bgra=frame.convert("RGBA").tobytes("raw", "BGRA"))
+        for frame in frames
+    ]
+    return MagicMock(return_value=sct)
+
+
+def screen(*changes):
+    """A 100x100 white screen with black rectangles at `changes`."""
+    image = Image.new("RGB", (100, 100), "white")
+    for box in changes:
+        image.paste((0, 0, 0), box)
+    return image
+
+
+@pytest.mark.asyncio
+async def test_grab_changes_only(capture):
+    frames = FrameCache()
+    source = frame_source(screen(), screen(), screen((10, 10, 20, 20)), screen())
+    with patch("computer_use_demo.tools.screen.mss.mss", source):
+        first = await capture.grab(frames=frames, changes_only=True)
+        unchanged = await capture.grab(frames=frames, changes_only=True)
+        changed = await capture.grab(frames=frames, changes_only=True)
+        # without changes_only the frame is always sent, and still remembered
+        full = await capture.grab(frames=frames)
+
+    assert first.data is not None
+    assert unchanged == Frame(None)
+    assert changed.data is not None and changed.region is None
+    assert full.data is not None
+    assert frames.stats() == {"frames": 4, "unchanged": 1, "cropped": 0}
+
+
+@pytest.mark.asyncio
+async def test_grab_crops_to_changes(capture):
+    frames = FrameCache()
+    source = frame_source(screen(), screen((40, 50, 45, 60)), screen((0, 0, 90, 90)))
+    with patch("computer_use_demo.tools.screen.mss.mss", source):
+        await capture.grab(frames=frames, changes_only=True, crop=True)
+        small = await capture.grab(frames=frames, changes_only=True, crop=True)
+        large = await capture.grab(frames=frames, changes_only=True, crop=True)
+
+    # the changed box plus a margin, clipped to the screen
+    assert small.region == (24, 34, 61, 76)
+    assert Image.open(io.BytesIO(small.data)).size == (37, 42)
+    # most of the screen changed: sent whole
+    assert large.region is None
+    assert Image.open(io.BytesIO(large.data)).size == (100, 100)
+
+
+@pytest.mark.asyncio
+async def test_unchanged_screen_after_action():
+    tool = ComputerTool20250124()
+    tool._screenshot_delay = 0
+    tool._settle_quiet = None
+    source = frame_source(screen(), screen(), screen(), screen((0, 0, 10, 10)))
+    with patch("computer_use_demo.tools.screen.mss.mss", source), patch(
+        "computer_use_demo.tools.computer.run", AsyncMock(return_value=(0, "", ""))
+    ):
+        shown = await tool(action="screenshot")
+        moved = await tool(action="mouse_move", coordinate=[1, 1])
+        # an explicit screenshot is always sent
+        again = await tool(action="screenshot")
+        clicked = await tool(action="left_click")
+
+    assert shown.base64_image
+    assert moved.image is None
+    assert moved.output == (
+        "The screen has not changed since the last screenshot "
+        "(1 action(s) ago); no new screenshot."
+    )
+    assert again.base64_image
+    assert clicked.base64_image and not clicked.output
+
+
+@pytest.mark.asyncio
+async def test_screenshot_fallback_resets_frames():
+    tool = ComputerTool20250124()
+    tool._frames.image = screen()
+    with patch.object(tool._capture, "grab", AsyncMock(return_value=None)), patch(
+        "computer_use_demo.tools.computer.run", AsyncMock(return_value=(1, "", "err"))
+    ), pytest.raises(ToolError):
+        await tool.screenshot(changes_only=True)
+    assert tool._frames.image is None
+
+
+def changing_source(changes: int):
+    """An mss.mss() factory whose screen changes on each of the first `changes`
+    grabs and then stays the same."""
+    count = 0
+
+    def grab(monitor):
+        nonlocal count
+        count += 1
+        return MagicMock(size=(1, 1), bgra=bytes([min(count, changes + 1)] * 4))
+
+    sct = MagicMock()
+    sct.monitors = [{}]
+    sct.grab.side_effect = grab
+    return MagicMock(return_value=sct)
+
+
+@pytest.mark.asyncio
+async def test_settle(capture):
+    with patch("computer_use_demo.tools.screen.mss.mss", changing_source(3)):
+        waited, settled = await capture.settle(quiet=0.05, timeout=2, interval=0.01)
+    assert settled
+    # three changes 10ms apart, then 50ms quiet
+    assert 0.08 <= waited < 1
+
+
+@pytest.mark.asyncio
+async def test_settle_compares_downscaled_probes(capture):
+    # one changed pixel is enough, though probes are a 16th of the frame
+    source = frame_source(screen(), screen((50, 50, 51, 51)))
+    with patch("computer_use_demo.tools.screen.mss.mss", source):
+        before = capture._sample()
+        after = capture._sample()
+    assert len(before) == 25 * 25 * 3
+    assert before != after
+
+
+@pytest.mark.asyncio
+async def test_settle_times_out(capture):
+    with patch("computer_use_demo.tools.screen.mss.mss", changing_source(1000)):
+        waited, settled = await capture.settle(quiet=0.05, timeout=0.2, interval=0.01)
+    assert not settled
+    assert 0.2 <= waited < 0.4
+
+
+@pytest.mark.asyncio
+async def test_settle_without_screen(capture):
+    factory = fake_mss()
+    factory.return_value.grab.side_effect = Exception("no display")
+    with patch("computer_use_demo.tools.screen.mss.mss", factory):
+        assert await capture.settle(quiet=0.05, timeout=1, interval=0.01) is None
+
+
+@pytest.mark.asyncio
+async def test_tool_settles_after_action():
+    tool = ComputerTool20250124()
+    with patch.object(
+        tool._capture, "settle", AsyncMock(return_value=(0.25, True))
+    ) as settle, patch(
+        "computer_use_demo.tools.computer.settle_stats.record"
+    ) as record, patch("asyncio.sleep", new_callable=AsyncMock) as sleep, patch.object(
+        tool,
+        "screenshot",
+        AsyncMock(return_value=ToolResult(image=ImageHandle(b"img"))),
+    ), patch(
+        "computer_use_demo.tools.computer.run", AsyncMock(return_value=(0, "", ""))
+    ):
+        await tool(action="left_click")
+        settle.assert_awaited_once_with(quiet=0.3, timeout=2.0, interval=0.05)
+        record.assert_called_once_with("left_click", 0.25, True)
+        sleep.assert_not_awaited()
+
+        # without a readable screen, sleep the full delay as before
+        settle.return_value = None
+        await tool(action="left_click")
+        sleep.assert_awaited_once_with(2.0)
+
+
+def test_settle_stats():
+    stats = SettleStats()
+    stats.record("left_click", 0.2, True)
+    stats.record("left_click", 2.0, False)
+    assert stats.stats() == {
+        "left_click": {
+            "count": 2,
+            "timed_out": 1,
+            "wait_avg_ms": 1100.0,
+            "wait_max_ms": 2000.0,
+        }
+    }
+
+
+@pytest.fixture
+def xvfb_display():
+    if shutil.which("Xvfb") is None:
+        pytest.skip("Xvfb is not installed")
+    display = 97
+    xvfb = subprocess.Popen(["Xvfb", f":{display}", "-screen", "0", "640x480x24"])
+    yield display
+    xvfb.terminate()
+    xvfb.wait()
+
+
+@pytest.mark.asyncio
+async def test_grab_from_xvfb(xvfb_display):
+    capture = ScreenCapture(xvfb_display)
+    try:
+        deadline = time.monotonic() + 10
+        frame = None
+        while frame is None and time.monotonic() < deadline:
+            frame = await capture.grab((320, 240))
+        assert frame is not None
+        assert Image.open(io.BytesIO(frame.data)).size == (320, 240)
+    finally:
+        capture.close()
@@ -2,6 +2,11 @@
 const API_BASE = (window.API_BASE || '/api');
 
 async function fetchJson(url, options) {
+  return (await fetchJsonResponse(url, options)).data;
+}
+
+// Like fetchJson, but also returns the response headers (e.g. paging cursors)
+async function fetchJsonResponse(url, options) {
   const res = await fetch(url, options);
   const text = await res.text();
   const ct = res.headers.get('content-type') || '';
@@ -9,7 +14,7 @@ async function fetchJson(url, options) {
     throw new Error(`HTTP ${res.status}: ${text.slice(0, 200)}`);
   }
   if (ct.includes('application/json')) {
-    try { return JSON.parse(text); } catch (e) { throw new Error(`Invalid JSON: ${text.slice(0,200)}`); }
+    try { return { data: JSON.parse(text), headers: res.headers }; } catch (e) { throw new Error(`Invalid JSON: ${text.slice(0,200)}`); }
   }
   throw new Error(`Non-JSON response: ${text.slice(0, 200)}`);
 }
@@ -39,13 +44,70 @@ let ws = null;
 let vncUrl = '/novnc/vnc.html?autoconnect=true&resize=scale&path=novnc/websockify';
 let aspectRatio = 1024/768;
 let wsConnecting = false;
+// Highest event seq seen for the current session; sent as ?since= when reconnecting
+let lastSeq = 0;
+// Assistant message being filled in from assistant_delta events
+let liveText = null;
+// Paging cursors (null: nothing older): the session list's X-Next-Before
+// header and the current session's next_before
+let sessionsNextBefore = null;
+let messagesNextBefore = null;
 
-function addMessage(role, text) {
+function messageDiv(role, text) {
   const div = document.createElement('div');
   div.className = `msg ${role}`;
   div.textContent = `${role}: ${text}`;
+  return div;
+}
+
+function addMessage(role, text) {
+  const div = messageDiv(role, text);
   messagesEl.appendChild(div);
   messagesEl.scrollTop = messagesEl.scrollHeight;
+  return div;
+}
+
+function storedMessageDivs(messages) {
+  const divs = [];
+  messages.forEach(m => {
+    if (m.role === 'user' && m.content) divs.push(messageDiv('user', m.content));
+    if (m.role === 'assistant' && m.content_json) {
+      const textBlocks = (m.content_json || []).filter(b => b.type === 'text');
+      textBlocks.forEach(b => divs.push(messageDiv('assistant', b.text || '')));
+    }
+  });
+  return divs;
+}
+
+function loadOlderButton(label, onClick) {
+  const btn = document.createElement('button');
+  btn.className = 'preset load-older';
+  btn.textContent = label;
+  btn.addEventListener('click', onClick);
+  return btn;
+}
+
+// Stored messages come newest page first; older pages go above what is shown
+function showOlderMessagesButton() {
+  messagesEl.querySelector('.load-older')?.remove();
+  if (messagesNextBefore) messagesEl.prepend(loadOlderButton('Load older messages', loadOlderMessages));
+}
+
+async function loadOlderMessages() {
+  const sessionId = currentSessionId;
+  try {
+    const detail = await fetchJson(`${API_BASE}/sessions/${sessionId}?before=${encodeURIComponent(messagesNextBefore)}`);
+    if (sessionId !== currentSessionId) return;
+    messagesNextBefore = detail.next_before || null;
+    // Keep the messages in view where they are
+    const height = messagesEl.scrollHeight;
+    messagesEl.querySelector('.load-older')?.remove();
+    messagesEl.prepend(...storedMessageDivs(detail.messages || []));
+    showOlderMessagesButton();
+    messagesEl.scrollTop += messagesEl.scrollHeight - height;
+  } catch (e) {
+    appendStreamBubble('api', `[error] load messages: ${e.message || e}`);
+  }
 }
 
 function appendStreamBubble(kind, text, at) {
@@ -65,7 +127,7 @@ function appendStreamBubble(kind, text, at) {
 
 async function createSession() {
   // Immediately cut current VM view and WS before archiving
-  try { if (ws) { ws.close(); } } catch (_) {}
+  try { if (ws) { ws.close(); ws = null; } } catch (_) {}
   try { if (vncFrame) { vncFrame.src = 'about:blank'; } } catch (_) {}
 
   if (currentSessionId) {
@@ -80,10 +142,13 @@ async function createSession() {
   sessionIdEl.textContent = `Session: ${currentSessionId}`;
   // Stick to same-origin proxied noVNC for stability
   const vm = data.metadata_json?.vm;
-  if (vmMeta) vmMeta.textContent = '';
+  showVmStatus(vm);
   // reset UI before connecting
   messagesEl.innerHTML = '';
+  messagesNextBefore = null;
+  liveText = null;
   streamList.innerHTML = '';
+  lastSeq = 0;
   await connectWebSocketWithRetry();
   ensureVncFrame();
   await loadSessions();
@@ -114,9 +179,11 @@ async function connectWebSocketWithRetry() {
       } else if (t === 'tool_result') {
         // Render tool result; if image present, show below stream area
         appendStreamBubble('tool', `${msg.tool_use_id || ''}\n${(msg.data?.output || '').slice(0,800)}`, msg.at);
-        if (msg.data?.base64_image) {
+        const src = toolImageSrc(msg.data);
+        if (src) {
           const img = document.createElement('img');
-          img.src = `data:image/png;base64,${msg.data.base64_image}`;
+          img.loading = 'lazy';
+          img.src = src;
           img.style.maxWidth = '100%';
           img.style.border = '1px solid #333';
           const item = document.createElement('div');
@@ -172,7 +239,7 @@ async function sendMessage() {
 
 createSessionBtn.addEventListener('click', createSession);
 sendBtn.addEventListener('click', sendMessage);
-refreshSessionsBtn?.addEventListener('click', loadSessions);
+refreshSessionsBtn?.addEventListener('click', () => loadSessions());
 
 // Initialize VNC iframe on load
 ensureVncFrame();
@@ -185,7 +252,10 @@ async function connectWebSocketWithRetry(maxAttempts = 5, delayMs = 300) {
   for (let attempt = 1; attempt <= maxAttempts; attempt++) {
     try {
       try { if (ws) { ws.close(); ws = null; } } catch (_) {}
-      const url = API_BASE.replace('http', 'ws') + `/sessions/${currentSessionId}/stream`;
+      // Resume after the last event we saw; the server replays only what was missed
+      const sessionId = currentSessionId;
+      const since = lastSeq ? `?since=${lastSeq}` : '';
+      const url = API_BASE.replace('http', 'ws') + `/sessions/${sessionId}/stream${since}`;
       await new Promise((resolve, reject) => {
         let opened = false;
         const sock = new WebSocket(url);
@@ -194,7 +264,15 @@ async function connectWebSocketWithRetry(maxAttempts = 5, delayMs = 300) {
           try { const msg = JSON.parse(ev.data); handleStreamMessage(msg); } catch (e) {}
         };
         sock.onerror = (e) => { lastErr = e; try { sock.close(); } catch(_){}; };
-        sock.onclose = (e) => { if (!opened) reject(new Error(`WS closed before open (code=${e.code})`)); else appendStreamBubble('api', '[disconnected]'); };
+        sock.onclose = (e) => {
+          if (!opened) { reject(new Error(`WS closed before open (code=${e.code})`)); return; }
+          appendStreamBubble('api', '[disconnected]');
+          // Unexpected drop (not a session switch): reconnect and resume
+          if (ws === sock && currentSessionId === sessionId) {
+            ws = null;
+            setTimeout(() => connectWebSocketWithRetry(), delayMs);
+          }
+        };
       });
       wsConnecting = false;
       return;
@@ -209,6 +287,30 @@ async function connectWebSocketWithRetry(maxAttempts = 5, delayMs = 300) {
 
 function handleStreamMessage(msg) {
   const t = msg.type;
+  if (t === 'ping') {
+    // Heartbeat: answer so the server keeps the connection
+    try { ws?.send(JSON.stringify({ type: 'pong' })); } catch (_) {}
+    return;
+  }
+  if (t === 'pong' || t === 'subscribed' || t === 'unsubscribed' || t === 'filter') return;
+  if (t === 'resync') {
+    // Missed events can't be replayed; reload the stored history instead
+    reloadStoredEvents(msg.seq);
+    return;
+  }
+  if (t === 'assistant_delta') {
+    // Live text preview; not sequenced, the completed block follows as assistant_block
+    if (msg.data?.type !== 'text_delta') return;
+    if (!liveText) liveText = { el: addMessage('assistant', ''), text: '' };
+    liveText.text += msg.data.text || '';
+    liveText.el.textContent = `assistant: ${liveText.text}`;
+    messagesEl.scrollTop = messagesEl.scrollHeight;
+    return;
+  }
+  if (msg.seq) {
+    if (msg.seq <= lastSeq) return; // already rendered
+    lastSeq = msg.seq;
+  }
   if (t === 'user_message') {
     const content = msg.message?.content || '';
     addMessage('user', content);
@@ -216,26 +318,47 @@ function handleStreamMessage(msg) {
   } else if (t === 'assistant_block') {
     const block = msg.data;
     if (block?.type === 'text' && block.text) {
-      addMessage('assistant', block.text);
+      if (liveText) liveText.el.textContent = `assistant: ${block.text}`;
+      else addMessage('assistant', block.text);
     }
+    liveText = null;
     appendStreamBubble('assistant', JSON.stringify(block).slice(0, 500), msg.at);
   } else if (t === 'assistant_message') {
     appendStreamBubble('assistant', '[assistant_message]', msg.at);
   } else if (t === 'tool_result') {
     appendStreamBubble('tool', `${msg.tool_use_id || ''}\n${(msg.data?.output || '').slice(0,800)}`, msg.at);
-    if (msg.data?.base64_image) renderImageBubble(msg.data.base64_image, msg.at);
+    const src = toolImageSrc(msg.data);
+    if (src) renderImageBubble(src, msg.at);
   } else if (t === 'api') {
     appendStreamBubble('api', `${msg.data?.request?.method || ''} ${msg.data?.request?.url || ''} -> ${msg.data?.response?.status || ''}`, msg.at);
   } else if (t === 'assistant_done') {
     appendStreamBubble('assistant', '[assistant_done]', msg.at);
+  } else if (t === 'vm_status') {
+    showVmStatus(msg.data);
+    appendStreamBubble('api', `[vm] ${msg.data?.status || ''}${msg.data?.reason ? ` (${msg.data.reason})` : ''}`, msg.at);
   } else {
     appendStreamBubble('api', JSON.stringify(msg));
   }
 }
 
-function renderImageBubble(base64Image, at) {
+// VM lifecycle: pending until the container is up, stopped when archived or idle
+function showVmStatus(vm) {
+  if (!vmMeta) return;
+  const status = vm?.status;
+  vmMeta.textContent = status && status !== 'ready' ? `VM ${status}${vm.reason ? ` (${vm.reason})` : ''}` : '';
+}
+
+// Screenshots are served from the media store; older events may still carry inline base64
+function toolImageSrc(data) {
+  if (data?.image?.url) return `${API_BASE}${data.image.url}`;
+  if (data?.base64_image) return `data:image/png;base64,${data.base64_image}`;
+  return null;
+}
+
+function renderImageBubble(src, at) {
   const img = document.createElement('img');
-  img.src = `data:image/png;base64,${base64Image}`;
+  img.loading = 'lazy';
+  img.src = src;
   img.style.maxWidth = '100%';
   img.style.border = '1px solid #333';
   const item = document.createElement('div');
@@ -307,10 +430,13 @@ document.querySelectorAll('.preset').forEach(btn => {
   });
 });
 
-async function loadSessions() {
+// Most recently active first; `older` appends the next page
+async function loadSessions(older = false) {
   try {
-    const items = await fetchJson(`${API_BASE}/sessions`);
-    renderSessionList(items);
+    const url = older ? `${API_BASE}/sessions?before=${encodeURIComponent(sessionsNextBefore)}` : `${API_BASE}/sessions`;
+    const { data: items, headers } = await fetchJsonResponse(url);
+    sessionsNextBefore = headers.get('X-Next-Before');
+    renderSessionList(items, older);
     // Show hint if no Mongo events likely (heuristic: always show; backend no-ops if not configured)
     if (persistHint) persistHint.classList.remove('hidden');
   } catch (e) {
@@ -318,8 +444,9 @@ async function loadSessions() {
   }
 }
 
-function renderSessionList(items) {
-  sessionList.innerHTML = '';
+function renderSessionList(items, append = false) {
+  if (append) sessionList.querySelector('.load-older')?.remove();
+  else sessionList.innerHTML = '';
   items.forEach(s => {
     const el = document.createElement('div');
     el.className = 'session-item';
@@ -337,63 +464,55 @@ function renderSessionList(items) {
       try {
         const detail = await fetchJson(`${API_BASE}/sessions/${s.id}`);
         const vm = detail.session?.metadata_json?.vm || s.metadata_json?.vm;
-        if (vmMeta) vmMeta.textContent = '';
-        // render existing messages
+        showVmStatus(vm);
+        // render existing messages: the newest page, older ones on request
         messagesEl.innerHTML = '';
-        (detail.messages || []).forEach(m => {
-          if (m.role === 'user' && m.content) addMessage('user', m.content);
-          if (m.role === 'assistant' && m.content_json) {
-            const textBlocks = (m.content_json || []).filter(b => b.type === 'text');
-            textBlocks.forEach(b => addMessage('assistant', b.text || ''));
-          }
-        });
+        liveText = null;
+        messagesEl.append(...storedMessageDivs(detail.messages || []));
+        messagesNextBefore = detail.next_before || null;
+        showOlderMessagesButton();
+        messagesEl.scrollTop = messagesEl.scrollHeight;
         // render stored events (if available)
-        try {
-          const events = await fetchJson(`${API_BASE}/sessions/${s.id}/events`);
-          streamList.innerHTML = '';
-          events.forEach(ev => {
-            const t = ev.type;
-            if (t === 'user_message') {
-              appendStreamBubble('user', ev.message?.content || '', ev.at);
-            } else if (t === 'assistant_block') {
-              appendStreamBubble('assistant', JSON.stringify(ev.data).slice(0,500), ev.at);
-            } else if (t === 'tool_result') {
-              appendStreamBubble('tool', `${ev.tool_use_id || ''}\n${(ev.data?.output || '').slice(0,800)}`, ev.at);
-              if (ev.data?.base64_image) {
-                const img = document.createElement('img');
-                img.src = `data:image/png;base64,${ev.data.base64_image}`;
-                img.style.maxWidth = '100%';
-                img.style.border = '1px solid #333';
-                const item = document.createElement('div');
-                item.className = 'tl-item';
-                const time = document.createElement('div');
-                time.className = 'tl-time';
-                time.textContent = ev.at ? new Date(ev.at).toLocaleTimeString() : '';
-                const bubble = document.createElement('div');
-                bubble.className = 'tl-bubble tool';
-                bubble.appendChild(img);
-                item.appendChild(time);
-                item.appendChild(bubble);
-                streamList.appendChild(item);
-              }
-            } else if (t === 'api') {
-              appendStreamBubble('api', `${ev.data?.request?.method || ''} ${ev.data?.request?.url || ''} -> ${ev.data?.response?.status || ''}`, ev.at);
-            } else if (t === 'assistant_message') {
-              appendStreamBubble('assistant', '[assistant_message]', ev.at);
-            } else if (t === 'assistant_done') {
-              appendStreamBubble('assistant', '[assistant_done]', ev.at);
-            }
-          });
-        } catch (e) {
-          // ignore if events backend not configured
-          streamList.innerHTML = '';
-        }
+        lastSeq = 0;
+        await reloadStoredEvents(0);
       } catch (e) {}
       await connectWebSocketWithRetry();
       ensureVncFrame();
     });
     sessionList.appendChild(el);
   });
+  if (sessionsNextBefore) sessionList.appendChild(loadOlderButton('Load older sessions', () => loadSessions(true)));
+}
+
+// Render stored events from the event store (if configured) and resume from the newest
+async function reloadStoredEvents(seq) {
+  try {
+    const events = await fetchJson(`${API_BASE}/sessions/${currentSessionId}/events`);
+    streamList.innerHTML = '';
+    lastSeq = seq || 0;
+    events.forEach(ev => {
+      const t = ev.type;
+      if (t === 'user_message') {
+        appendStreamBubble('user', ev.message?.content || '', ev.at);
+      } else if (t === 'assistant_block') {
+        appendStreamBubble('assistant', JSON.stringify(ev.data).slice(0,500), ev.at);
+      } else if (t === 'tool_result') {
+        appendStreamBubble('tool', `${ev.tool_use_id || ''}\n${(ev.data?.output || '').slice(0,800)}`, ev.at);
+        const src = toolImageSrc(ev.data);
+        if (src) renderImageBubble(src, ev.at);
+      } else if (t === 'api') {
+        appendStreamBubble('api', `${ev.data?.request?.method || ''} ${ev.data?.request?.url || ''} -> ${ev.data?.response?.status || ''}`, ev.at);
+      } else if (t === 'assistant_message') {
+        appendStreamBubble('assistant', '[assistant_message]', ev.at);
+      } else if (t === 'assistant_done') {
+        appendStreamBubble('assistant', '[assistant_done]', ev.at);
+      }
+    });
+    events.forEach(ev => { if (ev.seq && ev.seq > lastSeq) lastSeq = ev.seq; });
+  } catch (e) {
+    // ignore if events backend not configured
+    streamList.innerHTML = '';
+  }
 }
 
 // initial load
@@ -0,0 +1,54 @@
+import os
+import tempfile
+import uuid
+
+# Settings are read when app modules are imported: point the app at
+# throwaway storage first
+_tmp = tempfile.mkdtemp(prefix="app-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{_tmp}/app.db"
+os.environ["MEDIA_DIR"] = os.path.join(_tmp, "media")
+os.environ["VM_POOL_SIZE"] = "0"
+os.environ.pop("MONGODB_URI", None)
+
+import httpx  # noqa: E402
+import pytest  # noqa: E402
+
+from app.database import Base, SessionLocal, engine, init_db  # noqa: E402
+from app.models.session import Session as SessionModel  # noqa: E402
+from app.services.conversation_cache import conversation_cache  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def fresh_db():
+    Base.metadata.drop_all(bind=engine)
+    init_db()
+    yield
+
+
+@pytest.fixture(autouse=True)
+def reset_conversation_cache():
+    yield
+    for session_id in list(conversation_cache._entries):
+        conversation_cache.invalidate(session_id)
+
+
+@pytest.fixture
+async def client():
+    from app.main import app
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        yield client
+
+
+@pytest.fixture
+def make_session():
+    def make(**fields) -> SessionModel:
+        fields.setdefault("status", "active")
+        session = SessionModel(id=str(uuid.uuid4()), **fields)
+        with SessionLocal(expire_on_commit=False) as db:
+            db.add(session)
+            db.commit()
+        return session
+
+    return make
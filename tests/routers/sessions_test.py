@@ -0,0 +1,108 @@
+from datetime import datetime, timedelta
+
+from app.database import SessionLocal
+from app.models.message import Message as MessageModel
+from app.models.session import Session as SessionModel
+
+START = datetime(2025, 1, 1)
+
+
+def add_messages(session_id, count):
+    with SessionLocal() as db:
+        for i in range(count):
+            db.add(
+                MessageModel(
+                    id=f"m{i:02}",
+                    session_id=session_id,
+                    role="user",
+                    content=str(i),
+                    created_at=START + timedelta(seconds=i),
+                    seq=i + 1,
+                )
+            )
+        db.commit()
+
+
+async def test_list_sessions_pages_with_cursor_header(client, make_session):
+    # Two sessions share an updated_at: the id breaks the tie
+    ids = [make_session(updated_at=START + timedelta(seconds=i // 2)).id for i in range(5)]
+    expected = sorted(ids, key=lambda i: (ids.index(i) // 2, i), reverse=True)
+
+    seen, before = [], None
+    while True:
+        params = {"limit": 2, **({"before": before} if before else {})}
+        response = await client.get("/sessions", params=params)
+        assert response.status_code == 200
+        seen += [session["id"] for session in response.json()]
+        before = response.headers.get("X-Next-Before")
+        if before is None:
+            break
+    assert seen == expected
+
+
+async def test_list_sessions_puts_recently_active_ones_first(client, make_session):
+    old = make_session(created_at=START, updated_at=START)
+    new = make_session(created_at=START + timedelta(days=1), updated_at=START + timedelta(days=1))
+    # Activity on the older session (e.g. a message queues a turn) bumps it
+    with SessionLocal() as db:
+        db.get(SessionModel, old.id).last_agent_state = {"state": "queued"}
+        db.commit()
+    response = await client.get("/sessions")
+    assert [session["id"] for session in response.json()] == [old.id, new.id]
+
+
+async def test_cursor_header_is_exposed_to_the_frontend(client, make_session):
+    make_session()
+    make_session()
+    response = await client.get(
+        "/sessions", params={"limit": 1}, headers={"Origin": "http://localhost:8080"}
+    )
+    assert response.headers["X-Next-Before"]
+    exposed = response.headers["Access-Control-Expose-Headers"]
+    assert "X-Next-Before" in [h.strip() for h in exposed.split(",")]
+
+
+async def test_get_session_pages_messages_oldest_first(client, make_session):
+    session = make_session()
+    add_messages(session.id, 5)
+
+    first = (await client.get(f"/sessions/{session.id}", params={"limit": 3})).json()
+    assert [m["content"] for m in first["messages"]] == ["2", "3", "4"]
+    second = (
+        await client.get(
+            f"/sessions/{session.id}",
+            params={"limit": 3, "before": first["next_before"], "fields": "summary"},
+        )
+    ).json()
+    assert [m["content"] for m in second["messages"]] == ["0", "1"]
+    assert second["next_before"] is None
+    assert all(m.get("content_json") is None for m in second["messages"])
+
+
+async def test_bad_cursor_is_rejected(client, make_session):
+    session = make_session()
+    response = await client.get(f"/sessions/{session.id}", params={"before": "yesterday,x"})
+    assert response.status_code == 400
+
+
+async def test_create_session_rejects_a_bad_screenshot_encoding(client):
+    for encoding in ["gif", "jpeg:101", 75]:
+        response = await client.post(
+            "/sessions", json={"metadata": {"screenshot_encoding": encoding}}
+        )
+        assert response.status_code == 422
+        assert "screenshot_encoding" in response.json()["detail"]
+    with SessionLocal() as db:
+        assert db.query(SessionModel).count() == 0
+
+
+async def test_create_session_accepts_a_screenshot_encoding(client, monkeypatch):
+    async def create(session_id):
+        return {"status": "pending"}
+
+    monkeypatch.setattr("app.routers.sessions.vm_controller.create", create)
+    response = await client.post(
+        "/sessions", json={"metadata": {"screenshot_encoding": "jpeg:70"}}
+    )
+    assert response.status_code == 200
+    assert response.json()["metadata_json"]["screenshot_encoding"] == "jpeg:70"
@@ -0,0 +1,236 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+
+from app.database import SessionLocal
+from app.models.message import Message as MessageModel
+from app.models.session import Session as SessionModel
+from app.routers import messages
+from app.services.agent_pool import (
+    AgentQueueFull,
+    AgentWorkerPool,
+    _set_agent_state,
+    agent_pool,
+    agent_state,
+)
+
+
+@pytest.fixture
+async def pool():
+    """A pool whose turns wait until the test finishes them."""
+    pool = AgentWorkerPool(max_workers=2, max_queued=10)
+    log = []
+    finish = {}
+
+    async def run_job(job):
+        log.append(("start", job.message_id))
+        finish[job.message_id] = asyncio.Event()
+        await finish[job.message_id].wait()
+        log.append(("end", job.message_id))
+
+    pool._run_job = run_job
+    yield pool, log, finish
+    await pool.stop()
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def stored_state(session_id):
+    with SessionLocal() as db:
+        return (db.get(SessionModel, session_id).last_agent_state or {}).get("state")
+
+
+async def test_turns_of_a_session_run_one_at_a_time(pool):
+    pool, log, finish = pool
+    # Queued before start: picked up once the workers are up
+    pool.submit("a", "a1")
+    pool.submit("a", "a2")
+    pool.submit("b", "b1")
+    await pool.start()
+    await settle()
+    # Sessions run side by side, a session's turns one after another
+    assert log == [("start", "a1"), ("start", "b1")]
+    assert pool.stats()["queued"] == 1
+
+    finish["b1"].set()
+    await settle()
+    assert "a2" not in finish
+    finish["a1"].set()
+    await settle()
+    assert log[-2:] == [("end", "a1"), ("start", "a2")]
+    finish["a2"].set()
+    await settle()
+    stats = pool.stats()
+    assert (stats["completed"], stats["queued"], stats["active_sessions"]) == (3, 0, 0)
+
+
+async def test_submit_rejects_at_max_queued():
+    pool = AgentWorkerPool(max_workers=1, max_queued=2)
+    pool.submit("a", "a1")
+    pool.submit("b", "b1")
+    assert pool.full()
+    with pytest.raises(AgentQueueFull):
+        pool.submit("c", "c1")
+    stats = pool.stats()
+    assert (stats["queued"], stats["submitted"], stats["rejected"]) == (2, 2, 1)
+
+
+async def test_failed_turns_dont_stop_the_session(pool):
+    pool, log, finish = pool
+    run_job = pool._run_job
+
+    async def fail_first(job):
+        if job.message_id == "a1":
+            raise RuntimeError("model error")
+        await run_job(job)
+
+    pool._run_job = fail_first
+    await pool.start()
+    pool.submit("a", "a1")
+    pool.submit("a", "a2")
+    await settle()
+    assert log == [("start", "a2")]
+    finish["a2"].set()
+    await settle()
+    assert (pool.stats()["failed"], pool.stats()["completed"]) == (1, 1)
+
+
+def add_message(session, message_id, minute, seq=None):
+    with SessionLocal() as db:
+        db.add(
+            MessageModel(
+                id=message_id,
+                session_id=session.id,
+                role="user",
+                content=message_id,
+                seq=seq,
+                created_at=datetime(2026, 1, 1, 12, minute),
+            )
+        )
+        db.commit()
+
+
+def queued_turns(pool):
+    return {
+        session_id: [job.message_id for job in queue]
+        for session_id, queue in pool._session_queues.items()
+    }
+
+
+async def test_recover_pending_requeues_every_queued_turn(make_session):
+    # Two turns queued behind each other
+    a = make_session(last_agent_state=agent_state("queued", "a2"))
+    add_message(a, "a1", 1)
+    add_message(a, "a2", 3)
+    # A follow-up queued behind a running turn
+    b = make_session(last_agent_state=agent_state("running", "b0"))
+    add_message(b, "b0", 0, seq=1)
+    add_message(b, "b1", 2)
+    running = make_session(last_agent_state=agent_state("running", "c0"))
+    add_message(running, "c0", 0, seq=1)
+    idle = make_session(last_agent_state=agent_state("idle", "d0"))
+    archived = make_session(status="archived")
+    add_message(archived, "e1", 1)
+    pool = AgentWorkerPool(max_workers=1, max_queued=10)
+
+    await pool._recover_pending()
+
+    assert queued_turns(pool) == {a.id: ["a1", "a2"], b.id: ["b1"]}
+    assert stored_state(a.id) == "queued"
+    # Running turns may have half executed: not replayed
+    assert stored_state(b.id) == "interrupted"
+    assert stored_state(running.id) == "interrupted"
+    assert stored_state(idle.id) == "idle"
+
+
+async def test_recover_pending_leaves_what_doesnt_fit_queued(make_session):
+    a = make_session(last_agent_state=agent_state("queued", "a2"))
+    add_message(a, "a1", 1)
+    add_message(a, "a2", 2)
+    b = make_session(last_agent_state=agent_state("queued", "b1"))
+    add_message(b, "b1", 3)
+    pool = AgentWorkerPool(max_workers=1, max_queued=1)
+
+    await pool._recover_pending()
+
+    assert queued_turns(pool) == {a.id: ["a1"]}
+    assert stored_state(a.id) == "queued"
+    assert stored_state(b.id) == "interrupted"
+    # Still without a position, so the next start finds them again
+    with SessionLocal() as db:
+        unplaced = db.query(MessageModel).filter(MessageModel.seq.is_(None))
+        assert {m.id for m in unplaced} == {"a1", "a2", "b1"}
+
+
+async def test_finished_turn_keeps_a_later_queued_marker(make_session):
+    session = make_session(last_agent_state=agent_state("queued", "m2"))
+    await _set_agent_state(session, "idle", "m1", keep_queued=True)
+    assert stored_state(session.id) == "queued"
+    await _set_agent_state(session, "running", "m2")
+    await _set_agent_state(session, "idle", "m2", keep_queued=True)
+    assert stored_state(session.id) == "idle"
+    assert session.last_agent_state["state"] == "idle"
+
+
+def record_broadcasts(monkeypatch):
+    broadcasts = []
+
+    async def broadcast(session_id, message):
+        broadcasts.append(message)
+
+    monkeypatch.setattr(messages.stream_manager, "broadcast", broadcast)
+    return broadcasts
+
+
+async def test_send_message_is_rejected_when_the_pool_is_full(
+    client, make_session, monkeypatch
+):
+    session = make_session()
+    monkeypatch.setattr(agent_pool, "max_queued", 0)
+    response = await client.post(f"/sessions/{session.id}/messages", json={"content": "hi"})
+    assert response.status_code == 429
+    with SessionLocal() as db:
+        assert db.query(MessageModel).filter_by(session_id=session.id).count() == 0
+
+
+async def test_send_message_marks_a_turn_rejected_at_submit(
+    client, make_session, monkeypatch
+):
+    session = make_session()
+
+    def submit(session_id, message_id):
+        raise AgentQueueFull("Agent queue is full (0 pending turns)")
+
+    # The queue filled up between the capacity check and the submit
+    monkeypatch.setattr(agent_pool, "submit", submit)
+    broadcasts = record_broadcasts(monkeypatch)
+    response = await client.post(f"/sessions/{session.id}/messages", json={"content": "hi"})
+    assert response.status_code == 429
+    assert stored_state(session.id) == "rejected"
+    # Listeners already saw the message: tell them it was dropped
+    assert [event["type"] for event in broadcasts] == ["user_message", "user_message_rejected"]
+    assert broadcasts[1]["message"]["id"] == broadcasts[0]["message"]["id"]
+    # Not left behind to be recovered as a queued turn
+    with SessionLocal() as db:
+        assert db.query(MessageModel).filter_by(session_id=session.id).count() == 0
+
+
+async def test_send_message_broadcasts_before_queueing_the_turn(
+    client, make_session, monkeypatch
+):
+    session = make_session()
+    broadcasts = record_broadcasts(monkeypatch)
+    seen_at_submit = []
+
+    def submit(session_id, message_id):
+        # An idle worker would start publishing agent events from here on
+        seen_at_submit.extend(event["type"] for event in broadcasts)
+
+    monkeypatch.setattr(agent_pool, "submit", submit)
+    response = await client.post(f"/sessions/{session.id}/messages", json={"content": "hi"})
+    assert response.status_code == 200
+    assert seen_at_submit == ["user_message"]
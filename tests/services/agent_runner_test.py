@@ -0,0 +1,143 @@
+import asyncio
+import threading
+
+import pytest
+from sqlalchemy import select
+
+from app.database import AsyncDB, SessionLocal
+from app.models.message import Message as MessageModel
+from app.services.agent_pool import agent_pool
+from app.services.agent_runner import db_add_messages_async, load_history
+from app.services.conversation_cache import conversation_cache
+from app.services.db_writer import db_writer
+
+
+def transcript(messages):
+    return [(m["role"], m["content"][0]["text"]) for m in messages]
+
+
+def stored_rows(session_id):
+    with SessionLocal() as db:
+        return list(
+            db.scalars(
+                select(MessageModel)
+                .where(MessageModel.session_id == session_id)
+                .order_by(MessageModel.seq)
+            )
+        )
+
+
+async def wait_idle(pool):
+    for _ in range(500):
+        stats = pool.stats()
+        if not stats["queued"] and not stats["running"]:
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError(f"agent pool still busy: {pool.stats()}")
+
+
+@pytest.fixture
+async def running_pool():
+    await db_writer.start()
+    await agent_pool.start()
+    yield agent_pool
+    await agent_pool.stop()
+    await db_writer.stop()
+
+
+@pytest.fixture
+def fake_loop(monkeypatch):
+    """Replaces the model: each turn answers "reply <n>" after `release` is set."""
+    seen = []
+    started = asyncio.Event()
+    release = asyncio.Event()
+
+    async def sampling_loop(*, messages, step_callback, **kwargs):
+        seen.append(transcript(messages))
+        turn = len(seen)
+        started.set()
+        await release.wait()
+        reply = [{"role": "assistant", "content": [{"type": "text", "text": f"reply {turn}"}]}]
+        await step_callback(reply)
+        return messages + reply
+
+    monkeypatch.setattr("app.services.agent_runner.sampling_loop", sampling_loop)
+    return seen, started, release
+
+
+async def test_message_sent_during_a_turn_follows_that_turns_steps(
+    client, make_session, running_pool, fake_loop
+):
+    seen, started, release = fake_loop
+    session = make_session()
+
+    first = await client.post(f"/sessions/{session.id}/messages", json={"content": "first"})
+    assert first.status_code == 200
+    await started.wait()
+    # Posted while turn 1 is still running: its steps are stored after this message
+    second = await client.post(f"/sessions/{session.id}/messages", json={"content": "second"})
+    assert second.status_code == 200
+    release.set()
+    await wait_idle(running_pool)
+
+    assert seen == [
+        [("user", "first")],
+        [("user", "first"), ("assistant", "reply 1"), ("user", "second")],
+    ]
+    rows = stored_rows(session.id)
+    assert [(row.role, row.seq) for row in rows] == [
+        ("user", 1),
+        ("assistant", 2),
+        ("user", 3),
+        ("assistant", 4),
+    ]
+
+    # Extending the cached history and rebuilding it from scratch agree
+    cached = await load_history(AsyncDB(), session.id, rows[-1])
+    conversation_cache.invalidate(session.id)
+    rebuilt = await load_history(AsyncDB(), session.id, rows[-1])
+    assert cached == rebuilt
+    assert transcript(rebuilt) == [
+        ("user", "first"),
+        ("assistant", "reply 1"),
+        ("user", "second"),
+        ("assistant", "reply 2"),
+    ]
+
+
+async def test_load_history_stops_at_the_given_message(make_session):
+    session = make_session()
+    rows = await db_add_messages_async(
+        session.id,
+        [("assistant", [{"type": "text", "text": str(i)}]) for i in range(4)],
+    )
+    db = AsyncDB()
+    assert transcript(await load_history(db, session.id, rows[1])) == [
+        ("assistant", "0"),
+        ("assistant", "1"),
+    ]
+    # Continues from the cached prefix
+    assert conversation_cache.get(session.id).high_water == rows[1].seq
+    assert transcript(await load_history(db, session.id, rows[3]))[2:] == [
+        ("assistant", "2"),
+        ("assistant", "3"),
+    ]
+    await db.close()
+
+
+async def test_load_history_converts_rows_off_the_event_loop(make_session, monkeypatch):
+    session = make_session()
+    rows = await db_add_messages_async(
+        session.id, [("assistant", [{"type": "text", "text": "hi"}])]
+    )
+    threads = []
+
+    def internalize(content):
+        threads.append(threading.current_thread())
+        return content
+
+    monkeypatch.setattr("app.services.agent_runner.media_store.internalize", internalize)
+    db = AsyncDB()
+    assert transcript(await load_history(db, session.id, rows[0])) == [("assistant", "hi")]
+    await db.close()
+    assert threads and threading.main_thread() not in threads
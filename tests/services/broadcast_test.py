@@ -0,0 +1,101 @@
+import asyncio
+
+import pytest
+
+from app.services.broadcast import MemoryBackend, MemoryBus, _QueuedPublisher
+
+
+async def settle():
+    # Let sequencers, bus deliveries and connection writers run
+    for _ in range(10):
+        await asyncio.sleep(0.01)
+
+
+def events(subscriber):
+    return [event for event in subscriber.websocket.sent if "seq" in event]
+
+
+@pytest.fixture
+async def nodes(make_manager):
+    bus = MemoryBus()
+    managers = [make_manager(backend=MemoryBackend(bus)) for _ in range(2)]
+    for manager in managers:
+        await manager.start()
+    yield managers
+    for manager in managers:
+        await manager.stop()
+
+
+async def test_two_nodes_publishing_for_one_session_never_reuse_a_seq(nodes, connect):
+    a, b = nodes
+    on_a, on_b = await connect(a, "s1"), await connect(b, "s1")
+
+    # An agent turn on node a, while node b broadcasts VM status
+    await a.open("s1")
+    for i in range(5):
+        a.publish("s1", {"type": "assistant_block", "n": f"a{i}"})
+        await b.broadcast("s1", {"type": "vm_status", "n": f"b{i}"})
+    a.publish_transient("s1", {"type": "assistant_delta", "n": "delta"})
+    a.close("s1")
+    await settle()
+
+    for subscriber in (on_a, on_b):
+        seqs = sorted(event["seq"] for event in events(subscriber))
+        assert seqs == list(range(1, 11))
+        assert {event["n"] for event in events(subscriber)} == {
+            *(f"a{i}" for i in range(5)),
+            *(f"b{i}" for i in range(5)),
+        }
+    # A node's own events keep their publish order, deltas included
+    sent = [event["n"] for event in on_a.websocket.sent if event["n"].startswith(("a", "d"))]
+    assert sent == ["a0", "a1", "a2", "a3", "a4", "delta"]
+    assert a.stats()["seq_errors"] == b.stats()["seq_errors"] == 0
+
+
+async def test_resume_on_another_node(nodes, connect):
+    a, b = nodes
+    on_a = await connect(a, "s1")
+    # b serves the session too, so it has been recording a's events
+    await connect(b, "s1")
+    for i in range(6):
+        await a.broadcast("s1", {"type": "note", "n": i})
+    await settle()
+    assert [event["seq"] for event in events(on_a)] == [1, 2, 3, 4, 5, 6]
+
+    # The client lost its connection to a after seq 4 and comes back on b
+    await on_a.close()
+    resumed = await connect(b, "s1", since=4)
+    await settle()
+    assert [event["seq"] for event in events(resumed)] == [5, 6]
+    await b.broadcast("s1", {"type": "note", "n": 6})
+    await settle()
+    assert [event["seq"] for event in events(resumed)] == [5, 6, 7]
+
+
+async def test_shared_seqs_continue_after_stored_events(nodes, stored_seqs):
+    a, b = nodes
+    seqs, _ = stored_seqs
+    # e.g. the backend lost its counters, but the event store has the session
+    seqs["s1"] = 20
+    first, second = {"type": "note"}, {"type": "note"}
+    await a.broadcast("s1", first)
+    await b.broadcast("s1", second)
+    assert (first["seq"], second["seq"]) == (21, 22)
+
+
+class StuckBackend(_QueuedPublisher):
+    name = "stuck"
+
+    async def _send(self, channel, payload):
+        await asyncio.Event().wait()
+
+
+async def test_outbox_is_bounded():
+    backend = StuckBackend("test_", max_queued=2)
+    await backend.start(lambda *args: None)
+    for seq in range(1, 6):
+        backend.publish("s1", seq, "note", "{}")
+    stats = backend.stats()
+    await backend.stop()
+    assert stats["queued"] == 2
+    assert stats["dropped"] == 3
@@ -0,0 +1,63 @@
+import json
+import threading
+from unittest import mock
+
+import pytest
+
+from app.services.stream_manager import StreamManager
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+        self.closed = None
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, frame):
+        self.sent.append(json.loads(frame))
+
+    async def close(self, code=1000):
+        self.closed = code
+
+
+@pytest.fixture
+def make_manager():
+    def make(**kwargs) -> StreamManager:
+        options = dict(
+            max_queued=100,
+            policy="drop",
+            replay_buffer=10,
+            replay_sessions=2,
+            replay_max_events=100,
+        )
+        return StreamManager(**{**options, **kwargs})
+
+    return make
+
+
+@pytest.fixture
+def connect():
+    """Subscribe a fake WebSocket connection; its frames are in `subscriber.websocket.sent`."""
+
+    async def connect(manager, session_id, since=None):
+        subscriber = await manager.accept(FakeWebSocket())
+        await manager.subscribe(subscriber, session_id, since)
+        return subscriber
+
+    return connect
+
+
+@pytest.fixture
+def stored_seqs():
+    """The event store's last seq per session; records the threads it is read on."""
+    seqs = {}
+    threads = []
+
+    def last_seq(session_id):
+        threads.append(threading.current_thread())
+        return seqs.get(session_id, 0)
+
+    with mock.patch("app.services.stream_manager.event_store.last_seq", side_effect=last_seq):
+        yield seqs, threads
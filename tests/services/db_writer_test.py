@@ -0,0 +1,72 @@
+import asyncio
+import uuid
+
+import pytest
+
+from app.database import SessionLocal
+from app.models.session import Session as SessionModel
+from app.services.db_writer import DBWriter
+
+
+@pytest.fixture
+async def writer():
+    writer = DBWriter(batch_size=10, serialize=True)
+    await writer.start()
+    yield writer
+    await writer.stop()
+
+
+def add_session(session_id):
+    def write(db):
+        db.add(SessionModel(id=session_id, status="active"))
+        return session_id
+
+    return write
+
+
+def stored_ids():
+    with SessionLocal() as db:
+        return {session.id for session in db.query(SessionModel)}
+
+
+async def test_pending_writes_are_group_committed(writer):
+    ids = [str(uuid.uuid4()) for _ in range(5)]
+    results = await asyncio.gather(*(writer.run(add_session(i)) for i in ids))
+    assert results == ids
+    assert stored_ids() == set(ids)
+    stats = writer.stats()
+    assert (stats["writes"], stats["commits"]) == (5, 1)
+
+
+async def test_a_failed_write_doesnt_fail_its_batch(writer):
+    def fail(db):
+        raise ValueError("bad write")
+
+    ids = [str(uuid.uuid4()) for _ in range(2)]
+    results = await asyncio.gather(
+        writer.run(add_session(ids[0])),
+        writer.run(fail),
+        writer.run(add_session(ids[1])),
+        return_exceptions=True,
+    )
+    assert results[0] == ids[0] and results[2] == ids[1]
+    assert isinstance(results[1], ValueError)
+    assert stored_ids() == set(ids)
+    stats = writer.stats()
+    # Retried one by one after the batch failed
+    assert (stats["writes"], stats["commits"], stats["failed"]) == (2, 2, 1)
+
+
+async def test_stop_flushes_pending_writes(writer):
+    session_id = str(uuid.uuid4())
+    pending = asyncio.create_task(writer.run(add_session(session_id)))
+    await asyncio.sleep(0)
+    await writer.stop()
+    assert await pending == session_id
+    assert stored_ids() == {session_id}
+
+    # Stopped: writes run directly again
+    other = str(uuid.uuid4())
+    assert await writer.run(add_session(other)) == other
+    assert writer.stats()["serialized"] is False
+    assert stored_ids() == {session_id, other}
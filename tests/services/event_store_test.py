@@ -0,0 +1,82 @@
+import asyncio
+
+import pytest
+
+from app.services.event_store import EventStore
+
+
+class FakeCollection:
+    def __init__(self):
+        self.batches = []
+
+    def insert_many(self, docs, ordered=True):
+        self.batches.append([doc["n"] for doc in docs])
+
+
+@pytest.fixture
+def store():
+    store = EventStore()
+    store.coll = FakeCollection()
+    store.batch_size = 3
+    store.flush_interval = 0.05
+    store.max_queued = 4
+    return store
+
+
+def stall(store):
+    """Give the store a buffer that nothing drains."""
+    store._queue = asyncio.Queue(maxsize=store.max_queued)
+
+
+async def test_appends_are_written_in_batches(store):
+    store.max_queued = 10
+    await store.start()
+    for n in range(7):
+        store.append("s1", {"n": n})
+    await asyncio.sleep(0.2)
+    assert store.coll.batches == [[0, 1, 2], [3, 4, 5], [6]]
+    await store.stop()
+    assert store.stats()["written"] == 7
+
+
+async def test_stop_flushes_buffered_events(store):
+    store.flush_interval = 60
+    await store.start()
+    for n in range(2):
+        store.append("s1", {"n": n})
+    await store.stop()
+    assert store.coll.batches == [[0, 1]]
+    assert store.stats()["queued"] == 0
+
+
+async def test_append_without_writer_inserts_inline(store):
+    store.append("s1", {"n": 0})
+    assert store.coll.batches == [[0]]
+
+
+@pytest.mark.parametrize("policy", ["drop", "block"])
+async def test_sync_append_drops_when_full(store, policy):
+    store.overflow_policy = policy
+    stall(store)
+    tasks = len(asyncio.all_tasks())
+    for n in range(6):
+        store.append("s1", {"n": n})
+    # No put task per event under either policy
+    assert len(asyncio.all_tasks()) <= tasks
+    assert store.stats()["queued"] == 4
+    assert store.stats()["dropped"] == 2
+
+
+async def test_append_async_waits_for_room_under_block(store):
+    store.overflow_policy = "block"
+    stall(store)
+    for n in range(4):
+        await store.append_async("s1", {"n": n})
+    blocked = asyncio.create_task(store.append_async("s1", {"n": 4}))
+    await asyncio.sleep(0.01)
+    assert not blocked.done()
+
+    assert [doc["n"] for doc in store._take_batch(2)] == [0, 1]
+    await asyncio.wait_for(blocked, 1)
+    assert [doc["n"] for doc in store._take_batch(5)] == [2, 3, 4]
+    assert store.stats()["dropped"] == 0
@@ -0,0 +1,80 @@
+import io
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import pytest
+from PIL import Image
+
+from app.services.media_store import MediaStore
+from computer_use_demo.tools.base import ImageHandle
+
+
+@pytest.fixture
+def store(tmp_path):
+    return MediaStore(str(tmp_path))
+
+
+def png(color="red"):
+    buf = io.BytesIO()
+    Image.new("RGB", (64, 32), color).save(buf, "PNG")
+    return buf.getvalue()
+
+
+def leftovers(store):
+    return [p for p in store.root.rglob("*") if p.name.endswith(".tmp")]
+
+
+def test_concurrent_puts_of_the_same_image(store):
+    data = png()
+    with ThreadPoolExecutor(8) as pool:
+        refs = list(pool.map(lambda _: store.put(data), range(32)))
+    assert len({ref["url"] for ref in refs}) == 1
+    assert store.read(refs[0]["sha256"]) == data
+    assert leftovers(store) == []
+
+
+def test_failed_write_leaves_no_temp_file(store):
+    with mock.patch("app.services.media_store.os.replace", side_effect=OSError("disk full")):
+        with pytest.raises(OSError):
+            store.put(b"data")
+    assert leftovers(store) == []
+
+    class Unsavable:
+        def save(self, *args, **kwargs):
+            raise OSError("encoder failed")
+
+    digest = store.put(png())["sha256"]
+    with mock.patch.object(Image.Image, "convert", return_value=Unsavable()):
+        with pytest.raises(OSError):
+            store.thumbnail(digest, 16)
+    assert leftovers(store) == []
+
+
+async def test_put_image_async_stores_in_a_worker_thread(store):
+    image = ImageHandle(png(), "image/png")
+    threads = []
+    put = store.put
+
+    def record(*args):
+        threads.append(threading.current_thread())
+        return put(*args)
+
+    with mock.patch.object(store, "put", side_effect=record):
+        ref = await store.put_image_async(image)
+        # remembered for the handle: neither call stores it again
+        assert await store.put_image_async(image) is ref
+        assert store.put_image(image) is ref
+    assert len(threads) == 1 and threads[0] is not threading.main_thread()
+    assert store.resolve_images({"image": image}) == {"image": ref}
+
+
+def test_thumbnail(store):
+    digest = store.put(png("blue"))["sha256"]
+    path, media_type = store.thumbnail(digest, 16)
+    assert media_type == "image/jpeg"
+    with Image.open(path) as thumb:
+        assert thumb.size == (16, 8)
+    assert store.thumbnail(digest, 16) == (path, media_type)
+    assert store.thumbnail("0" * 64, 16) is None
+    assert leftovers(store) == []
@@ -0,0 +1,61 @@
+import asyncio
+import threading
+
+
+async def test_seq_is_loaded_off_the_event_loop_when_a_stream_opens(
+    stored_seqs, make_manager, connect
+):
+    seqs, threads = stored_seqs
+    seqs["s1"] = 41
+    manager = make_manager()
+    subscriber = await connect(manager, "s1")
+    assert manager.current_seq("s1") == 41
+    assert threads and threading.main_thread() not in threads
+    message = {"type": "note"}
+    manager.publish("s1", message)
+    assert message["seq"] == 42
+    await manager.broadcast("s1", {"type": "note"})
+    assert manager.current_seq("s1") == 43
+    assert len(threads) == 1
+    assert manager.stats()["seq_loads_inline"] == 0
+    await subscriber.close()
+
+
+async def test_concurrent_opens_load_once(stored_seqs, make_manager):
+    seqs, threads = stored_seqs
+    seqs["s1"] = 7
+    manager = make_manager()
+    await asyncio.gather(*(manager.open("s1") for _ in range(5)))
+    assert len(threads) == 1
+    assert manager.current_seq("s1") == 7
+    for _ in range(5):
+        manager.close("s1")
+    assert manager.stats()["seq_sessions"] == 0
+
+
+async def test_seqs_are_evicted_with_the_last_user_and_ring(stored_seqs, make_manager, connect):
+    seqs, threads = stored_seqs
+    manager = make_manager(replay_sessions=2)
+    subscriber = await connect(manager, "quiet")
+
+    # Nothing published: the seq goes with the last subscription
+    await manager.unsubscribe(subscriber, "quiet")
+    assert "quiet" not in manager._seqs
+
+    # Published sessions keep their seq while their replay ring is kept
+    for session_id in ("a", "b"):
+        await manager.broadcast(session_id, {"type": "note"})
+    await manager.subscribe(subscriber, "c")
+    await manager.broadcast("c", {"type": "note"})
+    # "a" lost its ring to "c"; "c" is still subscribed
+    assert sorted(manager._seqs) == ["b", "c"]
+    await manager.broadcast("d", {"type": "note"})
+    assert sorted(manager._seqs) == ["c", "d"]
+    await manager.unsubscribe(subscriber, "c")
+    assert sorted(manager._seqs) == ["c", "d"]
+
+    # Reloaded when used again, continuing from what was stored
+    seqs["a"] = 1
+    await manager.broadcast("a", {"type": "note"})
+    assert manager.current_seq("a") == 2
+    await subscriber.close()
@@ -0,0 +1,215 @@
+import asyncio
+import itertools
+import threading
+from unittest import mock
+
+import pytest
+
+from app.services.vm_manager import VM_LABEL, VMManager
+
+
+class NotFound(Exception):
+    pass
+
+
+class FakeContainer:
+    def __init__(self, containers, container_id, labels, healthy):
+        self.containers = containers
+        self.id = container_id
+        self.labels = labels
+        self.healthy = healthy
+        self.removed = False
+        self.attrs = {}
+        self._publish_ports()
+
+    def _publish_ports(self):
+        port = next(self.containers.ports)
+        self.attrs = {
+            "NetworkSettings": {
+                "Ports": {
+                    "6080/tcp": [{"HostPort": str(port)}],
+                    "5900/tcp": [{"HostPort": str(port + 1)}],
+                }
+            }
+        }
+
+    def reload(self):
+        pass
+
+    def exec_run(self, cmd):
+        return mock.Mock(exit_code=0 if self.healthy else 1)
+
+    def stop(self, timeout=None):
+        self.healthy = False
+
+    def remove(self):
+        self.removed = True
+
+
+class FakeContainers:
+    """The docker SDK's `client.containers`, with scripted boot outcomes."""
+
+    def __init__(self):
+        self.created = []
+        self.ports = itertools.count(30000, 2)
+        # Health of the next boots; healthy once these run out
+        self.boots = []
+        # While set, `run` waits for it, like a slow image pull
+        self.gate = None
+
+    def run(self, image, name, labels, **kwargs):
+        if self.gate is not None:
+            self.gate.wait(5)
+        healthy = self.boots.pop(0) if self.boots else True
+        container = FakeContainer(self, f"c{len(self.created)}", labels, healthy)
+        self.created.append(container)
+        return container
+
+    def get(self, container_id):
+        for container in self.created:
+            if container.id == container_id and not container.removed:
+                return container
+        raise NotFound(container_id)
+
+    def live(self, role=None):
+        return [
+            c
+            for c in self.created
+            if not c.removed and (role is None or c.labels[VM_LABEL] == role)
+        ]
+
+
+@pytest.fixture
+def docker():
+    return mock.Mock(containers=FakeContainers())
+
+
+@pytest.fixture
+async def make_pool(docker):
+    managers = []
+
+    def make(pool_size=2, **options):
+        manager = VMManager(client=docker, image="desktop", pool_size=pool_size)
+        manager.health_timeout = 0.05
+        manager.health_interval = 0.01
+        manager.check_interval = 0.05
+        for name, value in options.items():
+            setattr(manager, name, value)
+        managers.append(manager)
+        return manager
+
+    with mock.patch("app.services.vm_manager.BOOT_RETRY_DELAY", 0.01):
+        yield make
+        for manager in managers:
+            await manager.stop()
+
+
+async def until(condition, timeout=2.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        if asyncio.get_running_loop().time() > deadline:
+            raise AssertionError("condition not met in time")
+        await asyncio.sleep(0.01)
+
+
+async def test_pool_fills_hands_out_and_refills(make_pool, docker):
+    manager = make_pool(pool_size=2)
+    await manager.start()
+    await until(lambda: manager.stats()["ready"] == 2)
+
+    info = await manager.acquire()
+    assert info["container_id"] in {c.id for c in docker.containers.live("pool")}
+    assert info["novnc_port"] and info["vnc_port"]
+    await until(lambda: manager.stats()["ready"] == 2)
+    stats = manager.stats()
+    assert (stats["hits"], stats["misses"], stats["booted"]) == (1, 0, 3)
+    assert len(docker.containers.live()) == 3
+
+
+async def test_empty_pool_falls_back_to_a_cold_start(make_pool, docker):
+    docker.containers.gate = threading.Event()
+    manager = make_pool(pool_size=1)
+    await manager.start()
+    cold = asyncio.create_task(manager.acquire())
+    await asyncio.sleep(0.05)
+    docker.containers.gate.set()
+    info = await cold
+    assert docker.containers.get(info["container_id"]).labels[VM_LABEL] == "session"
+    assert manager.stats()["misses"] == 1
+
+
+async def test_unhealthy_boots_are_dropped(make_pool, docker):
+    docker.containers.boots = [False, True]
+    manager = make_pool(pool_size=1)
+    await manager.start()
+    await until(lambda: manager.stats()["ready"] == 1)
+    first = docker.containers.created[0]
+    assert first.removed
+    assert manager.stats()["unhealthy"] == 1
+    assert (await manager.acquire())["container_id"] != first.id
+
+
+async def test_containers_that_die_in_the_pool_are_replaced(make_pool, docker):
+    manager = make_pool(pool_size=1)
+    await manager.start()
+    await until(lambda: manager.stats()["ready"] == 1)
+    idle = docker.containers.created[0]
+    idle.healthy = False
+    await until(lambda: idle.removed and manager.stats()["ready"] == 1)
+    assert manager.stats()["unhealthy"] == 1
+    assert manager.take_ready()["container_id"] != idle.id
+
+
+async def test_released_containers_are_never_reused(make_pool, docker):
+    manager = make_pool(pool_size=1, check_interval=60)
+    await manager.start()
+    await until(lambda: manager.stats()["ready"] == 1)
+    # Pool has room: still not put back, the session's files are in there
+    manager.pool_size = 2
+    session_vm = await asyncio.to_thread(manager.create_vm)
+    await manager.release(session_vm["container_id"])
+    assert [c.id for c in docker.containers.created if c.removed] == [
+        session_vm["container_id"]
+    ]
+    assert manager.stats()["destroyed"] == 1
+    manager._refill()
+    await until(lambda: manager.stats()["ready"] == 2)
+    assert session_vm["container_id"] not in [
+        info["container_id"] for info in manager._ready
+    ]
+
+
+async def test_stop_right_after_a_handout(make_pool, docker):
+    manager = make_pool(pool_size=1, check_interval=60)
+    await manager.start()
+    await until(lambda: manager.stats()["ready"] == 1)
+    # The handout wakes the filler just as stop() cancels it
+    handed_out = manager.take_ready()
+    await asyncio.wait_for(manager.stop(), timeout=2)
+    assert [c.id for c in docker.containers.live()] == [handed_out["container_id"]]
+
+
+async def test_stop_removes_unused_containers(make_pool, docker):
+    manager = make_pool(pool_size=2)
+    await manager.start()
+    await until(lambda: manager.stats()["ready"] == 2)
+    handed_out = await manager.acquire()
+    # The replacement is still booting when the app shuts down
+    docker.containers.gate = threading.Event()
+    await asyncio.sleep(0.05)
+    stopping = asyncio.create_task(manager.stop())
+    await asyncio.sleep(0.05)
+    docker.containers.gate.set()
+    await stopping
+
+    assert [c.id for c in docker.containers.live()] == [handed_out["container_id"]]
+    assert manager.stats()["ready"] == 0
+
+
+async def test_pool_is_off_by_default(docker):
+    manager = VMManager(client=docker, image="desktop")
+    assert manager.pool_size == 0 and not manager.pooled
+    await manager.start()
+    info = await manager.acquire()
+    assert docker.containers.get(info["container_id"]).labels[VM_LABEL] == "session"
+    await manager.stop()